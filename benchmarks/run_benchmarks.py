@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput benchmarks of the kumbhserial pipeline stages, on synthetic
+device output. Each stage runs in a separate process, so that its peak
+memory use can be measured.
+
+Usage:
+  run_benchmarks.py [-h] [--size MB] [--stage name]... [--output file]
+                    [--compare file]
+
+Options:
+  -s, --size MB        Size of the synthetic lanyard dump [default: 20]
+  -S, --stage name     Only run given stage, one of: read_file, framing,
+                       tracker, json, ndjson, sniffer, sniffer_batch, gps,
+                       end_to_end
+  -o, --output file    Store the results in given JSON file, for example
+                       to serve as a baseline.
+  -c, --compare file   Compare the results to a stored JSON file.
+  -h, --help           This help text
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from queue import Empty
+import docopt
+
+from kumbhserial.appenders import (Dumper, JsonListAppender,
+                                   JsonLinesAppender)
+from kumbhserial.framing import RecordFramer
+from kumbhserial.gps import GpsInterpreter
+from kumbhserial.interpreter import (SeparatedTrackerEntrySetJsonConverter,
+                                     TrackerInterpreter)
+from kumbhserial.processing import convert_file
+from kumbhserial.reader import read_file, iter_records
+from kumbhserial.sniffer import SnifferInterpreter, BatchSnifferInterpreter
+from kumbhserial.synthetic import gps_stream, lanyard_dump, sniffer_stream
+from kumbhserial.version import __version__
+
+
+class NullAppender(object):
+    """ Discards all data. """
+    def append(self, data):
+        pass
+
+    def done(self):
+        pass
+
+
+class ListAppender(object):
+    """ Keeps all data in a list. """
+    def __init__(self):
+        self.data = []
+
+    def append(self, data):
+        self.data.append(data)
+
+    def done(self):
+        pass
+
+
+def peak_rss():
+    """ Peak resident set size of the current process in bytes. """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def load_records(path, terminator=b'\r'):
+    return [bytes(r) for r in iter_records(path, terminator)]
+
+
+def bench_read_file(files, output_dir):
+    read_file(files['dump'], NullAppender())
+    return os.path.getsize(files['dump']), files['dump_records']
+
+
+def setup_framing(files):
+    """ The lanyard dump in chunks, as a serial port would return them. """
+    with open(files['dump'], 'rb') as f:
+        return list(iter(lambda: f.read(4096), b''))
+
+
+def bench_framing(chunks, output_dir):
+    path = os.path.join(output_dir, 'dump.txt')
+    dumper = Dumper(path, flush=False)
+    framer = RecordFramer(dumper)
+    for chunk in chunks:
+        framer.feed(chunk)
+    framer.flush()
+    dumper.done()
+    return sum(len(c) for c in chunks), framer.num_records
+
+
+def setup_tracker(files):
+    return load_records(files['dump'])
+
+
+def bench_tracker(records, output_dir):
+    interpreter = TrackerInterpreter(NullAppender())
+    for record in records:
+        interpreter.append(record)
+    interpreter.done()
+    return sum(len(r) for r in records), len(records)
+
+
+def setup_json(files):
+    records = ListAppender()
+    interpreter = TrackerInterpreter(
+        SeparatedTrackerEntrySetJsonConverter(records, NullAppender()))
+    read_file(files['dump'], interpreter)
+    return records.data
+
+
+def bench_json(records, output_dir):
+    path = os.path.join(output_dir, 'detections.json')
+    appender = JsonListAppender(Dumper(path, flush=False))
+    for record in records:
+        appender.append(record)
+    appender.done()
+    return os.path.getsize(path), len(records)
+
+
+def bench_ndjson(records, output_dir):
+    path = os.path.join(output_dir, 'detections.ndjson')
+    appender = JsonLinesAppender(Dumper(path, flush=False))
+    for record in records:
+        appender.append(record)
+    appender.done()
+    return os.path.getsize(path), len(records)
+
+
+def setup_sniffer(files):
+    return load_records(files['sniffer'])
+
+
+def bench_sniffer(records, output_dir):
+    interpreter = SnifferInterpreter(NullAppender())
+    for record in records:
+        interpreter.append(record)
+    interpreter.done()
+    return sum(len(r) for r in records), len(records)
+
+
+def bench_sniffer_batch(records, output_dir):
+    interpreter = BatchSnifferInterpreter(NullAppender())
+    for record in records:
+        interpreter.append(record)
+    interpreter.done()
+    return sum(len(r) for r in records), len(records)
+
+
+def setup_gps(files):
+    return load_records(files['gps'], terminator=b'#')
+
+
+def bench_gps(records, output_dir):
+    interpreter = GpsInterpreter('benchmark', NullAppender())
+    for record in records:
+        interpreter.append(record)
+    interpreter.done()
+    if interpreter.has_error():
+        raise ValueError(interpreter.errors[0])
+    return sum(len(r) for r in records), len(records)
+
+
+def bench_end_to_end(files, output_dir):
+    convert_file(files['dump'], os.path.join(output_dir, 'detection.json'),
+                 os.path.join(output_dir, 'system.json'))
+    return os.path.getsize(files['dump']), files['dump_records']
+
+
+# stage name: (setup function or None, benchmark function)
+STAGES = (
+    ('read_file', (None, bench_read_file)),
+    ('framing', (setup_framing, bench_framing)),
+    ('tracker', (setup_tracker, bench_tracker)),
+    ('json', (setup_json, bench_json)),
+    ('ndjson', (setup_json, bench_ndjson)),
+    ('sniffer', (setup_sniffer, bench_sniffer)),
+    ('sniffer_batch', (setup_sniffer, bench_sniffer_batch)),
+    ('gps', (setup_gps, bench_gps)),
+    ('end_to_end', (None, bench_end_to_end)),
+)
+
+
+def run_stage(name, files, output_dir, results):
+    """
+    Run a single stage and put its measurements in the results queue.
+    """
+    setup, bench = dict(STAGES)[name]
+    try:
+        data = setup(files) if setup is not None else files
+        setup_rss = peak_rss()
+        start = time.perf_counter()
+        num_bytes, num_lines = bench(data, output_dir)
+        duration = time.perf_counter() - start
+    except Exception as ex:
+        results.put({'stage': name,
+                     'error': '{0}: {1}'.format(type(ex).__name__, ex)})
+    else:
+        results.put({
+            'stage': name,
+            'seconds': duration,
+            'bytes': num_bytes,
+            'lines': num_lines,
+            'lines_per_second': num_lines / duration,
+            'mb_per_second': num_bytes / duration / 1e6,
+            'setup_peak_rss': setup_rss,
+            'peak_rss': peak_rss(),
+        })
+
+
+def generate(directory, size):
+    """
+    Generate synthetic device output.
+    :param directory: directory to write files to
+    :param size: size of the lanyard dump in bytes
+    :return: dict with file names and record counts
+    """
+    files = {
+        'dump': os.path.join(directory, 'dump.txt'),
+        'sniffer': os.path.join(directory, 'sniffer.txt'),
+        'gps': os.path.join(directory, 'gps.txt'),
+    }
+    with open(files['dump'], 'wb') as f:
+        files['dump_records'] = lanyard_dump(f, size)[1]
+    with open(files['sniffer'], 'wb') as f:
+        sniffer_stream(f, size // 40)
+    with open(files['gps'], 'wb') as f:
+        gps_stream(f, size // 70)
+    return files
+
+
+def print_results(results, baseline=None):
+    if baseline is not None:
+        baseline = {r['stage']: r for r in baseline['results']}
+    print('{0:<14} {1:>14} {2:>10} {3:>10} {4:>10}'
+          .format('stage', 'lines/s', 'MB/s', 'peak MiB', 'vs base'))
+    for r in results:
+        if 'error' in r:
+            print('{0:<14} failed: {1}'.format(r['stage'], r['error']))
+            continue
+        compared = ''
+        if baseline is not None and 'lines_per_second' in baseline.get(
+                r['stage'], {}):
+            compared = '{0:.2f}x'.format(
+                r['lines_per_second'] /
+                baseline[r['stage']]['lines_per_second'])
+        print('{0:<14} {1:>14,.0f} {2:>10.1f} {3:>10.1f} {4:>10}'
+              .format(r['stage'], r['lines_per_second'], r['mb_per_second'],
+                      r['peak_rss'] / 2 ** 20, compared))
+
+
+def main(argv=sys.argv[1:]):
+    arguments = docopt.docopt(__doc__, argv)
+    stages = arguments['--stage'] or [name for name, _ in STAGES]
+    for name in stages:
+        if name not in dict(STAGES):
+            sys.exit('Unknown stage {0}'.format(name))
+    size = int(float(arguments['--size']) * 1e6)
+
+    baseline = None
+    if arguments['--compare']:
+        with open(arguments['--compare']) as f:
+            baseline = json.load(f)
+
+    directory = tempfile.mkdtemp()
+    try:
+        print('Generating {0:.0f} MB of synthetic data...'.format(size / 1e6))
+        files = generate(directory, size)
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        results = []
+        for name in stages:
+            output_dir = tempfile.mkdtemp(dir=directory)
+            process = context.Process(target=run_stage,
+                                      args=(name, files, output_dir, queue))
+            process.start()
+            process.join()
+            try:
+                results.append(queue.get(timeout=1))
+            except Empty:
+                results.append({'stage': name, 'error': 'exit code {0}'
+                                .format(process.exitcode)})
+            shutil.rmtree(output_dir)
+    finally:
+        shutil.rmtree(directory)
+
+    print_results(results, baseline)
+
+    if arguments['--output']:
+        with open(arguments['--output'], 'w') as f:
+            json.dump({
+                'version': __version__,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.platform(),
+                'size': size,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
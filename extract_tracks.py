@@ -7,14 +7,20 @@ segment the set of data points into individual tracks. Two
 files are output: tracks (GeoJSON LINESTRING) and point data
 (GeoJSON Point). The first is useful for formatting, the second for
 coloring and filtering.
+
+All records of a file are processed at once as NumPy arrays.
 """
 import json
 import os
+import sys
 import time
-from datetime import datetime
-from pyproj import Proj, transform
+import docopt
+from pyproj import Transformer
 import numpy as np
 
+LAT_LON_CRS = 'epsg:4326'
+METER_CRS = 'epsg:32642'
+
 
 def timestamp(record):
     return time.mktime((
@@ -24,104 +30,257 @@ def timestamp(record):
     ))
 
 
-def segment(records, segment_time_threshold=600):
-    # when there is a break in data collection, consider the next part
-    # as a new track
-    path_segments = []
-    prev_time = 0
-    for record in records:
-        record['timestamp'] = int(timestamp(record))
-        record['weekDay'] = (datetime
-                             .fromtimestamp(record['timestamp'])
-                             .weekday())
-        if (record['timestamp'] - prev_time >= segment_time_threshold or
-                record['timestamp'] <= prev_time):
-            path_segments.append([])
-        prev_time = record['timestamp']
-        path_segments[-1].append(record)
-
-    return path_segments
-
-def extract_tracks(input_directory, output_directory, segment_time_threshold=600):
-    tracks = []
-    points = []
-
-    lat_lon_proj = Proj(init='epsg:4326')
-    meter_proj = Proj(init='epsg:32642')
-
-    for path, dirs, files in os.walk(input_directory):
-        for file_name in files:
-            if not file_name.endswith('.json'):
-                continue
-
-            with open(os.path.join(path, file_name)) as f:
-                records = json.load(f)
-
-            # when there is a break in data collection, consider the next part
-            # as a new track
-            path_segments = segment(records, segment_time_threshold)
-            file_prefix = os.path.splitext(file_name)[0]
-
-            for i, path_segment in enumerate(path_segments):
-                coordinates = []
-                prev_point_meter = None
-                prev_timestamp = None
-
-                for record in path_segment:
-                    coord = [record['longitude'], record['latitude']]
-                    meter_x, meter_y = transform(lat_lon_proj, meter_proj, coord[0], coord[1])
-                    new_point_meter = np.array([meter_x, meter_y])
-                    if prev_timestamp is None:
-                        speed_computed_kmh = 0.0
-                    else:
-                        speed_computed_ms = np.linalg.norm(new_point_meter - prev_point_meter) / (record['timestamp'] - prev_timestamp)
-                        speed_computed_kmh = speed_computed_ms*3600/1000
-                    prev_point_meter = new_point_meter
-                    prev_timestamp = record['timestamp']
-
-                    points.append({
-                        'type': 'Feature',
-                        'geometry': {
-                            'type': 'Point',
-                            'coordinates': coord,
-                        },
-                        'properties': {
-                            'timestamp': record['timestamp'],
-                            'speed': record['speed'],
-                            'direction': record['direction'],
-                            'numSatellites': record['numSatellites'],
-                            'track': len(tracks) + 1,
-                            'device': record['device'],
-                            'meter_x': meter_x,
-                            'meter_y': meter_y,
-                            'speed_computed': speed_computed_kmh,
-                        },
-                    })
-                    coordinates.append(coord)
-
-                tracks.append({
-                    'type': 'Feature',
-                    'geometry': {
-                        'type': 'LineString',
-                        'coordinates': coordinates,
-                    },
-                    'properties': {
-                        'id': len(tracks) + 1,
-                        'device': path_segment[0]['device'],
-                        'filename': file_prefix,
-                    },
-                })
-
-    with open(os.path.join(output_directory, 'tracks.json'), 'w') as f:
-        json.dump({
-            'type': 'FeatureCollection',
-            'features': tracks,
-        }, f, separators=(',', ':'))
-
-    with open(os.path.join(output_directory, 'points.json'), 'w') as f:
-        json.dump({
-            'type': 'FeatureCollection',
-            'features': points,
-        }, f, separators=(',', ':'))
-
-extract_tracks(os.path.join('data', 'json'), os.path.join('data', 'geojson'))
+def timestamps(records):
+    """
+    Local time of all records as a UNIX timestamp, as timestamp() would
+    compute it. The timezone offset is looked up once per distinct minute.
+    :param records: list of record dicts
+    :return: int64 array
+    """
+    fields = np.array([(r['year'], r['month'], r['day'],
+                        r['hour'], r['minute'], r['second'])
+                       for r in records], dtype=np.int64).reshape(-1, 6)
+    days = ((fields[:, 0] - 1970).astype('datetime64[Y]')
+            .astype('datetime64[M]') + (fields[:, 1] - 1))
+    days = days.astype('datetime64[D]') + (fields[:, 2] - 1)
+    naive = (days.astype(np.int64) * 86400 + fields[:, 3] * 3600 +
+             fields[:, 4] * 60 + fields[:, 5])
+
+    minutes, inverse = np.unique(naive // 60, return_inverse=True)
+    offsets = np.array([
+        int(time.mktime(time.gmtime(m * 60)[:6] + (0, 0, 0))) - m * 60
+        for m in minutes.tolist()], dtype=np.int64)
+    return naive + offsets[inverse.reshape(-1)]
+
+
+def segment_starts(unix_times, segment_time_threshold=600):
+    """
+    When there is a break in data collection, or time goes backwards,
+    consider the next part as a new track.
+    :param unix_times: int64 array of record times
+    :param segment_time_threshold: minimum break in seconds
+    :return: boolean array, True where a track starts
+    """
+    gaps = np.diff(np.concatenate(([0], unix_times)))
+    starts = (gaps >= segment_time_threshold) | (gaps <= 0)
+    if len(starts) > 0:
+        starts[0] = True
+    return starts
+
+
+def computed_speed(meter_x, meter_y, unix_times, starts):
+    """
+    Speed between consecutive points of a track, 0 at the start of a track.
+    :param meter_x: float array of projected x coordinates in meters
+    :param meter_y: float array of projected y coordinates in meters
+    :param unix_times: int64 array of record times
+    :param starts: boolean array, True where a track starts
+    :return: float array of speeds in km/h
+    """
+    speed = np.zeros(len(unix_times))
+    steps = np.stack((np.diff(meter_x), np.diff(meter_y)), axis=1)
+    # a dot product per step, rounding the same as numpy.linalg.norm
+    distance = np.sqrt(
+        (steps[:, np.newaxis, :] @ steps[:, :, np.newaxis]).reshape(-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed[1:] = distance / np.diff(unix_times) * 3600 / 1000
+    speed[starts] = 0.0
+    return speed
+
+
+class FeatureWriter(object):
+    """
+    Writes GeoJSON features to a file one at a time, so that they need not
+    all be kept in memory. A FeatureCollection is written under a temporary
+    name and only replaces the output file once it is complete. With ndjson,
+    each line holds one feature, and every line written before a crash
+    remains usable.
+    """
+    def __init__(self, path, ndjson=False):
+        """
+        :param path: output file
+        :param ndjson: write newline-delimited GeoJSON features
+        """
+        self.path = path
+        self.ndjson = ndjson
+        self.temp_path = path if ndjson else path + '.tmp'
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+        self.first = True
+        self.file = open(self.temp_path, 'w')
+        if not ndjson:
+            self.file.write('{"type":"FeatureCollection","features":[')
+
+    def write(self, feature):
+        if self.ndjson:
+            self.file.write(self.encoder.encode(feature))
+            self.file.write('\n')
+        else:
+            if not self.first:
+                self.file.write(',')
+            self.file.write(self.encoder.encode(feature))
+        self.first = False
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """ Complete the file. """
+        if not self.ndjson:
+            self.file.write(']}')
+        self.file.close()
+        if not self.ndjson:
+            os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        """ Stop writing, removing an incomplete FeatureCollection. """
+        self.file.close()
+        if not self.ndjson:
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def track_features(records, file_prefix, transformer, first_id=1,
+                   segment_time_threshold=600):
+    """
+    Segment the records of a file into tracks.
+    :param records: list of record dicts of a single file
+    :param file_prefix: file name to store with the tracks
+    :param transformer: pyproj Transformer from longitude and latitude to
+        meters
+    :param first_id: id of the first track
+    :param segment_time_threshold: minimum break in seconds between tracks
+    :return: iterator of a (track, points) tuple per track, with track a
+        LineString feature and points a list of Point features.
+    """
+    if len(records) == 0:
+        return
+    unix_times = timestamps(records)
+    starts = segment_starts(unix_times, segment_time_threshold)
+    meter_x, meter_y = transformer.transform(
+        np.array([r['longitude'] for r in records], dtype=float),
+        np.array([r['latitude'] for r in records], dtype=float))
+    speed = computed_speed(meter_x, meter_y, unix_times, starts)
+    bounds = np.append(np.flatnonzero(starts), len(records)).tolist()
+
+    for track_id, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]),
+                                            first_id):
+        coordinates = []
+        points = []
+        for record, t, x, y, v in zip(
+                records[start:end], unix_times[start:end].tolist(),
+                meter_x[start:end].tolist(), meter_y[start:end].tolist(),
+                speed[start:end].tolist()):
+            coord = [record['longitude'], record['latitude']]
+            points.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': coord,
+                },
+                'properties': {
+                    'timestamp': t,
+                    'speed': record['speed'],
+                    'direction': record['direction'],
+                    'numSatellites': record['numSatellites'],
+                    'track': track_id,
+                    'device': record['device'],
+                    'meter_x': x,
+                    'meter_y': y,
+                    'speed_computed': v,
+                },
+            })
+            coordinates.append(coord)
+
+        track = {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': coordinates,
+            },
+            'properties': {
+                'id': track_id,
+                'device': records[start]['device'],
+                'filename': file_prefix,
+            },
+        }
+        yield track, points
+
+
+def extract_tracks(input_directory, output_directory,
+                   segment_time_threshold=600, ndjson=False):
+    """
+    Convert all JSON files of parse_excel.py in a directory to tracks and
+    points GeoJSON files. Features are written per track, so only a single
+    input file is kept in memory.
+    :param input_directory: directory with JSON files
+    :param output_directory: directory to write tracks.json and points.json
+        to, or with ndjson, tracks.ndjson and points.ndjson.
+    :param segment_time_threshold: minimum break in seconds between tracks
+    :param ndjson: write newline-delimited GeoJSON
+    """
+    extension = 'ndjson' if ndjson else 'json'
+    transformer = Transformer.from_crs(LAT_LON_CRS, METER_CRS,
+                                       always_xy=True)
+    num_tracks = 0
+
+    with FeatureWriter(os.path.join(output_directory,
+                                    'tracks.' + extension),
+                       ndjson) as tracks, \
+            FeatureWriter(os.path.join(output_directory,
+                                       'points.' + extension),
+                          ndjson) as points:
+        for path, dirs, files in os.walk(input_directory):
+            for file_name in files:
+                if not file_name.endswith('.json'):
+                    continue
+
+                with open(os.path.join(path, file_name)) as f:
+                    records = json.load(f)
+
+                file_prefix = os.path.splitext(file_name)[0]
+                for track, track_points in track_features(
+                        records, file_prefix, transformer, num_tracks + 1,
+                        segment_time_threshold):
+                    tracks.write(track)
+                    for point in track_points:
+                        points.write(point)
+                    num_tracks += 1
+                tracks.flush()
+                points.flush()
+
+
+def main(argv=sys.argv[1:]):
+    """
+    Converts GPS JSON files of parse_excel.py to GeoJSON tracks and points.
+
+    Usage:
+      extract_tracks.py [-h] [--ndjson] [--threshold S]
+                        [<input_dir> [<output_dir>]]
+
+    Options:
+      <input_dir>          Directory with JSON files, by default data/json
+      <output_dir>         Directory to write GeoJSON to, by default
+                           data/geojson
+      -n, --ndjson         Write newline-delimited GeoJSON, one feature
+                           per line
+      -t, --threshold S    Minimum break in seconds between tracks
+                           [default: 600]
+      -h, --help           This help text
+    """
+    arguments = docopt.docopt(main.__doc__, argv)
+    extract_tracks(arguments['<input_dir>'] or os.path.join('data', 'json'),
+                   arguments['<output_dir>'] or os.path.join('data',
+                                                             'geojson'),
+                   int(arguments['--threshold']), arguments['--ndjson'])
+
+
+if __name__ == '__main__':
+    main()
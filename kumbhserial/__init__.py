@@ -22,6 +22,7 @@ Kumbh Mela serial device reader
 from .ports import serial_ports, choose_serial_port
 from .interpreter import (TrackerInterpreter,
                           SeparatedTrackerEntrySetJsonConverter)
+from .daemon import DownloadDaemon
 from .main import download, sniffer, processor
 from .reader import SerialReader, run_reader, read_file
 from .sniffer import SnifferInterpreter
@@ -35,6 +36,7 @@ __all__ = [
     'choose_serial_port',
     'TrackerInterpreter',
     'SeparatedTrackerEntrySetJsonConverter',
+    'DownloadDaemon',
     'download',
     'sniffer',
     'processor',
@@ -17,21 +17,33 @@
 
 """ Pipe-like appenders, to dump data with different methods and formats. """
 
+import collections
 import json
 import threading
-import queue
+import time
+from .compression import CompressedDumper
+from .framing import record_function
+
+RECORD_FORMATS = ('json', 'ndjson')
 
 
 class Dumper(object):
     """
     Dumps bytes data to file.
     """
-    def __init__(self, path, flush=True):
+    def __init__(self, path, flush=True, offset=None):
         """
         :param path: file path to write to.
         :param flush: flush to file after writing. Slower but safer.
+        :param offset: continue writing an existing file, after truncating
+            it to offset bytes.
         """""
-        self.file = open(path, 'wb')
+        if offset is None:
+            self.file = open(path, 'wb')
+        else:
+            self.file = open(path, 'r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
         self.flush = flush
 
     def append(self, data):
@@ -40,6 +52,27 @@ class Dumper(object):
             if self.flush:
                 self.file.flush()
 
+    def append_record(self, record, meta):
+        """
+        Write a framed record, see the framing module. A timestamp is
+        written in place without joining the record first.
+        """
+        if meta.timestamp is None:
+            self.append(record)
+            return
+        if self.file:
+            index = meta.timestamp_index
+            self.file.writelines((record[:index], meta.separator,
+                                  meta.timestamp, meta.separator,
+                                  record[index:]))
+            if self.flush:
+                self.file.flush()
+
+    def tell(self):
+        """ Write all data to file and return the file size. """
+        self.file.flush()
+        return self.file.tell()
+
     def done(self):
         self.file.close()
         self.file = None
@@ -51,11 +84,20 @@ class Duplicator(object):
     """
     def __init__(self, appenders):
         self.appenders = appenders
+        self.record_functions = [record_function(a) for a in appenders]
 
     def append(self, data):
         for a in self.appenders:
             a.append(data)
 
+    def append_record(self, record, meta):
+        """
+        Send a framed record to each appender in the way it accepts it, see
+        framing.record_function.
+        """
+        for append_record in self.record_functions:
+            append_record(record, meta)
+
     def done(self):
         for a in self.appenders:
             a.done()
@@ -77,10 +119,16 @@ class JsonListAppender(object):
     Convert incoming data to a list of json objects. Each call to append will
     add one JSON object to a JSON list.
     """
-    def __init__(self, appender):
+    def __init__(self, appender, started=False, first=True):
+        """
+        :param appender: appender to write bytes to.
+        :param started: the list was already started, continue it.
+        :param first: no objects were written to the list yet.
+        """
         self.appender = appender
-        self.first = True
-        self.appender.append(b'[')
+        self.first = first
+        if not started:
+            self.appender.append(b'[')
 
     def append(self, data):
         if self.first:
@@ -96,38 +144,254 @@ class JsonListAppender(object):
         self.appender.done()
 
 
+class JsonLinesAppender(object):
+    """
+    Convert incoming data to newline-delimited JSON (NDJSON). Records are
+    serialized in batches into a buffer, which is written in large blocks once
+    it holds buffer_size bytes or once flush_interval seconds have passed.
+    There is no timer: the interval is only checked when a record arrives, so
+    when no more records come in, the buffer is kept until done is called.
+    Every written line is a complete JSON object, so the output remains
+    readable if the process is killed, as long as the receiving appender
+    writes each block through, like a Dumper with flush enabled.
+    """
+    def __init__(self, appender, batch_size=256, buffer_size=256 * 1024,
+                 flush_interval=1.0):
+        """
+        :param appender: appender to write blocks of bytes to.
+        :param batch_size: number of records to serialize at once.
+        :param buffer_size: number of bytes to buffer before writing.
+        :param flush_interval: number of seconds after which buffered data
+            is written at the next record.
+        """
+        self.appender = appender
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+        self.records = []
+        self.buffer = bytearray()
+        self.flushed_at = time.monotonic()
+
+    def append(self, data):
+        self.records.append(data)
+        if len(self.records) >= self.batch_size:
+            self.serialize()
+        if (len(self.buffer) >= self.buffer_size or
+                time.monotonic() - self.flushed_at >= self.flush_interval):
+            self.flush()
+
+    def serialize(self):
+        """ Serialize all pending records to the buffer. """
+        if len(self.records) > 0:
+            encode = self.encoder.encode
+            self.buffer += bytes('\n'.join([encode(r) for r in self.records]),
+                                 encoding='ascii')
+            self.buffer += b'\n'
+            self.records = []
+
+    def flush(self):
+        """ Write all pending records to the appender. """
+        self.serialize()
+        if len(self.buffer) > 0:
+            self.appender.append(bytes(self.buffer))
+            del self.buffer[:]
+        self.flushed_at = time.monotonic()
+
+    def done(self):
+        self.flush()
+        self.appender.done()
+
+
+def open_dumper(path, flush=True, offset=None, compression=None):
+    """
+    Create a Dumper, or with a compression method a CompressedDumper.
+    :param path: file path to write to.
+    :param flush: flush to file after writing, if not compressed.
+    :param offset: continue writing an existing file, see Dumper.
+    :param compression: one of compression.COMPRESSIONS or None.
+    :raises ValueError: if the compression cannot be used.
+    """
+    if compression is None:
+        return Dumper(path, flush=flush, offset=offset)
+    return CompressedDumper(path, compression, offset=offset)
+
+
+def record_appender(path, output_format='json', flush=True,
+                    compression=None):
+    """
+    Create an appender that writes records to a file.
+    :param path: file path to write to.
+    :param output_format: one of RECORD_FORMATS.
+    :param flush: flush to file after writing. NDJSON is always flushed,
+        since JsonLinesAppender already writes it in large blocks.
+    :param compression: one of compression.COMPRESSIONS or None.
+    :raises ValueError: if the output format or compression is not known.
+    """
+    if output_format == 'json':
+        return JsonListAppender(open_dumper(path, flush=flush,
+                                            compression=compression))
+    elif output_format == 'ndjson':
+        return JsonLinesAppender(open_dumper(path, flush=True,
+                                             compression=compression))
+    else:
+        raise ValueError('Output format {0} not one of {1}'
+                         .format(output_format, ', '.join(RECORD_FORMATS)))
+
+
 class ThreadBuffer(threading.Thread):
     """
     Put a thread between the sender and the receiver, so that these can act
     concurrently. This is helpful if both the sender and receiver do
-    independent I/O operations.
+    independent I/O operations. The thread passes on all items that are
+    waiting at once. When done, it first passes on all waiting items and then
+    marks the receiver done.
+
+    If maxsize is given, at most that many items are held, counting both the
+    waiting items and the batch that is being passed on. With the 'block'
+    policy, append then blocks until there is room, which slows down the
+    sender to the pace of the receiver. With the 'drop' policy, new items are
+    dropped and counted instead.
+
+    Since items are passed on later, memoryview items, such as framed
+    records, are copied when appended.
     """
-    def __init__(self, appender, **kwargs):
+    policies = ('block', 'drop')
+
+    def __init__(self, appender, maxsize=0, policy='block', **kwargs):
+        """
+        :param appender: appender to send data to from the thread.
+        :param maxsize: maximum number of held items, 0 for unbounded.
+        :param policy: what to do when full: 'block' or 'drop'.
+        :param kwargs: arguments to threading.Thread.
+        :raises ValueError: if the policy is not known.
+        """
+        if policy not in ThreadBuffer.policies:
+            raise ValueError('Policy {0} not one of {1}'
+                             .format(policy, ', '.join(ThreadBuffer.policies)))
         self.appender = appender
-        self.queue = queue.Queue()
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = collections.deque()
+        # number of items taken by the thread but not yet passed on
+        self.in_flight = 0
+        self.condition = threading.Condition()
         self.is_done = False
+        self.exception = None
+        self._appender_done = False
+        self.num_appended = 0
+        self.num_delivered = 0
+        self.num_dropped = 0
+        self.max_depth = 0
+        self.total_latency = 0.
+        self.max_latency = 0.
         super().__init__(**kwargs)
         self.start()
 
     def append(self, data):
-        self.queue.put(data)
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        with self.condition:
+            if 0 < self.maxsize <= self._depth():
+                if self.policy == 'drop':
+                    self.num_dropped += 1
+                    return
+                while (self._depth() >= self.maxsize and
+                       self.exception is None):
+                    self.condition.wait()
+            if self.exception is not None:
+                raise RuntimeError('Buffered appender failed: {0}'
+                                   .format(self.exception))
+            self.items.append((time.monotonic(), data))
+            self.num_appended += 1
+            if self._depth() > self.max_depth:
+                self.max_depth = self._depth()
+            self.condition.notify_all()
 
     def run(self):
-        while not self.is_done:
+        while True:
+            with self.condition:
+                while len(self.items) == 0 and not self.is_done:
+                    self.condition.wait()
+                if len(self.items) == 0:
+                    return
+                batch = self.items
+                self.items = collections.deque()
+                self.in_flight = len(batch)
+
+            now = time.monotonic()
+            latency = now - batch[0][0]
+            self.total_latency += sum(now - t for t, _ in batch)
+            if latency > self.max_latency:
+                self.max_latency = latency
             try:
-                data = self.queue.get(timeout=1)
-                self.appender.append(data)
-            except queue.Empty:
-                pass  # no input yet, check if is_done
+                for _, data in batch:
+                    self.appender.append(data)
+                    self.num_delivered += 1
+            except Exception as ex:
+                print('Buffered appender failed: {0}'.format(ex))
+                with self.condition:
+                    self.exception = ex
+                    self.items.clear()
+                    self.in_flight = 0
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.in_flight = 0
+                self.condition.notify_all()
+
+    @property
+    def depth(self):
+        """ Number of held items, waiting or being passed on. """
+        with self.condition:
+            return self._depth()
+
+    def _depth(self):
+        return len(self.items) + self.in_flight
+
+    def stats(self):
+        """
+        Counters of the buffer. Depth counts the held items, of which
+        in_flight are being passed on. Latency is the time in seconds that
+        items waited before being passed on.
+        :return: dict
+        """
+        with self.condition:
+            return {
+                'appended': self.num_appended,
+                'delivered': self.num_delivered,
+                'dropped': self.num_dropped,
+                'depth': self._depth(),
+                'in_flight': self.in_flight,
+                'max_depth': self.max_depth,
+                'mean_latency': (self.total_latency /
+                                 max(self.num_delivered, 1)),
+                'max_latency': self.max_latency,
+            }
 
-    def join(self, **kwargs):
-        self.done()
+    def join(self, timeout=None):
+        """
+        Wait until all waiting items are passed on, and mark the receiver
+        done.
+        :param timeout: if the items were not passed on after timeout, mark
+            the receiver done anyway and return.
+        """
+        self.done(join=False)
         try:
-            super().join(**kwargs)
+            super().join(timeout=timeout)
         finally:
-            self.appender.done()
+            if not self._appender_done:
+                self._appender_done = True
+                self.appender.done()
 
-    def done(self):
-        if not self.is_done:
+    def done(self, join=True):
+        """
+        Stop accepting items, pass on the waiting items and mark the receiver
+        done.
+        :param join: wait for the waiting items to be passed on.
+        """
+        with self.condition:
             self.is_done = True
+            self.condition.notify_all()
+        if join:
             self.join()
@@ -0,0 +1,104 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact columnar storage of records.
+"""
+
+import numpy as np
+
+
+class RecordColumns(object):
+    """
+    Structure-of-arrays storage of records with integer fields. Columns are
+    appended in chunks and joined when they are requested. Records can be
+    read back as dicts, which are only created while iterating.
+    """
+    def __init__(self, dtypes):
+        """
+        :param dtypes: sequence of (field name, numpy dtype) tuples.
+        """
+        self.dtypes = tuple(dtypes)
+        self.fields = tuple(f for f, _ in self.dtypes)
+        self._chunks = []
+        self._length = 0
+
+    @classmethod
+    def from_records(cls, dtypes, records):
+        """
+        Create columns from a sequence of dicts.
+        :param dtypes: sequence of (field name, numpy dtype) tuples.
+        :param records: sequence of dicts containing all fields.
+        """
+        columns = cls(dtypes)
+        columns.extend({f: [r[f] for r in records]
+                        for f in columns.fields})
+        return columns
+
+    def extend(self, columns):
+        """
+        Append a chunk of records.
+        :param columns: dict with an equal length array per field.
+        """
+        chunk = tuple(np.asarray(columns[f], dtype=dtype)
+                      for f, dtype in self.dtypes)
+        if len(chunk[0]) > 0:
+            self._chunks.append(chunk)
+            self._length += len(chunk[0])
+
+    def column(self, field):
+        """
+        Get all values of a single field.
+        :param field: field name
+        :return: numpy array
+        """
+        self._join()
+        if len(self._chunks) == 0:
+            return np.zeros(0, dtype=dict(self.dtypes)[field])
+        return self._chunks[0][self.fields.index(field)]
+
+    def columns(self):
+        """
+        :return: dict with an array per field.
+        """
+        return {f: self.column(f) for f in self.fields}
+
+    @property
+    def nbytes(self):
+        """ Number of bytes used by the columns. """
+        return sum(c.nbytes for chunk in self._chunks for c in chunk)
+
+    def _join(self):
+        if len(self._chunks) > 1:
+            self._chunks = [tuple(np.concatenate(c)
+                                  for c in zip(*self._chunks))]
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            for row in zip(*[c.tolist() for c in chunk]):
+                yield dict(zip(self.fields, row))
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError('record index out of range')
+        self._join()
+        return {f: c[i].item() for f, c in zip(self.fields, self._chunks[0])}
@@ -0,0 +1,341 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compressed output and input files. Data is written in independent frames,
+gzip members or zstd or lz4 frames, that are each flushed to disk. A file
+that was being written when the program crashed is readable up to where it
+was cut off. gzip is always available; zstd needs the zstandard package
+and lz4 the lz4 package.
+"""
+
+import gzip
+import io
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+COMPRESSIONS = ('gzip', 'zstd', 'lz4')
+EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst', 'lz4': 'lz4'}
+MAGIC_NUMBERS = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+    b'\x04\x22\x4d\x18': 'lz4',
+}
+PACKAGES = {'zstd': 'zstandard', 'lz4': 'lz4'}
+
+# errors raised when decompressing an incomplete or corrupt frame
+DECOMPRESSION_ERRORS = (zlib.error,)
+if zstandard is not None:
+    DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+if lz4_frame is not None:
+    DECOMPRESSION_ERRORS += (RuntimeError,)
+
+
+def check_compression(compression):
+    """
+    Check that a compression method can be used.
+    :param compression: one of COMPRESSIONS
+    :raises ValueError: if the method is not known or its package is not
+        installed.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError('Compression {0} not one of {1}'
+                         .format(compression, ', '.join(COMPRESSIONS)))
+    if ((compression == 'zstd' and zstandard is None) or
+            (compression == 'lz4' and lz4_frame is None)):
+        raise ValueError('Compression {0} requires the {1} package'
+                         .format(compression, PACKAGES[compression]))
+
+
+def frame_compressor(compression, level=None):
+    """
+    Function that compresses data into a single, complete frame.
+    :param compression: one of COMPRESSIONS
+    :param level: compression level, or None for the default of the method
+    :return: function that takes bytes and returns bytes
+    :raises ValueError: if the compression cannot be used.
+    """
+    check_compression(compression)
+    if compression == 'gzip':
+        level = 6 if level is None else level
+        return lambda data: _gzip_compress(data, level)
+    elif compression == 'zstd':
+        compressor = zstandard.ZstdCompressor(
+            level=3 if level is None else level)
+        return compressor.compress
+    else:
+        level = 0 if level is None else level
+        return lambda data: lz4_frame.compress(data, compression_level=level)
+
+
+def _gzip_compress(data, level):
+    """
+    Compress data into a gzip member without a modification time, as
+    gzip.compress does with mtime=0, which needs Python 3.8.
+    """
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=level,
+                       mtime=0) as f:
+        f.write(data)
+    return output.getvalue()
+
+
+def compressed_name(path, compression):
+    """
+    File name with the extension of a compression method appended.
+    :param path: file name
+    :param compression: one of COMPRESSIONS or None
+    :return: file name
+    """
+    if compression is None:
+        return path
+    return '{0}.{1}'.format(path, EXTENSIONS[compression])
+
+
+def strip_compression_extension(path):
+    """
+    File name without the extension of a compression method, if any.
+    """
+    for extension in EXTENSIONS.values():
+        if path.endswith('.' + extension):
+            return path[:-len(extension) - 1]
+    return path
+
+
+def detect_compression(path):
+    """
+    Detect the compression method of a file from its first bytes.
+    :param path: file name
+    :return: one of COMPRESSIONS or None if the file is not compressed.
+    """
+    with open(path, 'rb') as f:
+        start = f.read(4)
+    for magic, compression in MAGIC_NUMBERS.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def open_compressed(path, compression=None):
+    """
+    Open a possibly compressed file for reading, decompressing it
+    transparently. The file may consist of many frames.
+    :param path: file name
+    :param compression: compression method, by default detected from the
+        file.
+    :return: binary file-like object
+    :raises ValueError: if the file is compressed with a method that cannot
+        be used.
+    """
+    if compression is None:
+        compression = detect_compression(path)
+    if compression is None:
+        return open(path, 'rb')
+    check_compression(compression)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    elif compression == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True)
+    else:
+        return lz4_frame.open(path, 'rb')
+
+
+def frame_decompressor(compression):
+    """
+    Object that decompresses a single frame, with decompress(data), and eof
+    and unused_data attributes.
+    :param compression: one of COMPRESSIONS
+    :raises ValueError: if the compression cannot be used.
+    """
+    check_compression(compression)
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    else:
+        return lz4_frame.LZ4FrameDecompressor()
+
+
+def iter_chunks(path, chunk_size=1024 * 1024):
+    """
+    Read a possibly compressed file in chunks. If the file ends in an
+    incomplete frame, for example because the program writing it crashed,
+    the data that can be decompressed from it is still returned; reading
+    stops at a corrupt frame.
+    :param path: file name
+    :param chunk_size: number of bytes to read from the file at once
+    :return: iterator of bytes
+    :raises ValueError: if the file is compressed with a method that cannot
+        be used.
+    """
+    compression = detect_compression(path)
+    with open(path, 'rb') as f:
+        if compression is None:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+            return
+
+        decompressor = frame_decompressor(compression)
+        in_frame = False
+        for data in iter(lambda: f.read(chunk_size), b''):
+            while len(data) > 0:
+                in_frame = True
+                try:
+                    chunk = decompressor.decompress(data)
+                except DECOMPRESSION_ERRORS as ex:
+                    print('WARNING: {0} has a corrupt frame: {1}'
+                          .format(path, ex))
+                    return
+                if len(chunk) > 0:
+                    yield chunk
+                if decompressor.eof:
+                    data = decompressor.unused_data
+                    decompressor = frame_decompressor(compression)
+                    in_frame = False
+                else:
+                    data = b''
+        if in_frame:
+            print('WARNING: {0} ends in an incomplete frame'.format(path))
+
+
+class CompressedDumper(threading.Thread):
+    """
+    Dumps bytes data to a compressed file, compressing from a thread so that
+    appending data never waits for compression. Data is collected until
+    frame_size bytes are waiting or flush_interval seconds have passed, and
+    then written and flushed as an independent frame. When done, the
+    remaining data is written and the file is closed.
+    """
+    def __init__(self, path, compression='gzip', offset=None, level=None,
+                 frame_size=1024 * 1024, flush_interval=1.0):
+        """
+        :param path: file path to write to.
+        :param compression: one of COMPRESSIONS
+        :param offset: continue writing an existing file, after truncating
+            it to offset bytes. The offset must be at the end of a frame, as
+            returned by tell().
+        :param level: compression level, or None for the default
+        :param frame_size: number of bytes to collect before compressing
+        :param flush_interval: maximum number of seconds to wait before
+            compressing and flushing the collected data.
+        :raises ValueError: if the compression cannot be used.
+        """
+        super().__init__(daemon=True)
+        self.compress = frame_compressor(compression, level)
+        self.compression = compression
+        if offset is None:
+            self.file = open(path, 'wb')
+        else:
+            self.file = open(path, 'r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        self.frame_size = frame_size
+        self.flush_interval = flush_interval
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.is_done = False
+        self.exception = None
+        self.start()
+
+    def append(self, data):
+        if len(data) > 0:
+            self._collect((data,))
+
+    def append_record(self, record, meta):
+        """
+        Collect a framed record, see the framing module. A timestamp is
+        collected in place without joining the record first.
+        """
+        if meta.timestamp is None:
+            self.append(record)
+            return
+        index = meta.timestamp_index
+        self._collect((record[:index], meta.separator, meta.timestamp,
+                       meta.separator, record[index:]))
+
+    def _collect(self, parts):
+        with self.condition:
+            if self.exception is not None:
+                raise RuntimeError('Compression failed: {0}'
+                                   .format(self.exception))
+            for part in parts:
+                self.buffer += part
+            if len(self.buffer) >= self.frame_size:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: (self.is_done or
+                             len(self.buffer) >= self.frame_size),
+                    timeout=self.flush_interval)
+                is_done = self.is_done
+            try:
+                self._write_frame()
+            except Exception as ex:
+                with self.condition:
+                    self.exception = ex
+                return
+            if is_done:
+                return
+
+    def _write_frame(self):
+        """ Compress and write all collected data as one frame. """
+        with self.write_lock:
+            with self.condition:
+                data = bytes(self.buffer)
+                del self.buffer[:]
+            if len(data) > 0:
+                self.file.write(self.compress(data))
+                self.file.flush()
+
+    def tell(self):
+        """
+        Write all collected data and return the file size, which is at the
+        end of a frame.
+        """
+        self._write_frame()
+        return self.file.tell()
+
+    def done(self):
+        """
+        Write the remaining data and close the file.
+        :raises RuntimeError: if compressing or writing failed.
+        """
+        with self.condition:
+            if self.is_done:
+                return
+            self.is_done = True
+            self.condition.notify()
+        self.join()
+        self.file.close()
+        if self.exception is not None:
+            raise RuntimeError('Compression failed: {0}'
+                               .format(self.exception))
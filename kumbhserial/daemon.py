@@ -0,0 +1,220 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read many serial devices at once from a single thread with asyncio.
+"""
+
+import asyncio
+import serial
+from .framing import RecordFramer
+from .reader import READ_SIZE
+
+
+class AsyncSerialReader(object):
+    """
+    Reads a serial device, as provided in the Kumbh Mela project, from an
+    asyncio event loop. Data is read whenever the port is readable, and
+    split into records at the terminator, which are sent to the appender.
+    A heartbeat is sent to the device with a timer.
+    """
+    def __init__(self, port, appender, loop, terminator=b'\r',
+                 insert_timestamp_at=(b'>', b'<'), baud_rate=921600,
+                 heartbeat=1, wait_time=12, idle_time=1, clock=None):
+        """
+        Opens a serial port. Call start() to start reading.
+        :param port: serial port name
+        :param appender: appender to write records to
+        :param loop: asyncio event loop to read in
+        :param terminator: end-of-record terminator
+        :param insert_timestamp_at: tokens to insert a timestamp after
+        :param baud_rate: serial baud rate
+        :param heartbeat: seconds between heartbeat signals, or None to not
+            send a heartbeat.
+        :param wait_time: maximum number of seconds to keep reading after
+            done() is called, while the device is still sending data.
+        :param idle_time: number of seconds without data after done() is
+            called, after which the device is considered finished.
+        :param clock: helpers.Clock for the inserted timestamps, by default
+            the shared clock.
+        :raises serial.SerialException: if the port cannot be opened.
+        """
+        self.comm = serial.Serial(port, baud_rate, timeout=0)
+        self.port = port
+        self.appender = appender
+        self.loop = loop
+        self.terminator = terminator
+        self.insert_timestamp_at = insert_timestamp_at
+        self.heartbeat = heartbeat
+        self.wait_time = wait_time
+        self.idle_time = idle_time
+        self.clock = clock
+        self.framer = RecordFramer(appender, terminator, insert_timestamp_at,
+                                   clock=clock)
+        self.exception = None
+        self.is_done = False
+        self.num_bytes = 0
+        self.finished = loop.create_future()
+        self._heartbeat_handle = None
+        self._idle_handle = None
+        self._wait_handle = None
+
+    def start(self):
+        """ Start reading and sending the heartbeat. """
+        self.loop.add_reader(self.comm.fileno(), self._read)
+        if self.heartbeat is not None:
+            self._send_heartbeat()
+
+    def _send_heartbeat(self):
+        try:
+            self.comm.write(b'@')
+        except (OSError, serial.SerialException) as ex:
+            self._close(ex)
+            return
+        self._heartbeat_handle = self.loop.call_later(
+            self.heartbeat, self._send_heartbeat)
+
+    def _read(self):
+        try:
+            data = self.comm.read(READ_SIZE)
+        except (OSError, serial.SerialException) as ex:
+            self._close(ex)
+            return
+        if len(data) == 0:
+            return
+        self.num_bytes += len(data)
+        self.framer.feed(data)
+        if self.is_done:
+            self._idle_handle.cancel()
+            self._idle_handle = self.loop.call_later(self.idle_time,
+                                                     self._close)
+
+    def done(self):
+        """
+        Stop sending the heartbeat. The port is closed once the device stops
+        sending data, or when the wait time has passed.
+        """
+        if self.is_done:
+            return
+        self.is_done = True
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+        if not self.finished.done():
+            self._idle_handle = self.loop.call_later(self.idle_time,
+                                                     self._close)
+            self._wait_handle = self.loop.call_later(self.wait_time,
+                                                     self._close)
+
+    def _close(self, exception=None):
+        """ Close the port and mark the appender done. """
+        if self.finished.done():
+            return
+        self.is_done = True
+        self.exception = exception
+        for handle in (self._heartbeat_handle, self._idle_handle,
+                       self._wait_handle):
+            if handle is not None:
+                handle.cancel()
+        try:
+            self.loop.remove_reader(self.comm.fileno())
+            self.comm.close()
+        except (OSError, serial.SerialException):
+            pass
+        try:
+            self.framer.flush()
+            self.appender.done()
+        except Exception as ex:
+            if self.exception is None:
+                self.exception = ex
+        self.finished.set_result(self)
+
+    def __str__(self):
+        return '{0} ({1} bytes)'.format(self.port, self.num_bytes)
+
+
+class DownloadDaemon(object):
+    """
+    Reads any number of serial ports in one thread. Each port gets its own
+    appender, created when the port is added.
+    """
+    def __init__(self, appender_factory, loop=None, **kwargs):
+        """
+        :param appender_factory: function that takes a port name and returns
+            an appender for that port.
+        :param loop: asyncio event loop, by default a new one.
+        :param kwargs: arguments to AsyncSerialReader.
+        """
+        self.appender_factory = appender_factory
+        self.loop = loop if loop is not None else asyncio.new_event_loop()
+        self.reader_kwargs = kwargs
+        self.readers = {}
+        self.stopped = self.loop.create_future()
+
+    def add(self, port):
+        """
+        Start reading a port. Must be called from the event loop thread.
+        :param port: serial port name
+        :return: the AsyncSerialReader of the port
+        :raises serial.SerialException: if the port cannot be opened.
+        """
+        if port in self.readers:
+            return self.readers[port]
+        appender = self.appender_factory(port)
+        try:
+            reader = AsyncSerialReader(port, appender, self.loop,
+                                       **self.reader_kwargs)
+        except serial.SerialException:
+            appender.done()
+            raise
+        self.readers[port] = reader
+        reader.finished.add_done_callback(self._finished)
+        reader.start()
+        print('Reading {0}'.format(port))
+        return reader
+
+    def _finished(self, future):
+        reader = future.result()
+        if self.readers.get(reader.port) is reader:
+            del self.readers[reader.port]
+        if reader.exception is not None:
+            print('Failed to read {0}: {1}'.format(reader, reader.exception))
+        else:
+            print('Finished {0}'.format(reader))
+
+    def remove(self, port):
+        """
+        Stop reading a port, see AsyncSerialReader.done.
+        :param port: serial port name
+        """
+        if port in self.readers:
+            self.readers[port].done()
+
+    def stop(self):
+        """ Stop reading all ports and let run() return once they finish. """
+        if not self.stopped.done():
+            self.stopped.set_result(None)
+
+    async def run(self):
+        """
+        Read until stop() is called, and then until all ports are finished.
+        """
+        await self.stopped
+        readers = list(self.readers.values())
+        for reader in readers:
+            reader.done()
+        if len(readers) > 0:
+            await asyncio.wait([r.finished for r in readers])
@@ -0,0 +1,205 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Batch decoder of the lanyard device lines. Decodes many base64 lines at once
+into a (N, 16) array and unpacks the detection and system fields with array
+operations.
+"""
+
+import base64
+import numpy as np
+
+B64_ALPHABET = (b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                b'0123456789+/')
+B64_LENGTH = 22
+RECORD_LENGTH = 16
+EXPERIMENT_DATA = b'EXPERIMENT_DATA\x00'
+DETECTION_SLOTS = 6
+
+_B64_INVALID = 0xff
+_B64_LOOKUP = np.full(256, _B64_INVALID, dtype=np.uint8)
+_B64_LOOKUP[np.frombuffer(B64_ALPHABET, dtype=np.uint8)] = np.arange(
+    64, dtype=np.uint8)
+_SEPARATOR_CHAR = ord('/')
+_EXPERIMENT_DATA = np.frombuffer(EXPERIMENT_DATA, dtype=np.uint8)
+
+
+def b64decode_lines(b64lines):
+    """
+    Decode base64 lines of 22 characters, without padding, to 16 bytes each.
+    Lines that are not exactly 22 characters or that contain characters
+    outside the base64 alphabet are decoded one by one, like
+    base64.b64decode would.
+
+    :param b64lines: sequence of N bytes-like base64 lines.
+    :return: tuple of a (N, 16) uint8 array and a boolean (N,) array that is
+        False for lines that could not be decoded.
+    """
+    binary, valid, _ = _b64decode(b64lines)
+    return binary, valid
+
+
+def decode_lines(b64lines):
+    """
+    Decode base64 lines and check their checksums. Separator lines (starting
+    with 21 '/' characters) and the experiment data header are marked as not
+    valid.
+
+    :param b64lines: sequence of N bytes-like base64 lines.
+    :return: tuple of a (N, 16) uint8 array, a boolean (N,) array that is
+        False for lines that carry no data, and a (N,) array of checksums,
+        which are 0 for a correct line.
+    """
+    binary, valid, separator = _b64decode(b64lines)
+    valid &= ~separator
+    valid &= ~(binary == _EXPERIMENT_DATA).all(axis=1)
+    checksums = (binary.sum(axis=1, dtype=np.uint32) % 256).astype(np.uint8)
+    return binary, valid, checksums
+
+
+def _b64decode(b64lines):
+    """
+    Decode base64 lines and detect separator lines.
+    :return: tuple of decoded (N, 16) uint8 array, boolean (N,) array of
+        decodable lines and boolean (N,) array of separator lines.
+    """
+    n = len(b64lines)
+    binary = np.zeros((n, RECORD_LENGTH), dtype=np.uint8)
+    valid = np.ones(n, dtype=bool)
+    separator = np.zeros(n, dtype=bool)
+    if n == 0:
+        return binary, valid, separator
+
+    lengths = np.fromiter((len(b) for b in b64lines), dtype=np.intp, count=n)
+    fixed_idx = np.flatnonzero(lengths == B64_LENGTH)
+    if len(fixed_idx) == n:
+        raw = np.frombuffer(b''.join(b64lines), dtype=np.uint8)
+    else:
+        raw = np.frombuffer(b''.join([b64lines[i] for i in fixed_idx]),
+                            dtype=np.uint8)
+    raw = raw.reshape(-1, B64_LENGTH)
+    separator[fixed_idx] = (raw[:, :B64_LENGTH - 1] ==
+                            _SEPARATOR_CHAR).all(axis=1)
+    sextets = _B64_LOOKUP[raw]
+
+    # pad to 24 characters, that is 6 groups of 4 sextets
+    groups = np.zeros((len(fixed_idx), 24), dtype=np.uint8)
+    groups[:, :B64_LENGTH] = sextets
+    groups = groups.reshape(-1, 6, 4)
+    out = np.empty((len(fixed_idx), 6, 3), dtype=np.uint8)
+    out[:, :, 0] = (groups[:, :, 0] << 2) | (groups[:, :, 1] >> 4)
+    out[:, :, 1] = ((groups[:, :, 1] & 0xf) << 4) | (groups[:, :, 2] >> 2)
+    out[:, :, 2] = ((groups[:, :, 2] & 0x3) << 6) | groups[:, :, 3]
+    binary[fixed_idx] = out.reshape(-1, 18)[:, :RECORD_LENGTH]
+
+    irregular = np.union1d(
+        np.flatnonzero(lengths != B64_LENGTH),
+        fixed_idx[(sextets == _B64_INVALID).any(axis=1)])
+
+    for i in irregular:
+        line = bytes(b64lines[i])
+        if lengths[i] != B64_LENGTH:
+            separator[i] = line.startswith(b'/' * (B64_LENGTH - 1))
+        try:
+            decoded = base64.b64decode(line + b'==')
+        except ValueError:
+            decoded = b''
+        if len(decoded) == RECORD_LENGTH:
+            binary[i] = np.frombuffer(decoded, dtype=np.uint8)
+        else:
+            valid[i] = False
+
+    return binary, valid, separator
+
+
+def unpack_system(binary, line_ids):
+    """
+    Unpack system records.
+
+    :param binary: (N, 16) uint8 array of decoded system lines.
+    :param line_ids: (N,) array of line numbers.
+    :return: dict of (N,) arrays, one per system field.
+    """
+    h = binary.astype(np.int64)
+    return {
+        'line': np.asarray(line_ids, dtype=np.int64),
+        # system.density = 0x12
+        # 00120000 00000000 00000000 00000000
+        'density': h[:, 1],
+        # system.time = 0x12345678ABCDEF
+        # 0000EFCD AB785634 00000000 00000000
+        'time': (h[:, 2] +
+                 (h[:, 3] << 8) +
+                 (h[:, 4] << 16) +
+                 (h[:, 5] << 24) +
+                 (h[:, 6] << 32) +
+                 (h[:, 7] << 36)),
+        # system.auth = 0x1234
+        # 00000000 00000000 34120000 00000000
+        'auth': (h[:, 8] << 8) + h[:, 9],
+        # system.reset = 1
+        # 00000000 00000000 00000100 00000000
+        'reset': h[:, 10] & 0x1,
+        # system.state = 3
+        # 00000000 00000000 00000600 00000000
+        'state': (h[:, 10] & 0x6) >> 1,
+        # system.rtc = 0x123456
+        # 00000000 00000000 00000000 00563412
+        'rtc': h[:, 13] + (h[:, 14] << 8) + (h[:, 15] << 16),
+        # system.detection = 0x123456
+        # 00000000 00000000 0000B0A2 91000000
+        'detection': ((h[:, 10] & ~0x7) +
+                      (h[:, 11] << 8) +
+                      (h[:, 12] << 16)) >> 3,
+    }
+
+
+def unpack_detections(binary, line_ids):
+    """
+    Unpack the six 20-bit detection slots of each detection line. A slot with
+    all bits set terminates the detections of that line.
+
+    :param binary: (N, 16) uint8 array of decoded detection lines.
+    :param line_ids: (N,) array of line numbers.
+    :return: dict of (M,) arrays, one per detection field, in line and slot
+        order.
+    """
+    data = binary[:, 1:]
+    nibbles = np.empty((len(data), 30), dtype=np.int64)
+    nibbles[:, 0::2] = data >> 4
+    nibbles[:, 1::2] = data & 0xf
+    slots = nibbles.reshape(-1, DETECTION_SLOTS, 5)
+
+    terminated = np.logical_or.accumulate(
+        (slots == 0xf).all(axis=2), axis=1)
+    slots = slots[~terminated]
+    lines = np.repeat(np.asarray(line_ids, dtype=np.int64),
+                      DETECTION_SLOTS).reshape(-1, DETECTION_SLOTS)
+
+    return {
+        'line': lines[~terminated],
+        # type = 3
+        # C0000
+        'type': slots[:, 0] >> 2,
+        # rssi = 21 (20 + 1)
+        # 01000
+        'rssi': -(20 + (((slots[:, 0] << 4) + slots[:, 1]) & 0x3f)),
+        # id = 0xABC
+        # 00ABC
+        'id': (slots[:, 2] << 8) + (slots[:, 3] << 4) + slots[:, 4],
+    }
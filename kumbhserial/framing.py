@@ -0,0 +1,233 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Split serial data into records without copying each record.
+
+Data read from a port is collected in a reusable buffer and split at the
+terminator in bulk. Records are passed on as memoryview slices of that
+buffer, which are only valid during the append call: an appender that keeps
+a record must copy it, as ThreadBuffer does.
+
+The receive time and stream offset of each record, and the timestamp for
+records that contain a timestamp token such as '>', are side-band data in a
+RecordMeta. Appenders that have an append_record(record, meta) method get
+the record and its RecordMeta. Other appenders get the record from
+append(), with the timestamp spliced in after the token if it has one, as
+helpers.insert_timestamp would.
+"""
+
+from .helpers import default_clock
+
+# initial size of the framing buffer
+BUFFER_SIZE = 65536
+
+
+class RecordMeta(object):
+    """
+    Side-band data of a framed record. A RecordFramer reuses a single
+    RecordMeta, so it is only valid during the append call.
+    """
+    def __init__(self, separator=b'%'):
+        """
+        :param separator: text to wrap a spliced timestamp in
+        """
+        self.separator = separator
+        # stream offset of the first byte of the record
+        self.offset = 0
+        # wall-clock time that the end of the record was received
+        self.receive_time = None
+        # ISO timestamp bytes, or None if the record has no timestamp token
+        self.timestamp = None
+        # index in the record to insert the timestamp at
+        self.timestamp_index = None
+
+    def splice(self, record):
+        """
+        The record with the timestamp inserted, if it has one.
+        :param record: bytes-like record
+        :return: bytes
+        """
+        record = bytes(record)
+        if self.timestamp is None:
+            return record
+        index = self.timestamp_index
+        return b''.join((record[:index], self.separator, self.timestamp,
+                         self.separator, record[index:]))
+
+
+def record_function(appender):
+    """
+    Function to pass framed records to an appender.
+    :param appender: appender with an append_record(record, meta) method,
+        or with only append(data).
+    :return: function taking a record and its RecordMeta. Without an
+        append_record method, the timestamp of the record is spliced in.
+    """
+    append_record = getattr(appender, 'append_record', None)
+    if append_record is not None:
+        return append_record
+    append = appender.append
+
+    def append_spliced(record, meta):
+        if meta.timestamp is None:
+            append(record)
+        else:
+            append(meta.splice(record))
+
+    return append_spliced
+
+
+class RecordFramer(object):
+    """
+    Splits a byte stream into records at a terminator, see the module
+    documentation. Records that are not terminated yet stay in the buffer
+    until more data is fed, or until flush() is called.
+    """
+    def __init__(self, appender, terminator=b'\r',
+                 insert_timestamp_at=(b'>', b'<'), separator=b'%',
+                 buffer_size=BUFFER_SIZE, clock=None):
+        """
+        :param appender: appender to send records to
+        :param terminator: end-of-record terminator, or None to pass on
+            each fed chunk as a record.
+        :param insert_timestamp_at: tokens after which a record gets a
+            timestamp. Only the first token found in a record is used.
+        :param separator: text to wrap a spliced timestamp in
+        :param buffer_size: initial buffer size in bytes. The buffer grows
+            if a single record does not fit.
+        :param clock: helpers.Clock for receive times and timestamps, by
+            default the shared clock.
+        """
+        self.append_record = record_function(appender)
+        self.terminator = terminator
+        self.tokens = tuple(insert_timestamp_at)
+        self.clock = clock if clock is not None else default_clock
+        self.meta = RecordMeta(separator)
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # number of bytes in the buffer
+        self.length = 0
+        # stream offset of the start of the buffer
+        self.offset = 0
+        self.num_records = 0
+
+    def feed(self, data, receive_time=None):
+        """
+        Add received data and pass on all complete records.
+        :param data: bytes-like data
+        :param receive_time: wall-clock time that the data was received,
+            by default the current time.
+        :return: number of records passed on
+        """
+        size = len(data)
+        if size == 0:
+            return 0
+        if self.length + size > len(self.buffer):
+            self._grow(self.length + size)
+        self.buffer[self.length:self.length + size] = data
+        self.length += size
+        if receive_time is None:
+            receive_time = self.clock.now()
+        self.meta.receive_time = receive_time
+        return self._split(final=self.terminator is None)
+
+    def flush(self):
+        """
+        Pass on the data that is left as a last, unterminated, record.
+        :return: number of records passed on
+        """
+        return self._split(final=True)
+
+    def _split(self, final):
+        buffer = self.buffer
+        view = self.view
+        length = self.length
+        terminator = self.terminator
+        append_record = self.append_record
+        meta = self.meta
+
+        # next position of each token, or -1 if none is left
+        next_tokens = [buffer.find(token, 0, length)
+                       for token in self.tokens]
+        next_token = _first_position(next_tokens)
+
+        num_records = 0
+        start = 0
+        if terminator is None:
+            end = -1
+        else:
+            end = buffer.find(terminator, 0, length)
+        while end != -1 or (final and start < length):
+            if end == -1:
+                end = length
+            else:
+                end += len(terminator)
+            meta.offset = self.offset + start
+            if next_token != -1 and next_token < end:
+                index, token = _first_token(buffer, start, end, self.tokens)
+                meta.timestamp = self.clock.timestamp_bytes(
+                    meta.receive_time)
+                meta.timestamp_index = index + len(token) - start
+                try:
+                    append_record(view[start:end], meta)
+                finally:
+                    meta.timestamp = None
+                    meta.timestamp_index = None
+                next_tokens = [position if position >= end or position == -1
+                               else buffer.find(token, end, length)
+                               for position, token in zip(next_tokens,
+                                                          self.tokens)]
+                next_token = _first_position(next_tokens)
+            else:
+                append_record(view[start:end], meta)
+            num_records += 1
+            start = end
+            if terminator is None or start >= length:
+                end = -1
+            else:
+                end = buffer.find(terminator, start, length)
+
+        # keep the unterminated rest at the start of the buffer
+        rest = length - start
+        if start > 0 and rest > 0:
+            buffer[:rest] = bytes(view[start:length])
+        self.length = rest
+        self.offset += start
+        self.num_records += num_records
+        return num_records
+
+    def _grow(self, size):
+        new_size = len(self.buffer)
+        while new_size < size:
+            new_size *= 2
+        buffer = bytearray(new_size)
+        buffer[:self.length] = self.view[:self.length]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+
+
+def _first_position(positions):
+    """ Smallest position that is not -1, or -1. """
+    found = [p for p in positions if p != -1]
+    return min(found) if len(found) > 0 else -1
+
+
+def _first_token(buffer, start, end, tokens):
+    """ Index and value of the first token in buffer[start:end]. """
+    found = [(buffer.find(token, start, end), token) for token in tokens]
+    return min((index, token) for index, token in found if index != -1)
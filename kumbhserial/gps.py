@@ -19,49 +19,271 @@
 Facilities to read out the Kumbh Mela GPS devices.
 """
 
+import datetime
+import queue
+import re
+import sys
 import threading
+import time
 import serial
-from .reader import SerialReader
+from .helpers import strip_view
 
+# number of seconds without data after which a device is considered empty
+IDLE_TIME = 3
 
-class GpsReaderThread(threading.Thread):
+# example data record, with date ddmmyy, time and coordinates in degrees and
+# minutes:
+# $TI010,230416125520,2310.6876N,07543.6625E,000.00,029.87,14,1#
+GPS_RECORD = re.compile(
+    rb'\$([^,$#]+),(\d{6}(?:[01]\d|2[0-3])[0-5]\d)([0-5]\d),'
+    rb'(\d*[0-5]\d\.\d+)([NS]),(\d*[0-5]\d\.\d+)([EW]),'
+    rb'(-?\d+(?:\.\d*)?),(-?\d+(?:\.\d*)?),(\d+),(\d+)#')
+# number of device minutes to cache the UNIX time of
+MAX_CACHED_MINUTES = 100000
+
+
+class GpsDrain(object):
     """
-    Thread to read out a GPS device
+    Reads out a GPS device: starts the transfer, reads until the device
+    sends its end of data marker '@' and then clears the device. Data is
+    read as it arrives and split into records, so the end marker is noticed
+    as soon as it is received. A device that sends nothing for idle_time
+    seconds is empty, in CHARGE mode or not a GPS device.
     """
-    def __init__(self, port, appender, clear=True, **kwargs):
-        super().__init__()
+    def __init__(self, port, appender, clear=True, idle_time=IDLE_TIME,
+                 poll_time=0.1):
+        """
+        :param port: serial port name
+        :param appender: appender for the GPS records
+        :param clear: clear the device after it was read completely
+        :param idle_time: seconds without data after which to stop reading
+        :param poll_time: serial read timeout in seconds
+        """
+        self.port = port
         self.interpreter = GpsInterpreter(port, appender)
-        self.reader = SerialReader(port, self.interpreter, wait_time=1,
-                                   baud_rate=115200, terminator=b'#',
-                                   insert_timestamp_at=(), **kwargs)
         self.clear = clear
+        self.idle_time = idle_time
+        self.poll_time = poll_time
+        self.num_bytes = 0
+        self.start_time = None
+        self.end_time = None
+        self.end_reached = False
 
     def run(self):
+        """
+        Read out and clear the device. Errors are printed, not raised.
+        """
+        self.start_time = time.monotonic()
         try:
-            writer = GpsWriter(self.reader.comm)
-            writer.start_transfer()
-            print('Reading <{0}>...'.format(self.reader.port))
-            while (not self.interpreter.is_done and
-                   self.interpreter.num_empty < 3):
-                self.reader.read()
-
-            if self.interpreter.has_error():
-                print('Error parsing {0}'.format(self.interpreter))
-            elif self.interpreter.num_records == 0:
-                print('Device <{0}> is empty, set to CHARGE mode, or not a'
-                      ' GPS device.'.format(self.reader.port))
-            elif self.clear:
-                writer.clear()
-                print("Cleared {0}. Done.".format(self.interpreter))
-            else:
-                print('Done reading {0}.'.format(self.interpreter))
-        except serial.SerialException as ex:
+            with serial.Serial(self.port, baudrate=115200,
+                               timeout=self.poll_time) as comm:
+                writer = GpsWriter(comm)
+                writer.start_transfer()
+                print('Reading <{0}>...'.format(self.port))
+                self._read(comm)
+                self.interpreter.flush()
+                self.end_time = time.monotonic()
+
+                if self.interpreter.has_error():
+                    print('Error parsing {0}'.format(self.interpreter))
+                elif self.interpreter.num_records == 0:
+                    print('Device <{0}> is empty, set to CHARGE mode, or not '
+                          'a GPS device.'.format(self.port))
+                elif not self.end_reached:
+                    print('Device {0} stopped sending before the end of its '
+                          'data, not cleared.'.format(self))
+                elif self.clear:
+                    writer.clear()
+                    comm.flush()
+                    print('Cleared {0}. Done.'.format(self))
+                else:
+                    print('Done reading {0}.'.format(self))
+        except (OSError, serial.SerialException) as ex:
             print('Failed to read serial device {0}: {1}'
                   .format(self.interpreter, ex))
         finally:
-            self.reader.done()
-            if not self.interpreter.is_done:
-                self.interpreter.done()
+            if self.end_time is None:
+                self.end_time = time.monotonic()
+            self.interpreter.done()
+
+    def _read(self, comm):
+        buffer = bytearray()
+        last_data = time.monotonic()
+        while True:
+            data = comm.read(max(1, comm.in_waiting))
+            now = time.monotonic()
+            if len(data) == 0:
+                if now - last_data >= self.idle_time:
+                    return
+                continue
+            last_data = now
+            self.num_bytes += len(data)
+            buffer += data
+
+            start = 0
+            end = buffer.find(b'#')
+            while end != -1:
+                self.interpreter.append(bytes(buffer[start:end + 1]))
+                start = end + 1
+                end = buffer.find(b'#', start)
+            del buffer[:start]
+            if buffer.strip() == b'@':
+                self.end_reached = True
+                return
+
+    @property
+    def duration(self):
+        """ Number of seconds spent reading so far. """
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time
+        if end_time is None:
+            end_time = time.monotonic()
+        return end_time - self.start_time
+
+    @property
+    def transfer_rate(self):
+        """ Bytes read per second. """
+        duration = self.duration
+        return self.num_bytes / duration if duration > 0 else 0.0
+
+    def __str__(self):
+        return '{0}, {1:.1f} kB in {2:.1f} s ({3:.1f} kB/s)'.format(
+            self.interpreter, self.num_bytes / 1000, self.duration,
+            self.transfer_rate / 1000)
+
+
+class GpsReaderThread(threading.Thread):
+    """
+    Thread to read out a GPS device
+    """
+    def __init__(self, port, appender, clear=True, **kwargs):
+        """
+        :param port: serial port name
+        :param appender: appender for the GPS records
+        :param clear: clear the device after it was read completely
+        :param kwargs: arguments to GpsDrain
+        """
+        super().__init__()
+        self.drain = GpsDrain(port, appender, clear=clear, **kwargs)
+        self.interpreter = self.drain.interpreter
+
+    def run(self):
+        self.drain.run()
+
+
+class GpsScheduler(object):
+    """
+    Reads out GPS devices with a bounded number of worker threads. Devices
+    that are added while all workers are busy wait in a queue. A device is
+    queued only once while it is waiting or being read; each device gets its
+    own appender when its turn comes.
+    """
+    def __init__(self, appender_factory, workers=4, clear=True, **kwargs):
+        """
+        :param appender_factory: function that takes a port name and returns
+            an appender for that port.
+        :param workers: number of devices to read at the same time
+        :param clear: clear the devices after they were read completely
+        :param kwargs: arguments to GpsDrain
+        """
+        if workers < 1:
+            raise ValueError('Need at least one worker')
+        self.appender_factory = appender_factory
+        self.drain_kwargs = kwargs
+        self.drain_kwargs['clear'] = clear
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.waiting = []
+        self.active = {}
+        self.finished = []
+        self.workers = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def add(self, port):
+        """
+        Queue a device to be read. May be called from any thread.
+        :param port: serial port name
+        :return: whether the device was queued, False if it is already
+            waiting or being read.
+        """
+        with self.lock:
+            if port in self.waiting or port in self.active:
+                return False
+            self.waiting.append(port)
+        self.queue.put(port)
+        return True
+
+    def _work(self):
+        while True:
+            port = self.queue.get()
+            if port is None:
+                return
+            try:
+                appender = self.appender_factory(port)
+            except (OSError, ValueError) as ex:
+                print('Cannot write output of <{0}>: {1}'.format(port, ex))
+                with self.lock:
+                    self.waiting.remove(port)
+                continue
+            drain = GpsDrain(port, appender, **self.drain_kwargs)
+            with self.lock:
+                self.waiting.remove(port)
+                self.active[port] = drain
+            try:
+                drain.run()
+            finally:
+                with self.lock:
+                    del self.active[port]
+                    self.finished.append(drain)
+
+    def stats(self):
+        """
+        Counters of the scheduler.
+        :return: dict with the number of waiting, active and finished
+            devices, and the number of bytes read from finished devices.
+        """
+        with self.lock:
+            return {
+                'waiting': len(self.waiting),
+                'active': len(self.active),
+                'finished': len(self.finished),
+                'bytes': sum(d.num_bytes for d in self.finished),
+            }
+
+    def __repr__(self):
+        with self.lock:
+            active = list(self.active.values())
+            waiting = list(self.waiting)
+            num_finished = len(self.finished)
+            num_bytes = sum(d.num_bytes for d in self.finished)
+        if len(active) == 0 and len(waiting) == 0:
+            ret = 'Not reading any devices'
+        else:
+            ret = '\nNow reading: {0}'.format(
+                ''.join('\n* ' + str(d) for d in active))
+            if len(waiting) > 0:
+                ret += '\nWaiting: {0}'.format(', '.join(waiting))
+        if num_finished > 0:
+            ret += '\nFinished {0} devices, {1:.1f} kB'.format(
+                num_finished, num_bytes / 1000)
+        return ret
+
+    def stop(self):
+        """
+        Waits until all waiting and active devices have been read.
+        """
+        print("Waiting for GPS to finish...")
+        for _ in self.workers:
+            self.queue.put(None)
+        try:
+            for worker in self.workers:
+                worker.join()
+        except KeyboardInterrupt:
+            sys.exit('GPS devices may not be entirely read or cleared. '
+                     'Incomplete files may be left.')
 
 
 class GpsWriter(object):
@@ -80,23 +302,38 @@ class GpsWriter(object):
 
 class GpsInterpreter(object):
     """
-    Interprets the output of a GPS serial device and outputs a dict.
-
-    Records num_records as the number of valid records, and num_empty
-    as the number of consecutive empty data strings received. If num_empty is
-    large, most probably the GPS device will not send any output at all. If the
-    end of the data stream is reached, according to the device data, the
-    interpreter will set is_done to True. The current_id is known as soon as
-    valid data comes in, which contains the device id.
+    Interprets the output of a GPS serial device and outputs a dict per
+    record, with the device ID, the time as seconds since the UNIX epoch
+    (the device time is taken as UTC), the latitude and longitude in signed
+    decimal degrees, the speed, direction, number of satellites and the line
+    number of the device.
+
+    Records are kept as bytes and parsed in batches of batch_size, when
+    flush() is called, or when done. Records num_records as the number of
+    records received, and num_empty as the number of consecutive empty data
+    strings received. If num_empty is large, most probably the GPS device
+    will not send any output at all. If the end of the data stream is
+    reached, according to the device data, the interpreter will set is_done
+    to True. The current_id is known as soon as valid data is parsed, which
+    contains the device id.
     """
-    def __init__(self, port, appender):
+    def __init__(self, port, appender, batch_size=1024):
+        """
+        :param port: serial port name, for reporting
+        :param appender: appender to send record dicts to
+        :param batch_size: number of records to parse at once
+        """
         self.appender = appender
+        self.batch_size = batch_size
         self.errors = []
         self.is_done = False
         self.num_empty = 0
         self.num_records = 0
         self.current_id = None
         self.port = port
+        self.pending = []
+        self._minutes = {}
+        self._device_ids = {}
 
     def has_error(self):
         return len(self.errors) > 0
@@ -107,48 +344,103 @@ class GpsInterpreter(object):
             return
 
         self.num_empty = 0
-        self.num_records += 1
-        data = str(data, encoding='ascii')
-
-        if data == '@':
+        if data[:1] != b'$' and strip_view(data) == b'@':
             self.done()
-        if not data.endswith('#'):
-            self.errors.append('cannot read end of line \'#\': ' + data)
             return
-        if not data.startswith('$'):
-            self.errors.append('Cannot read start of line \'$\': ' + data)
+        self.num_records += 1
+        self.pending.append(bytes(data))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Parse all pending records and send them to the appender.
+        """
+        if len(self.pending) == 0:
             return
-        # example data record:
-        # $TI010,230416125520,2310.6876N,07543.6625E,000.00,029.87,14,1#
-        str_data = str(data[1:-1], encoding='ascii')
-        try:
-            cols = str_data.split(',')
-            self.current_id = cols[0]
-            self.appender.append({
-                'deviceId': self.current_id,
-                'date': '20' + cols[1][4:6] +
-                        '-' + cols[1][2:4] +
-                        '-' + cols[1][0:2],
-                'time': cols[1][6:8] +
-                        ':' + cols[1][8:10] +
-                        ':' + cols[1][10:12],
-                'coordNorthSouth': cols[2][-1:],
-                'latitude': float(cols[2][:-1]) / 100.,
-                'coordEastWest': cols[3][-1:],
-                'longitude': float(cols[3][:-1]) / 100.,
-                'speed': float(cols[4]),
-                'direction': float(cols[5]),
-                'numberOfSatellites': int(cols[6]),
-                'line': int(cols[7]),
+        pending = self.pending
+        self.pending = []
+
+        records = None
+        matches = GPS_RECORD.findall(b''.join(pending))
+        if len(matches) == len(pending):
+            try:
+                records = self._convert(matches)
+            except ValueError:
+                pass
+        if records is None:
+            records = self._parse_each(pending)
+        if len(records) > 0:
+            self.current_id = records[-1]['deviceId']
+        for record in records:
+            self.appender.append(record)
+
+    def _parse_each(self, pending):
+        """
+        Parse records one by one, recording an error for each malformed
+        record.
+        """
+        records = []
+        first_record = self.num_records - len(pending) + 1
+        for i, data in enumerate(pending, first_record):
+            match = GPS_RECORD.search(data)
+            try:
+                if match is None:
+                    raise ValueError('malformed record')
+                records.extend(self._convert([match.groups()]))
+            except ValueError as ex:
+                self.errors.append('cannot parse record #{0}: {1}: {2}'
+                                   .format(i, ex, data))
+        return records
+
+    def _convert(self, matches):
+        """
+        Convert the fields of GPS_RECORD matches to record dicts.
+        :raises ValueError: if a date does not exist.
+        """
+        minutes = self._minutes
+        device_ids = self._device_ids
+        records = []
+        for (device_id, minute, second, latitude, north_south, longitude,
+             east_west, speed, direction, satellites, line) in matches:
+            minute_time = minutes.get(minute)
+            if minute_time is None:
+                minute_time = self._minute_time(minute)
+            name = device_ids.get(device_id)
+            if name is None:
+                name = device_ids[device_id] = str(device_id,
+                                                   encoding='ascii')
+            # degrees and minutes, dddmm.mmmm, to decimal degrees
+            latitude = float(latitude)
+            degrees = latitude // 100
+            latitude = degrees + (latitude - 100 * degrees) / 60
+            longitude = float(longitude)
+            degrees = longitude // 100
+            longitude = degrees + (longitude - 100 * degrees) / 60
+            records.append({
+                'deviceId': name,
+                'timestamp': minute_time + int(second),
+                'latitude': latitude if north_south == b'N' else -latitude,
+                'longitude': longitude if east_west == b'E' else -longitude,
+                'speed': float(speed),
+                'direction': float(direction),
+                'numberOfSatellites': int(satellites),
+                'line': int(line),
             })
-        except IndexError as ex:
-            self.errors.append(
-                'expected 8 columns of data (record #{0}): {1}: {2}'
-                .format(self.num_records, ex, data))
-        except ValueError as ex:
-            self.errors.append(
-                'data types do not match (record #{0}): {1}: {2}'
-                .format(self.num_records, ex, data))
+        return records
+
+    def _minute_time(self, minute):
+        """
+        Seconds since the UNIX epoch of a ddmmyyHHMM device time in UTC.
+        :raises ValueError: if the date does not exist.
+        """
+        if len(self._minutes) >= MAX_CACHED_MINUTES:
+            self._minutes.clear()
+        self._minutes[minute] = int(datetime.datetime(
+            2000 + int(minute[4:6]), int(minute[2:4]), int(minute[0:2]),
+            int(minute[6:8]), int(minute[8:10]),
+            tzinfo=datetime.timezone.utc).timestamp())
+        return self._minutes[minute]
 
     def __str__(self):
         ret = 'GPS <device: {0}>'.format(self.port)
@@ -163,4 +455,5 @@ class GpsInterpreter(object):
     def done(self):
         if not self.is_done:
             self.is_done = True
+            self.flush()
             self.appender.done()
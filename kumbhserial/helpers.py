@@ -41,6 +41,28 @@ def output_filename(directory, prefix, extension):
         prefix, time.strftime("%Y%m%d-%H%M%S"), extension))
 
 
+# bytes that bytes.strip removes
+_WHITESPACE = frozenset(b' \t\n\r\x0b\x0c')
+
+
+def strip_view(data):
+    """
+    Strip leading and trailing ASCII whitespace, as bytes.strip does, without
+    copying the data.
+    :param data: bytes-like data, for example a record of
+        reader.iter_records
+    :return: memoryview of data
+    """
+    view = memoryview(data)
+    start = 0
+    end = len(view)
+    while start < end and view[start] in _WHITESPACE:
+        start += 1
+    while end > start and view[end - 1] in _WHITESPACE:
+        end -= 1
+    return view[start:end]
+
+
 def text_in(quit_commands=('q', 'quit')):
     """
     Allow a user to enter text in a terminal prompt.
@@ -71,30 +93,128 @@ def select_value_from_list(text, value_list):
         return value_list[int(text)]
 
 
+class IsoFormatter(object):
+    """
+    Formats UNIX times as ISO timestamps with the local timezone, the same
+    as datetime.isoformat does. The date, time and timezone are computed
+    once per second, so formatting many times of the same second is cheap.
+    The formatter may be shared between threads.
+    """
+    def __init__(self):
+        # second, date and time text, timezone text
+        self._cache = (None, None, None)
+
+    def format(self, unix_time):
+        """
+        :param unix_time: seconds since the UNIX epoch, as from time.time()
+        :return: ISO timestamp string
+        """
+        second = int(unix_time // 1)
+        microsecond = round((unix_time - second) * 1e6)
+        if microsecond >= 1000000:
+            second += 1
+            microsecond -= 1000000
+        cached_second, prefix, suffix = self._cache
+        if second != cached_second:
+            local = datetime.fromtimestamp(second, timezone.utc).astimezone()
+            text = local.isoformat()
+            prefix = text[:19]
+            suffix = text[19:]
+            self._cache = (second, prefix, suffix)
+        if microsecond == 0:
+            return prefix + suffix
+        return '%s.%06d%s' % (prefix, microsecond, suffix)
+
+
+class Clock(object):
+    """
+    Wall-clock and monotonic readings, and ISO timestamps of the wall clock
+    as str or as bytes to splice into device data. The last timestamp is
+    cached: with a resolution, times are rounded down to a multiple of it,
+    so that all calls within the same tick only look up the cached
+    timestamp. Without a resolution, timestamps have microsecond precision
+    and are still formatted cheaply with an IsoFormatter.
+    """
+    def __init__(self, resolution=None):
+        """
+        :param resolution: resolution of timestamps in seconds, or None for
+            microseconds.
+        """
+        self.resolution = resolution
+        self.formatter = IsoFormatter()
+        # tick, str timestamp, bytes timestamp
+        self._cache = (None, None, None)
+
+    def now(self):
+        """ Wall-clock time in seconds since the UNIX epoch. """
+        return time.time()
+
+    def monotonic(self):
+        """ Monotonic time in seconds, for measuring intervals. """
+        return time.monotonic()
+
+    def timestamp(self, unix_time=None):
+        """
+        ISO timestamp with timezone.
+        :param unix_time: seconds since the UNIX epoch, by default now.
+        :return: str
+        """
+        return self._timestamps(unix_time)[1]
+
+    def timestamp_bytes(self, unix_time=None):
+        """
+        ISO timestamp with timezone, ASCII encoded.
+        :param unix_time: seconds since the UNIX epoch, by default now.
+        :return: bytes
+        """
+        return self._timestamps(unix_time)[2]
+
+    def _timestamps(self, unix_time):
+        if unix_time is None:
+            unix_time = time.time()
+        if self.resolution is None:
+            tick = unix_time
+        else:
+            tick = unix_time // self.resolution
+            unix_time = tick * self.resolution
+        cached = self._cache
+        if cached[0] != tick:
+            text = self.formatter.format(unix_time)
+            cached = (tick, text, bytes(text, encoding='ascii'))
+            self._cache = cached
+        return cached
+
+
+# clock shared by all readers and interpreters
+default_clock = Clock()
+
+
 def timestamp():
     """
     ISO timestamp with timezone.
     :return: string of the current time.
     """
-    return datetime.now(timezone.utc).astimezone().isoformat()
+    return default_clock.timestamp()
 
 
-def insert_timestamp(text, token, separator=b'%'):
+def insert_timestamp(text, token, separator=b'%', clock=None):
     """
     Insert a ISO timestamp in given text after any place that given token is
     encountered. The timestamp is wrapped in two separator tokens.
     :param text: bytes of text
     :param token: bytes token to insert timestamp after
     :param separator: text to wrap the timestamp in
+    :param clock: Clock to take the timestamp from, by default default_clock
     :return: bytes of text
     """
     index = text.find(token)
-    if index != -1:
-        return (text[:index + len(token)] + separator +
-                bytes(timestamp(), encoding='ascii') +
-                separator + text[index + len(token):])
-    else:
+    if index == -1:
         return text
+    index += len(token)
+    if clock is None:
+        clock = default_clock
+    return b''.join((text[:index], separator, clock.timestamp_bytes(),
+                     separator, text[index:]))
 
 
 def dir_files(dir_name):
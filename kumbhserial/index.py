@@ -0,0 +1,214 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Index of the device sessions in raw lanyard dumps, stored in SQLite.
+"""
+
+import os
+import re
+import sqlite3
+from datetime import datetime
+from .compression import open_compressed
+
+SESSION_FIELDS = ('device_id', 'time', 'end_time', 'file', 'start_offset',
+                  'end_offset', 'num_lines', 'detections', 'system', 'error')
+
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z',
+                '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+# a timezone offset with a colon, which %z only parses from Python 3.7
+_OFFSET_COLON = re.compile(r'([+-]\d\d):(\d\d)$')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    device_id INTEGER NOT NULL,
+    time TEXT,
+    end_time TEXT,
+    file TEXT NOT NULL,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER,
+    num_lines INTEGER,
+    detections INTEGER,
+    system INTEGER,
+    error TEXT,
+    unix_time REAL,
+    unix_end_time REAL,
+    PRIMARY KEY (file, start_offset)
+);
+CREATE INDEX IF NOT EXISTS sessions_device
+    ON sessions (device_id, unix_time);
+CREATE INDEX IF NOT EXISTS sessions_time ON sessions (unix_time);
+'''
+
+
+class SessionIndex(object):
+    """
+    Index of device sessions, the logs between a '>' and a '<' line, by
+    device ID, time and location in the raw dump. Adding a session again
+    at the same location of the same file replaces it.
+    """
+    def __init__(self, path, timeout=60):
+        """
+        Open or create an index.
+        :param path: SQLite database file
+        :param timeout: seconds to wait if another process writes the index
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout,
+                                          check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+
+    def add(self, filename, entry_set):
+        """
+        Add a device session read by a TrackerInterpreter.
+        :param filename: raw dump file that the session was read from
+        :param entry_set: TrackerEntrySet
+        """
+        entry_set.flush()
+        error = entry_set.error
+        if isinstance(error, bytes):
+            error = str(error, encoding='ascii', errors='replace')
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sessions VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (entry_set.device_id, entry_set.time, entry_set.end_time,
+                 os.path.abspath(filename), entry_set.start_offset,
+                 entry_set.end_offset, entry_set.num_lines,
+                 len(entry_set.detection_columns),
+                 len(entry_set.system_columns), error,
+                 unix_time(entry_set.time), unix_time(entry_set.end_time)))
+
+    def rename_file(self, filename, new_filename):
+        """
+        Update the sessions of a raw dump that was moved.
+        """
+        with self.connection:
+            self.connection.execute(
+                'UPDATE sessions SET file = ? WHERE file = ?',
+                (os.path.abspath(new_filename), os.path.abspath(filename)))
+
+    def find(self, device_id=None, start=None, end=None, filename=None):
+        """
+        Find sessions, ordered by start time.
+        :param device_id: only sessions of this device
+        :param start: only sessions ending at or after this time, an ISO
+            date or time string or a datetime.
+        :param end: only sessions starting at or before this time, an ISO
+            date or time string or a datetime.
+        :param filename: only sessions from this raw dump
+        :return: list of dicts with SESSION_FIELDS
+        :raises ValueError: if a time cannot be parsed.
+        """
+        conditions = []
+        parameters = []
+        if device_id is not None:
+            conditions.append('device_id = ?')
+            parameters.append(int(device_id))
+        if start is not None:
+            conditions.append('coalesce(unix_end_time, unix_time) >= ?')
+            parameters.append(parse_time(start))
+        if end is not None:
+            conditions.append('unix_time <= ?')
+            parameters.append(parse_time(end))
+        if filename is not None:
+            conditions.append('file = ?')
+            parameters.append(os.path.abspath(filename))
+
+        query = 'SELECT {0} FROM sessions'.format(', '.join(SESSION_FIELDS))
+        if len(conditions) > 0:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY unix_time, file, start_offset'
+        return [dict(zip(SESSION_FIELDS, row))
+                for row in self.connection.execute(query, parameters)]
+
+    def close(self):
+        self.connection.close()
+
+
+def read_session(session):
+    """
+    Read the raw data of a session from its dump. Compressed dumps are
+    decompressed up to the session.
+    :param session: dict as returned by SessionIndex.find
+    :return: bytes
+    """
+    with open_compressed(session['file']) as f:
+        f.seek(session['start_offset'])
+        return f.read(session['end_offset'] - session['start_offset'])
+
+
+class SessionIndexAppender(object):
+    """
+    Adds the TrackerEntrySets of a raw dump to a session index and passes
+    them on. The index is opened at the first session.
+    """
+    def __init__(self, index_path, filename, appender=None):
+        """
+        :param index_path: SQLite database file, see SessionIndex
+        :param filename: raw dump file the sessions are read from
+        :param appender: appender to pass the TrackerEntrySets on to, if any
+        """
+        self.index_path = index_path
+        self.filename = filename
+        self.appender = appender
+        self.index = None
+
+    def append(self, entry_set):
+        if self.index is None:
+            self.index = SessionIndex(self.index_path)
+        self.index.add(self.filename, entry_set)
+        if self.appender is not None:
+            self.appender.append(entry_set)
+
+    def done(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.appender is not None:
+            self.appender.done()
+
+
+def parse_time(text):
+    """
+    Parse an ISO date or time, as written by helpers.timestamp. Times
+    without timezone are taken as local time.
+    :param text: time string or datetime
+    :return: seconds since the UNIX epoch
+    :raises ValueError: if the time cannot be parsed.
+    """
+    if isinstance(text, datetime):
+        return text.timestamp()
+    text = _OFFSET_COLON.sub(r'\1\2', text)
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(text, time_format).timestamp()
+        except ValueError:
+            pass
+    raise ValueError('Cannot parse time {0}'.format(text))
+
+
+def unix_time(text):
+    """
+    Parse a session time.
+    :param text: time string or None
+    :return: seconds since the UNIX epoch, or None if it cannot be parsed
+    """
+    try:
+        return parse_time(text)
+    except (TypeError, ValueError):
+        return None
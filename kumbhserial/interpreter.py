@@ -19,32 +19,70 @@
 Parser and interpreter of the Kumbh Mela lanyard devices.
 """
 
-import base64
-from .helpers import timestamp
+from time import monotonic
+import numpy as np
+from .appenders import record_appender, RECORD_FORMATS
+from .columns import RecordColumns
+from .decoder import decode_lines, unpack_detections, unpack_system
+from .helpers import strip_view, timestamp
+from .stats import instrument
+
+DETECTION_DTYPES = (('line', np.uint32), ('type', np.uint8),
+                    ('rssi', np.int8), ('id', np.uint16))
+SYSTEM_DTYPES = (('line', np.uint32), ('density', np.uint8),
+                 ('time', np.int64), ('auth', np.uint16), ('reset', np.uint8),
+                 ('state', np.uint8), ('rtc', np.uint32),
+                 ('detection', np.uint32))
+TRACKER_FORMATS = RECORD_FORMATS + ('npz',)
+# first bytes of the lines of a device log, and the separators after the
+# line number of detection and system lines
+_START, _END, _DIGIT_0, _DIGIT_2 = b'><02'
+_DETECTION, _SYSTEM = b':-'
 
 
 class TrackerInterpreter(object):
     """
     Parses the raw data from the lanyard devices.
     """
-    def __init__(self, appender):
+    def __init__(self, appender, offset=0, batch_appender=None,
+                 batch_interval=1.0):
+        """
+        :param appender: appender of TrackerEntrySet objects
+        :param offset: byte offset in the raw stream of the first line.
+            The start_offset and end_offset of each TrackerEntrySet are
+            counted from here.
+        :param batch_appender: appender of the records of each decoded
+            batch, as a TrackerEntrySet holding only those records, while the
+            device is still being read. For example to publish the records
+            live.
+        :param batch_interval: with a batch_appender, number of seconds after
+            which pending lines are decoded at the next line.
+        """
         self.appender = appender
         self.current_entries = None
+        self.offset = offset
+        self.batch_appender = batch_appender
+        self.batch_interval = batch_interval
+        self.flushed_at = monotonic()
 
     def append(self, line):
         # if line[0] != '\n':
         # skipping lines not part of the well-defined stream
         # return
 
-        line = bytes(line.strip())
+        start = self.offset
+        self.offset += len(line)
+        # of a device log line, only its base64 data is copied
+        line = strip_view(line)
 
         if len(line) == 0:
             return
-        if line.startswith(b'>'):
+        if line[0] == _START:
+            line = bytes(line)
             if self.current_entries is not None:
                 self.log(
                     error='Starting new device log when the old one was not '
-                          'finished')
+                          'finished', end_offset=start)
             parts = line.split(b'%')
             if len(parts) == 3:
                 time = str(parts[1], encoding='ascii')
@@ -54,30 +92,44 @@ class TrackerInterpreter(object):
                 device_id = line[1:]
 
             self.current_entries = TrackerEntrySet(int(device_id), time)
+            self.current_entries.batch_appender = self.batch_appender
+            self.current_entries.start_offset = start
+            self.current_entries.num_lines = 1
             return
         elif self.current_entries is None:
             # skip lines not generated by a node
             return
 
+        self.current_entries.num_lines += 1
+
         # maximum line address is 279620 with full 4MB data
-        if (line.startswith(b'0') or line.startswith(b'1') or
-                line.startswith(b'2')):
+        if _DIGIT_0 <= line[0] <= _DIGIT_2:
             if len(line) != 29:
-                self.log(error=b'Device log line not length 29: ' + line)
+                self.log(error=b'Device log line not length 29: ' +
+                         bytes(line))
                 return
             else:
                 try:
                     line_id = int(line[:6])
-                    if line[6:].startswith(b':'):
-                        self.current_entries.add_detection(line_id, line[7:])
-                    elif line[6:].startswith(b'-'):
-                        self.current_entries.add_system(line_id, line[7:])
+                    if line[6] == _DETECTION:
+                        self.current_entries.add_detection(
+                            line_id, bytes(line[7:]))
+                    elif line[6] == _SYSTEM:
+                        self.current_entries.add_system(
+                            line_id, bytes(line[7:]))
                     else:
-                        self.log(
-                            error=b'Invalid device log line format: ' + line)
+                        self.log(error=b'Invalid device log line format: ' +
+                                 bytes(line))
                 except ValueError:
-                    self.log(error=b'Invalid device log line format: ' + line)
-        elif line.startswith(b'<'):
+                    self.log(error=b'Invalid device log line format: ' +
+                             bytes(line))
+                if (self.batch_appender is not None and
+                        self.current_entries is not None and
+                        monotonic() - self.flushed_at >= self.batch_interval):
+                    self.current_entries.flush()
+                    self.flushed_at = monotonic()
+        elif line[0] == _END:
+            line = bytes(line)
             parts = line.split(b'%')
             if len(parts) == 3:
                 self.current_entries.end_time = str(parts[1], encoding='ascii')
@@ -94,34 +146,63 @@ class TrackerInterpreter(object):
                     b'ID {1}'.format(self.current_entries.device_id,
                                      line[1:]))
         else:
-            self.log(error=b'Unknown line type: ' + line)
+            self.log(error=b'Unknown line type: ' + bytes(line))
 
-    def log(self, error=None):
+    def log(self, error=None, end_offset=None):
         if self.current_entries is not None:
+            # decode pending lines first, so that an error here comes after
+            # any checksum error
+            self.current_entries.flush()
             if error is not None:
                 self.current_entries.error = error
+            if end_offset is None:
+                end_offset = self.offset
+            self.current_entries.end_offset = end_offset
             self.appender.append(self.current_entries)
             self.current_entries = None
 
     def done(self):
         self.log()
         self.appender.done()
+        if self.batch_appender is not None:
+            self.batch_appender.done()
 
 
 class TrackerEntrySet(object):
     """
     Interprets individual records of the lanyard devices. If their was a
     problem with the device output, the error property will be set.
+
+    Lines are decoded in batches: added lines are kept until batch_size lines
+    are pending or until the detections or system records are requested.
+    Records are stored in system_columns and detection_columns; the system
+    and detections properties give them as lists of dicts.
+
+    When read by a TrackerInterpreter, start_offset and end_offset are the
+    byte range of the device log in the raw stream and num_lines is its
+    number of lines.
+
+    If batch_appender is set, the records of each decoded batch are also
+    appended to it, as a TrackerEntrySet holding only those records and the
+    error so far.
      """
     separator = b'/' * 21
+    batch_size = 8192
 
     def __init__(self, device_id, time):
         self.device_id = device_id
         self.time = time
         self.end_time = None
+        self.start_offset = None
+        self.end_offset = None
+        self.num_lines = 0
+        self.batch_appender = None
         self._error = None
-        self.system = []
-        self.detections = []
+        self.system_columns = RecordColumns(SYSTEM_DTYPES)
+        self.detection_columns = RecordColumns(DETECTION_DTYPES)
+        self._pending_ids = []
+        self._pending_is_system = []
+        self._pending_lines = []
 
     @property
     def error(self):
@@ -133,9 +214,32 @@ class TrackerEntrySet(object):
               .format(self.device_id, error))
         self._error = error
 
+    @property
+    def system(self):
+        self.flush()
+        return list(self.system_columns)
+
+    @system.setter
+    def system(self, system):
+        self.flush()
+        self.system_columns = RecordColumns.from_records(SYSTEM_DTYPES,
+                                                         system)
+
+    @property
+    def detections(self):
+        self.flush()
+        return list(self.detection_columns)
+
+    @detections.setter
+    def detections(self, detections):
+        self.flush()
+        self.detection_columns = RecordColumns.from_records(
+            DETECTION_DTYPES, detections)
+
     def decode(self, b64data):
         """
         Decode the base 64 data and check the checksum. It will ignore the
+        separator and experiment data lines by raising a ValueError.
 
         :param b64data: 22 bytes of base64 encoded binary data.
         :return: decoded bytes.
@@ -144,122 +248,66 @@ class TrackerEntrySet(object):
         # 16bit samples set with all bits 1, in base 64 representation
         #  the last two characters are // as a result and the
         # character preceding it must be f, v or /.
-        if b64data.startswith(TrackerEntrySet.separator):
-            raise ValueError('separator')
-
-        try:
-            binary_data = bytearray(base64.b64decode(b64data + b'=='))
-        except TypeError:
-            self.error = 'data is not in the correct format'
-        else:
-            if binary_data == b'EXPERIMENT_DATA\x00':
-                raise ValueError('experiment data')
-            if sum(binary_data) % 256 != 0:
-                self.error = 'data checksum {0} invalid: {1}'.format(
-                    sum(binary_data) % 256, b64data)
+        binary_data, valid, checksums = decode_lines([b64data])
+        if not valid[0]:
+            raise ValueError('no data')
+        if checksums[0] != 0:
+            self.error = 'data checksum {0} invalid: {1}'.format(
+                checksums[0], bytes(b64data))
 
-            return binary_data
+        return bytearray(binary_data[0])
 
     def add_system(self, line_id, b64data):
-        try:
-            hex_data = self.decode(b64data)
-        except ValueError:
-            return
-        self.system.append({
-            'line': line_id,
-            # system.lrc = 0x12
-            # 12000000 00000000 00000000 00000000
-            # ignore, only a checksum
-            # 'lrc': hex_data[0],
-            # system.density = 0x12
-            # 00120000 00000000 00000000 00000000
-            'density': hex_data[1],
-            # system.time = 0x12345678ABCDEF
-            # 0000EFCD AB785634 00000000 00000000
-            'time': (hex_data[2] +
-                     (hex_data[3] << 8) +
-                     (hex_data[4] << 16) +
-                     (hex_data[5] << 24) +
-                     (hex_data[6] << 32) +
-                     (hex_data[7] << 36)),
-            # system.auth = 0x1234
-            # 00000000 00000000 34120000 00000000
-            'auth': (hex_data[8] << 8) + hex_data[9],
-            # system.reset = 1
-            # 00000000 00000000 00000100 00000000
-            'reset': hex_data[10] & 0x1,
-            # system.state = 3
-            # 00000000 00000000 00000600 00000000
-            # system.state = 2
-            # 00000000 00000000 00000400 00000000
-            'state': (hex_data[10] & 0x6) >> 1,
-            # system.rtc = 0x123456
-            # 00000000 00000000 00000000 00563412
-            'rtc': (hex_data[13] +
-                    (hex_data[14] << 8) +
-                    (hex_data[15] << 16)),
-            # system.detection = 0x123456 (if you left shift this by three you
-            #                              get 91A2B0)
-            # 00000000 00000000 0000B0A2 91000000
-            'detection': ((hex_data[10] & ~0x7) +
-                          (hex_data[11] << 8) +
-                          (hex_data[12] << 16)) >> 3,
-        })
+        self._add_line(line_id, True, b64data)
 
     def add_detection(self, line_id, b64data):
-        # detect.lrc = 0x12
-        try:
-            hex_data = self.decode(b64data)[1:]
-        except ValueError:
+        self._add_line(line_id, False, b64data)
+
+    def _add_line(self, line_id, is_system, b64data):
+        self._pending_ids.append(line_id)
+        self._pending_is_system.append(is_system)
+        self._pending_lines.append(b64data)
+        if len(self._pending_lines) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Decode all pending lines and add their records.
+        """
+        if len(self._pending_lines) == 0:
             return
-        oct_data = []
-        for h in hex_data:
-            oct_data.append((h & 0xf0) >> 4)
-            oct_data.append(h & 0x0f)
-
-        # 12000000 00000000 00000000 00000000
-        #
-        # >put the same 20 bits of data in detect (count 0, 1, 2, 3, 4, 5)
-        #
-        # data = 0x12345
-        # 00123450 00000000 00000000 00000000
-        #
-        # data = 0x12345
-        # 00000001 23450000 00000000 00000000
-        #
-        # etc...
-        for i in range(0, 30, 5):
-            if (oct_data[i] &
-                    oct_data[i + 1] &
-                    oct_data[i + 2] &
-                    oct_data[i + 3] &
-                    oct_data[i + 4]) == 0xf:
-                break
-            self.detections.append({
-                'line': line_id,
-                # type = 3
-                # C0000
-                #
-                # type = 1
-                # 40000
-                'type': (oct_data[i] >> 2),
-                # rssi = 21 (20 + 1)
-                # 01000
-                #
-                # rssi = 82 (20 + 0x3E)
-                # 3E000
-                'rssi': -(20 + (((oct_data[i] << 4) +
-                                 oct_data[i + 1]) & 0x3f)),
-                # id = 0xABC
-                # 00ABC
-                'id': ((oct_data[i + 2] << 8) +
-                       (oct_data[i + 3] << 4) +
-                       oct_data[i + 4])
-            })
+
+        lines = self._pending_lines
+        line_ids = np.array(self._pending_ids, dtype=np.int64)
+        is_system = np.array(self._pending_is_system, dtype=bool)
+        self._pending_ids = []
+        self._pending_is_system = []
+        self._pending_lines = []
+
+        binary, valid, checksums = decode_lines(lines)
+        for i in np.flatnonzero(valid & (checksums != 0)):
+            self.error = 'data checksum {0} invalid: {1}'.format(
+                checksums[i], bytes(lines[i]))
+
+        mask = valid & is_system
+        system = unpack_system(binary[mask], line_ids[mask])
+        self.system_columns.extend(system)
+        mask = valid & ~is_system
+        detections = unpack_detections(binary[mask], line_ids[mask])
+        self.detection_columns.extend(detections)
+
+        if self.batch_appender is not None:
+            batch = TrackerEntrySet(self.device_id, self.time)
+            batch._error = self._error
+            batch.system_columns.extend(system)
+            batch.detection_columns.extend(detections)
+            self.batch_appender.append(batch)
 
     def __str__(self):
+        self.flush()
         ret = 'Device({0} detections, {1} system, {2})'.format(
-                len(self.detections), len(self.system), self.time)
+                len(self.detection_columns), len(self.system_columns),
+                self.time)
         if self.error is not None:
             ret += ' failed: {0}'.format(self.error)
         return ret
@@ -321,18 +369,20 @@ class SeparatedTrackerEntrySetJsonConverter(object):
         self.appender_system = appender_system
 
     def append(self, entry_set):
+        # decoding pending lines may set a checksum error
+        entry_set.flush()
         base = {'deviceId': entry_set.device_id,
                 'time': entry_set.time,
                 'endTime': entry_set.end_time}
         if entry_set.error:
             base['error'] = entry_set.error
 
-        for d in entry_set.detections:
+        for d in entry_set.detection_columns:
             a = base.copy()
             a.update(d)
             self.appender_detections.append(a)
 
-        for s in entry_set.system:
+        for s in entry_set.system_columns:
             a = base.copy()
             a.update(s)
             self.appender_system.append(a)
@@ -342,6 +392,120 @@ class SeparatedTrackerEntrySetJsonConverter(object):
         self.appender_detections.done()
 
 
+class TrackerEntrySetNpzConverter(object):
+    """
+    Converts TrackerEntrySets to a detections and a system NumPy .npz file,
+    without data duplication. Each file contains a table of device blocks
+    and a fixed-width column per record field:
+
+    * block_device_id, block_time, block_end_time, block_error: one value per
+      device block. Times and errors are strings, empty if not known.
+    * block_count: number of records of each device block. The records of
+      block i are at indexes sum(block_count[:i]) up to
+      sum(block_count[:i + 1]).
+    * one column per field, for example line, type, rssi and id for
+      detections.
+
+    Load the files with numpy.load. Files that are concatenated key by key
+    form a valid file. All records are kept in memory and the files are
+    written once done is called, so this suits converting finished dumps,
+    not reading devices.
+    """
+    def __init__(self, filename_detections, filename_system, compress=True):
+        """
+        :param filename_detections: .npz output file for detections
+        :param filename_system: .npz output file for system records
+        :param compress: compress the columns in the .npz files.
+        """
+        self.filename_detections = filename_detections
+        self.filename_system = filename_system
+        self.compress = compress
+        self.blocks = RecordColumns((('device_id', np.uint32),
+                                     ('detections', np.uint32),
+                                     ('system', np.uint32)))
+        self.block_times = []
+        self.block_end_times = []
+        self.block_errors = []
+        self.detections = RecordColumns(DETECTION_DTYPES)
+        self.system = RecordColumns(SYSTEM_DTYPES)
+
+    def append(self, entry_set):
+        entry_set.flush()
+        self.blocks.extend({
+            'device_id': [entry_set.device_id],
+            'detections': [len(entry_set.detection_columns)],
+            'system': [len(entry_set.system_columns)],
+        })
+        self.block_times.append(_text(entry_set.time))
+        self.block_end_times.append(_text(entry_set.end_time))
+        self.block_errors.append(_text(entry_set.error))
+        self.detections.extend(entry_set.detection_columns.columns())
+        self.system.extend(entry_set.system_columns.columns())
+
+    def save(self, filename, count, records):
+        """
+        Write the device blocks with given records to file.
+        """
+        columns = records.columns()
+        columns.update({
+            'block_device_id': self.blocks.column('device_id'),
+            'block_time': np.array(self.block_times, dtype=str),
+            'block_end_time': np.array(self.block_end_times, dtype=str),
+            'block_error': np.array(self.block_errors, dtype=str),
+            'block_count': count,
+        })
+        with open(filename, 'wb') as f:
+            if self.compress:
+                np.savez_compressed(f, **columns)
+            else:
+                np.savez(f, **columns)
+
+    def done(self):
+        self.save(self.filename_detections, self.blocks.column('detections'),
+                  self.detections)
+        self.save(self.filename_system, self.blocks.column('system'),
+                  self.system)
+
+
+def _text(value):
+    """ Convert a string, bytes or None to a string. """
+    if value is None:
+        return ''
+    elif isinstance(value, bytes):
+        return str(value, encoding='ascii', errors='replace')
+    else:
+        return str(value)
+
+
+def tracker_appender(filename_detections, filename_system,
+                     output_format='json', flush=False, compression=None,
+                     stats=None):
+    """
+    Create an appender that writes TrackerEntrySets to a detections and a
+    system file.
+    :param filename_detections: output file for detections
+    :param filename_system: output file for system records
+    :param output_format: one of TRACKER_FORMATS.
+    :param flush: flush to file after writing, if applicable.
+    :param compression: compression method of the JSON formats, one of
+        compression.COMPRESSIONS or None. npz files are always compressed.
+    :param stats: stats.StatsRegistry to instrument the writers with, if
+        any.
+    :raises ValueError: if the output format or compression is not known.
+    """
+    if output_format == 'npz':
+        return instrument(TrackerEntrySetNpzConverter(filename_detections,
+                                                      filename_system),
+                          'npz', stats)
+    return SeparatedTrackerEntrySetJsonConverter(
+        instrument(record_appender(filename_detections, output_format,
+                                   flush=flush, compression=compression),
+                   'detection_json', stats),
+        instrument(record_appender(filename_system, output_format,
+                                   flush=flush, compression=compression),
+                   'system_json', stats))
+
+
 if __name__ == '__main__':
     import sys
     from .appenders import JsonListAppender, Dumper
@@ -21,64 +21,381 @@ Main functions to run scripts from.
 
 from __future__ import print_function
 
-from .gps import GpsReaderThread
-from .helpers import output_filename, dir_files
-from .interpreter import (SeparatedTrackerEntrySetJsonConverter,
-                          TrackerInterpreter)
-from .reader import run_reader, read_file, ReaderSet
-from .sniffer import SnifferInterpreter
-from .appenders import (Dumper, JsonListAppender, Duplicator, ThreadBuffer,
-                        RawPrinter)
-from .ports import resolve_serial_port, choose_serial_port
+from .daemon import DownloadDaemon
+from .gps import GpsDrain, GpsScheduler
+from .helpers import output_filename, dir_files, text_in
+from .index import (SessionIndex, SessionIndexAppender, read_session,
+                    SESSION_FIELDS)
+from .interpreter import (TrackerInterpreter, tracker_appender,
+                          SeparatedTrackerEntrySetJsonConverter,
+                          TRACKER_FORMATS)
+from .processing import convert_files
+from .publisher import RecordPublisher, parse_address
+from .reader import run_reader, read_file
+from .sniffer import SnifferInterpreter, BatchSnifferInterpreter
+from .stats import StatsRegistry, StatsReporter, instrument
+from .appenders import (Duplicator, ThreadBuffer, RawPrinter,
+                        record_appender, open_dumper, RECORD_FORMATS)
+from .compression import (check_compression, compressed_name,
+                          strip_compression_extension)
+from .ports import (resolve_serial_port, choose_serial_port, serial_ports,
+                    PortWatcher)
 from .version import __version__
+import functools
 import sys
 import os
 import shutil
+import signal
 import docopt
 import serial
 
+# maximum number of serial reads held before they are interpreted
+BUFFER_SIZE = 100000
+# seconds after which decoded records are published while reading a device
+PUBLISH_INTERVAL = 1.0
+# session index in the data directory
+INDEX_FILE = 'sessions.sqlite'
+# seconds between statistics reports
+STATS_INTERVAL = 10
+
 
 def download(argv=sys.argv[1:]):
     """
     Listens to a device and dumps it in raw text and JSON format.
     if --no-json is specified, only to [DATA]/raw. Output goes to
     [DATA]/raw/processed and to [DATA]/system and [DATA]/detection.
+    With --multiprocess, a capture process reads the device and writes the
+    raw dump, and a separate process decodes and writes the data, taking it
+    from a shared memory ring buffer.
     Usage:
-      kumbhdownload [-h] [-V] [--data dir] [--no-json] [<device_num>]
+      kumbhdownload [-h] [-V] [--data dir] [--no-json] [--format fmt]
+                    [--compress alg] [--publish sock] [--stats dest]
+                    [--multiprocess] [--ring MB] [<device_num>]
 
     Options:
       <device_num>       TTY or serial port number or name to listen to
       -d, --data dir     Data base directory [default: ./data]
       -J, --no-json      Do not output to JSON, only to raw text.
+      -f, --format fmt   Output format: json or ndjson [default: json]
+      -z, --compress alg  Compress the raw and JSON output with gzip, zstd
+                          or lz4.
+      -p, --publish sock  Publish detection and system records live on a
+                          Unix socket path or a TCP host:port.
+      -s, --stats dest   Report the throughput and latency of each stage
+                         every 10 seconds to standard output (-), a JSON
+                         file (.json) or a Prometheus text file (.prom).
+      -m, --multiprocess  Read the device and decode its data in separate
+                          processes. Needs Python 3.8 or later; ignored
+                          with --no-json.
+      -r, --ring MB      With --multiprocess, size of the ring buffer
+                         between the processes [default: 16]
       -h, --help         This help text
       -V, --version      Version information
     """
     arguments = docopt.docopt(download.__doc__, argv, version=__version__)
+    output_format = resolve_format(arguments['--format'])
+    compression = resolve_compression(arguments['--compress'])
 
     chosen_port = resolve_port(arguments['<device_num>'])
 
-    port_id = chosen_port.split('/')[-1]
-    if arguments['--no-json']:
-        appender = Dumper(output_filename(os.path.join(arguments['--data'],
-                                                       'raw'),
-                                          'dump-' + port_id, 'txt'))
+    if arguments['--multiprocess'] and not arguments['--no-json']:
+        download_processes(chosen_port, arguments, output_format, compression)
+        return
+
+    publisher = start_publisher(arguments['--publish'])
+    stats, reporter = start_stats(arguments['--stats'])
+    if stats is not None and publisher is not None:
+        stats.add_source('publisher', publisher.stats)
+    appender = download_appender(chosen_port, arguments['--data'],
+                                 output_format, arguments['--no-json'],
+                                 buffered=True, publisher=publisher,
+                                 compression=compression, stats=stats)
+    try:
+        read_device(chosen_port, appender)
+    finally:
+        if publisher is not None:
+            publisher.done()
+        if reporter is not None:
+            reporter.done()
+
+
+def download_processes(port, arguments, output_format, compression):
+    """
+    Run download with separate capture and decode processes, see
+    spool.run_spooled_reader, and report how much data was not decoded.
+    :param port: serial port name
+    :param arguments: parsed arguments of download
+    :param output_format: output format, one of appenders.RECORD_FORMATS
+    :param compression: compression method or None
+    """
+    try:
+        ring_size = int(float(arguments['--ring']) * 1024 * 1024)
+        if ring_size <= 0:
+            raise ValueError
+    except ValueError:
+        sys.exit('Ring buffer size {0} is not a positive number.'
+                 .format(arguments['--ring']))
+    if arguments['--publish'] is not None:
+        try:
+            parse_address(arguments['--publish'])
+        except ValueError as ex:
+            sys.exit('Cannot publish on {0}: {1}'
+                     .format(arguments['--publish'], ex))
+    try:
+        # shared memory needs Python 3.8 or later
+        from .spool import run_spooled_reader
+    except ImportError as ex:
+        sys.exit('Cannot use --multiprocess: {0}'.format(ex))
+
+    dump_path = raw_dump_filename(arguments['--data'], port, compression)
+    decoder = functools.partial(
+        decode_download, port=port, data_dir=arguments['--data'],
+        dump_path=dump_path, output_format=output_format,
+        compression=compression, publish=arguments['--publish'],
+        stats_destination=arguments['--stats'])
+    try:
+        ring_stats, exit_code = run_spooled_reader(
+            port, decoder, ring_size, dump_path=dump_path,
+            compression=compression)
+    except KeyboardInterrupt:
+        sys.exit("Force quit")
+    if exit_code != 0:
+        print('Decoding failed. The raw dump {0} is complete; convert it '
+              'with kumbhprocessor {0}'.format(dump_path))
+    elif ring_stats['lost_bytes'] > 0:
+        print('{0} of {1} bytes in {2} reads were not decoded because the '
+              'ring buffer was full; consider a larger --ring. The raw dump '
+              '{3} is complete.'.format(
+                  ring_stats['lost_bytes'],
+                  ring_stats['lost_bytes'] + ring_stats['captured'],
+                  ring_stats['lost_reads'], dump_path))
     else:
-        dumper = Dumper(output_filename(os.path.join(arguments['--data'],
-                                                     'raw', 'processed'),
-                                        'dump-' + port_id, 'txt'))
-        filename_detections = output_filename(
-            os.path.join(arguments['--data'], 'detection'),
-            'detection-' + port_id, 'json')
-        filename_system = output_filename(
-            os.path.join(arguments['--data'], 'system'),
-            'system-' + port_id, 'json')
-        tracker = TrackerInterpreter(
-            SeparatedTrackerEntrySetJsonConverter(
-                JsonListAppender(Dumper(filename_detections, flush=False)),
-                JsonListAppender(Dumper(filename_system, flush=False))))
-        appender = Duplicator([ThreadBuffer(tracker), dumper])
+        print('Read and decoded {0} bytes.'.format(ring_stats['captured']))
+
+
+def decode_download(ring, port, data_dir, dump_path, output_format='json',
+                    compression=None, publish=None, stats_destination=None):
+    """
+    Decode the data of a download device from a ring buffer, in the decode
+    process of download_processes.
+    :param ring: spool.SharedRing
+    :param port: serial port name
+    :param data_dir: data base directory
+    :param dump_path: raw dump that the capture process writes
+    :param output_format: output format, one of appenders.RECORD_FORMATS
+    :param compression: compression method or None
+    :param publish: socket address to publish records on, or None
+    :param stats_destination: where to report statistics to, or None
+    """
+    from .spool import drain
+
+    publisher = start_publisher(publish)
+    stats, reporter = start_stats(stats_destination)
+    if stats is not None:
+        stats.add_source('ring ' + port.split('/')[-1], ring.stats)
+        if publisher is not None:
+            stats.add_source('publisher', publisher.stats)
+    appender = download_appender(port, data_dir, output_format,
+                                 publisher=publisher, compression=compression,
+                                 stats=stats, dump_path=dump_path)
+    try:
+        drain(ring, appender)
+    finally:
+        if publisher is not None:
+            publisher.done()
+        if reporter is not None:
+            reporter.done()
+        ring.release()
+
 
-    read_device(chosen_port, appender)
+def raw_dump_filename(data_dir, port, compression=None):
+    """
+    New file name of the raw dump of a download device that is interpreted
+    while reading.
+    :param data_dir: data base directory
+    :param port: serial port name
+    :param compression: compression method of the dump, or None
+    :return: file path in [DATA]/raw/processed
+    """
+    return output_filename(os.path.join(data_dir, 'raw', 'processed'),
+                           'dump-' + port.split('/')[-1],
+                           compressed_name('txt', compression))
+
+
+def download_appender(port, data_dir, output_format='json', raw_only=False,
+                      buffered=False, publisher=None, compression=None,
+                      stats=None, dump_path=None):
+    """
+    Create an appender that dumps the data of a download device in raw text
+    and, unless raw_only is set, interprets it and indexes the device
+    sessions. See download.
+    :param port: serial port name
+    :param data_dir: data base directory
+    :param output_format: output format, see interpreter.TRACKER_FORMATS
+    :param raw_only: only dump raw text to [DATA]/raw
+    :param buffered: interpret the data in a separate thread
+    :param publisher: RecordPublisher to also publish the detection and
+        system records on, unless raw_only is set.
+    :param compression: compression method of the raw and JSON output, see
+        compression.COMPRESSIONS.
+    :param stats: stats.StatsRegistry to instrument the stages with, if any.
+    :param dump_path: raw dump that is written elsewhere, for example by a
+        capture process. The appender then only interprets the data and
+        indexes the sessions in this dump.
+    :return: appender
+    """
+    port_id = port.split('/')[-1]
+    raw_extension = compressed_name('txt', compression)
+    if raw_only:
+        return instrument(open_dumper(
+            output_filename(os.path.join(data_dir, 'raw'), 'dump-' + port_id,
+                            raw_extension),
+            compression=compression), 'raw_dump', stats)
+
+    if dump_path is None:
+        dump_path = raw_dump_filename(data_dir, port, compression)
+        dumper = instrument(open_dumper(dump_path, compression=compression),
+                            'raw_dump', stats)
+    else:
+        dumper = None
+    filename_detections = output_filename(
+        os.path.join(data_dir, 'detection'), 'detection-' + port_id,
+        output_extension(output_format, compression))
+    filename_system = output_filename(
+        os.path.join(data_dir, 'system'), 'system-' + port_id,
+        output_extension(output_format, compression))
+    entry_appender = tracker_appender(filename_detections, filename_system,
+                                      output_format, compression=compression,
+                                      stats=stats)
+    if publisher is not None:
+        # publish each decoded batch, not only whole device logs
+        batch_appender = instrument(SeparatedTrackerEntrySetJsonConverter(
+            publisher.channel('detection'), publisher.channel('system')),
+            'publish', stats)
+    else:
+        batch_appender = None
+    tracker = instrument(TrackerInterpreter(
+        instrument(SessionIndexAppender(os.path.join(data_dir, INDEX_FILE),
+                                        dump_path, entry_appender),
+                   'index', stats),
+        batch_appender=batch_appender, batch_interval=PUBLISH_INTERVAL),
+        'tracker', stats)
+    if buffered:
+        tracker = ThreadBuffer(tracker, maxsize=BUFFER_SIZE)
+        if stats is not None:
+            stats.add_source('buffer ' + port_id, tracker.stats)
+            tracker = stats.wrap(tracker, 'buffer')
+    if dumper is None:
+        return instrument(tracker, 'read', stats)
+    return instrument(Duplicator([tracker, dumper]), 'read', stats)
+
+
+def daemon(argv=sys.argv[1:]):
+    """
+    Listens to many devices at once from a single thread, and dumps each in
+    raw text and JSON format, as kumbhdownload does. Without device numbers,
+    all serial ports are read.
+    Usage:
+      kumbhdaemon [-h] [-V] [--data dir] [--no-json] [--format fmt]
+                  [--compress alg] [--watch] [--publish sock]
+                  [--stats dest] [<device_num>...]
+
+    Options:
+      <device_num>       TTY or serial port numbers or names to listen to
+      -d, --data dir     Data base directory [default: ./data]
+      -J, --no-json      Do not output to JSON, only to raw text.
+      -f, --format fmt   Output format: json or ndjson [default: json]
+      -z, --compress alg  Compress the raw and JSON output with gzip, zstd
+                          or lz4.
+      -w, --watch        Also read devices that are plugged in later.
+      -p, --publish sock  Publish detection and system records live on a
+                          Unix socket path or a TCP host:port.
+      -s, --stats dest   Report the throughput and latency of each stage
+                         every 10 seconds to standard output (-), a JSON
+                         file (.json) or a Prometheus text file (.prom).
+      -h, --help         This help text
+      -V, --version      Version information
+    """
+    arguments = docopt.docopt(daemon.__doc__, argv, version=__version__)
+    output_format = resolve_format(arguments['--format'])
+    compression = resolve_compression(arguments['--compress'])
+
+    try:
+        if arguments['<device_num>']:
+            ports = [resolve_serial_port(p) for p in arguments['<device_num>']]
+        else:
+            ports = serial_ports()
+    except ValueError as ex:
+        sys.exit(ex)
+    if len(ports) == 0 and not arguments['--watch']:
+        sys.exit('No serial device detected.')
+
+    publisher = start_publisher(arguments['--publish'])
+    stats, reporter = start_stats(arguments['--stats'])
+    if stats is not None and publisher is not None:
+        stats.add_source('publisher', publisher.stats)
+    reader_daemon = DownloadDaemon(
+        lambda port: download_appender(port, arguments['--data'],
+                                       output_format, arguments['--no-json'],
+                                       publisher=publisher,
+                                       compression=compression,
+                                       stats=stats))
+    loop = reader_daemon.loop
+    for port in ports:
+        try:
+            reader_daemon.add(port)
+        except serial.SerialException as ex:
+            print('Cannot open serial port {0}: {1}'.format(port, ex))
+
+    def read_command():
+        line = sys.stdin.readline()
+        if len(line) == 0:
+            loop.remove_reader(sys.stdin)
+        if len(line) == 0 or line.strip().lower() in ('q', 'quit'):
+            print('Stopping all devices... WAIT UP TO 12 SECONDS!')
+            reader_daemon.stop()
+
+    if arguments['--watch']:
+        watch_ports(reader_daemon)
+
+    print('Type q or quit to quit.')
+    loop.add_reader(sys.stdin, read_command)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, reader_daemon.stop)
+    try:
+        loop.run_until_complete(reader_daemon.run())
+    finally:
+        loop.close()
+        if publisher is not None:
+            publisher.done()
+        if reporter is not None:
+            reporter.done()
+
+
+def watch_ports(reader_daemon, interval=1):
+    """
+    Add ports to a download daemon as soon as they are plugged in. The ports
+    are scanned from the event loop of the daemon.
+    :param reader_daemon: DownloadDaemon
+    :param interval: seconds between scans
+    """
+    watcher = PortWatcher()
+    watcher.scan()
+
+    def port_changed(event, port):
+        if event == 'added' and not reader_daemon.stopped.done():
+            try:
+                reader_daemon.add(port)
+            except serial.SerialException as ex:
+                print('Cannot open serial port {0}: {1}'.format(port, ex))
+
+    def scan():
+        if not reader_daemon.stopped.done():
+            watcher.scan()
+            reader_daemon.loop.call_later(interval, scan)
+
+    watcher.subscribe(port_changed)
+    reader_daemon.loop.call_later(interval, scan)
 
 
 def sniffer(argv=sys.argv[1:]):
@@ -86,44 +403,85 @@ def sniffer(argv=sys.argv[1:]):
     Listens to the sniffer node and outputs the real time and network time
     in JSON format. Output goes to $DATA/sniffer.
     Usage:
-      kumbhsniffer [-h] [-V] [--data dir] [--print] [<device_num>]
+      kumbhsniffer [-h] [-V] [--data dir] [--print] [--format fmt]
+                   [--batch] [--epoch] [--stats dest] [<device_num>]
 
     Options:
       <device_num>       TTY or serial port number or name to listen to
       -d, --data dir     Data base directory [default: data]
       -p, --print        Print data to screen
+      -f, --format fmt   JSON output format: json or ndjson [default: json]
+      -b, --batch        Parse lines in batches, for busy sniffer nodes.
+                         Malformed lines are skipped.
+      -e, --epoch        With --batch, write timestamps as seconds since
+                         the UNIX epoch instead of ISO timestamps.
+      -s, --stats dest   Report the throughput and latency of each stage
+                         every 10 seconds to standard output (-), a JSON
+                         file (.json) or a Prometheus text file (.prom).
       -h, --help         This help text
       -V, --version      Version information
     """
     arguments = docopt.docopt(sniffer.__doc__, argv, version=__version__)
+    output_format = resolve_format(arguments['--format'])
 
     chosen_port = resolve_port(arguments['<device_num>'])
     filename = output_filename(os.path.join(arguments['--data'], 'sniffer'),
-                               'sniffer', 'json')
-    appender = JsonListAppender(Dumper(filename))
+                               'sniffer', output_format)
+    stats, reporter = start_stats(arguments['--stats'])
+    appender = instrument(record_appender(filename, output_format), 'json',
+                          stats)
     if arguments['--print']:
         appender = Duplicator([appender, RawPrinter()])
 
-    interpreter = SnifferInterpreter(appender)
-    read_device(chosen_port, interpreter)
+    if arguments['--batch']:
+        interpreter = BatchSnifferInterpreter(
+            appender,
+            timestamp_format='epoch' if arguments['--epoch'] else 'iso')
+    else:
+        interpreter = SnifferInterpreter(appender)
+    try:
+        read_device(chosen_port, instrument(interpreter, 'sniffer', stats))
+    finally:
+        if reporter is not None:
+            reporter.done()
 
 
 def processor(argv=sys.argv[1:]):
     """
     Process raw files and convert them to JSON. Input is all files in
     [DATA]/raw and output goes to [DATA]/system and [DATA]/detection. The
-    original file is moved to [DATA]/raw/processed.
+    original file is moved to [DATA]/raw/processed. The progress is kept in
+    [DATA]/checkpoints, so that an interrupted conversion resumes where it
+    stopped when run again. Device sessions are added to the index in
+    [DATA]/sessions.sqlite, see kumbhindex.
 
     Usage:
-      kumbhprocessor [-h] [-V] [--data dir] [<input>]
+      kumbhprocessor [-h] [-V] [--data dir] [--jobs N] [--format fmt]
+                     [--compress alg] [--stats dest] [<input>]
 
     Options:
       <input>            File or directory to read from, if not [DATA]/raw.
       -d, --data dir     Data base directory [default: data]
+      -j, --jobs N       Number of files or device blocks to convert in
+                         parallel [default: 1]
+      -f, --format fmt   Output format: json, ndjson or npz [default: json]
+      -z, --compress alg  Compress the JSON output with gzip, zstd or lz4.
+                          Compressed raw files are always read.
+      -s, --stats dest   Report the throughput and latency of each stage
+                         every 10 seconds to standard output (-), a JSON
+                         file (.json) or a Prometheus text file (.prom).
       -h, --help         This help text
       -V, --version      Version information
     """
     arguments = docopt.docopt(processor.__doc__, argv, version=__version__)
+    output_format = resolve_format(arguments['--format'], TRACKER_FORMATS)
+    compression = resolve_compression(arguments['--compress'])
+
+    try:
+        jobs = int(arguments['--jobs'])
+    except ValueError:
+        sys.exit('Number of jobs {0} is not a number.'
+                 .format(arguments['--jobs']))
 
     if arguments['<input>']:
         if os.path.isdir(arguments['<input>']):
@@ -150,29 +508,49 @@ def processor(argv=sys.argv[1:]):
     if not os.path.exists(processed_dir):
         os.mkdir(processed_dir)
 
-    for i, path in enumerate(files):
-        filename = os.path.basename(path)
-        print("Converting {0} out of {1}: {2}"
-              .format(i + 1, len(files), filename))
-        base = os.path.splitext(filename)[0]
+    conversions = []
+    for path in sorted(files):
+        base = os.path.splitext(os.path.basename(
+            strip_compression_extension(path)))[0]
+        extension = output_extension(output_format, compression)
         filename_detections = output_filename(
             os.path.join(arguments['--data'], 'detection'),
-            'detection-' + base, 'json')
+            'detection-' + base, extension)
         filename_system = output_filename(
             os.path.join(arguments['--data'], 'system'),
-            'system-' + base, 'json')
-        tracker = TrackerInterpreter(
-            SeparatedTrackerEntrySetJsonConverter(
-                JsonListAppender(Dumper(filename_detections, flush=False)),
-                JsonListAppender(Dumper(filename_system, flush=False))))
-
-        read_file(path, tracker)
-
+            'system-' + base, extension)
+        conversions.append((path, filename_detections, filename_system))
+
+    failed = []
+    checkpoint_dir = os.path.join(arguments['--data'], 'checkpoints')
+    index_path = os.path.join(arguments['--data'], INDEX_FILE)
+    stats, reporter = start_stats(arguments['--stats'])
+    for conversion, error in convert_files(conversions, jobs=jobs,
+                                           output_format=output_format,
+                                           checkpoint_dir=checkpoint_dir,
+                                           index=index_path,
+                                           compression=compression,
+                                           stats=stats):
+        path = conversion[0]
+        if error is not None:
+            failed.append((path, error))
+            continue
         try:
-            shutil.move(path, processed_dir)
+            new_path = shutil.move(path, processed_dir)
         except OSError as ex:
             print("Failed to move {0} to {1}: {2}"
                   .format(path, processed_dir, ex))
+        else:
+            session_index = SessionIndex(index_path)
+            session_index.rename_file(path, new_path)
+            session_index.close()
+    if reporter is not None:
+        reporter.done()
+
+    print("Converted {0} out of {1} files."
+          .format(len(files) - len(failed), len(files)))
+    for path, error in failed:
+        print("Failed to convert {0}: {1}".format(path, error))
 
 
 def gps(argv=sys.argv[1:]):
@@ -182,22 +560,51 @@ def gps(argv=sys.argv[1:]):
     original file is moved to [DATA]/raw/processed.
 
     Usage:
-      kumbhgps [-h] [-V] [--data dir] [--format format] [--no-lookup] [--no-clear] [--listen] [<device_num>]
+      kumbhgps [-h] [-V] [--data dir] [--format fmt] [--compress alg]
+               [--no-lookup] [--no-clear] [--listen [--auto]]
+               [--workers num] [--stats dest] [<device_num>]
 
     Options:
       <device_num>         TTY or serial port number or name to listen to
       -l, --listen         Keep listening for devices.
+      -a, --auto           With --listen, read each device as soon as it is
+                           plugged in, without asking for the port.
+      -w, --workers num    With --listen, number of devices to read at the
+                           same time [default: 4]
       -C, --no-clear       Do not clear the device after reading
       -d, --data dir       Data base directory [default: data]
+      -f, --format fmt     JSON output format: json or ndjson [default: json]
+      -z, --compress alg   Compress the JSON output with gzip, zstd or lz4.
+      -s, --stats dest     Report the throughput and latency of each stage
+                           every 10 seconds to standard output (-), a JSON
+                           file (.json) or a Prometheus text file (.prom).
       -h, --help           This help text
       -L, --no-lookup      Do not look up the device number
       -V, --version        Version information
     """
     arguments = docopt.docopt(gps.__doc__, argv, version=__version__)
+    resolve_format(arguments['--format'])
+    resolve_compression(arguments['--compress'])
 
-    if arguments['--listen']:
-        continuous_gps(arguments)
-        return
+    stats, reporter = start_stats(arguments['--stats'])
+    try:
+        if arguments['--listen']:
+            continuous_gps(arguments, stats)
+        else:
+            read_gps(arguments, stats)
+    finally:
+        if reporter is not None:
+            reporter.done()
+
+
+def read_gps(arguments, stats=None):
+    """
+    Read a single GPS device.
+    :param arguments: dict of arguments from docopt
+    :param stats: stats.StatsRegistry to instrument the output with, if any
+    """
+    output_format = arguments['--format']
+    compression = arguments['--compress']
 
     if not arguments['--no-lookup']:
         chosen_port = resolve_port(arguments['<device_num>'])
@@ -207,47 +614,236 @@ def gps(argv=sys.argv[1:]):
         sys.exit('Provide a device if specifying --no-lookup')
 
     filename = output_filename(os.path.join(arguments['--data'], 'gps'),
-                               'gps', 'json')
-
-    try:
-        reader = GpsReaderThread(chosen_port,
-                                 JsonListAppender(Dumper(filename)),
-                                 clear=not arguments['--no-clear'])
-    except serial.SerialException as ex:
-        print('Cannot open serial port {0}: {1}'.format(chosen_port, ex))
-    else:
-        reader.start()
-        reader.join()
-        print("Quit.")
+                               'gps', output_extension(output_format,
+                                                       compression))
+    appender = instrument(record_appender(filename, output_format,
+                                          compression=compression),
+                          'json', stats)
+    GpsDrain(chosen_port, appender, clear=not arguments['--no-clear']).run()
+    print("Quit.")
 
 
-def continuous_gps(arguments):
+def continuous_gps(arguments, stats=None):
     """
     Continuously listen for new GPS devices.
     :param arguments: dict of arguments from docopt
+    :param stats: stats.StatsRegistry to instrument the output with, if any
     """
-    readers = ReaderSet()
+    if arguments['--auto']:
+        watch_gps(arguments, stats)
+        return
+
+    scheduler = gps_scheduler(arguments, stats)
     try:
         while True:
-            chosen_port = choose_serial_port(readers)
-            filename = output_filename(
-                os.path.join(arguments['--data'], 'gps'), 'gps', 'json')
-            try:
-                readers.start(GpsReaderThread(
-                    chosen_port, JsonListAppender(Dumper(filename)),
-                    clear=not arguments['--no-clear']))
-            except serial.SerialException as ex:
-                print('Cannot open serial port {0}: {1}'
-                      .format(chosen_port, ex))
+            chosen_port = choose_serial_port(scheduler)
+            if not scheduler.add(chosen_port):
+                print('Device <{0}> is already being read.'
+                      .format(chosen_port))
     except ValueError as ex:
-        readers.stop()
+        scheduler.stop()
         print(ex)
         sys.exit(0)
     except KeyboardInterrupt as ex:
-        readers.stop()
+        scheduler.stop()
         sys.exit(ex)
 
 
+def watch_gps(arguments, stats=None):
+    """
+    Read every GPS device as soon as it is plugged in, until the user quits.
+    Ports that are present at the start are not read.
+    :param arguments: dict of arguments from docopt
+    :param stats: stats.StatsRegistry to instrument the output with, if any
+    """
+    scheduler = gps_scheduler(arguments, stats)
+    watcher = PortWatcher()
+    watcher.scan()
+
+    def port_changed(event, port):
+        if event == 'added':
+            scheduler.add(port)
+
+    watcher.subscribe(port_changed)
+    watcher.start()
+    print('Plug in GPS devices to read them. Press ENTER to show the '
+          'devices, type q or quit to quit.')
+    try:
+        while True:
+            text_in()
+            print(scheduler)
+    except ValueError as ex:
+        print(ex)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        scheduler.stop()
+
+
+def gps_scheduler(arguments, stats=None):
+    """
+    Create a scheduler that reads GPS devices into their own output files.
+    :param arguments: dict of arguments from docopt
+    :param stats: stats.StatsRegistry to instrument the output with, if any
+    :return: GpsScheduler
+    """
+    output_format = arguments['--format']
+    compression = arguments['--compress']
+    try:
+        workers = int(arguments['--workers'])
+        if workers < 1:
+            raise ValueError
+    except ValueError:
+        sys.exit('--workers must be a positive number')
+
+    def appender_factory(port):
+        # devices read at the same time need different file names
+        prefix = 'gps-' + os.path.basename(port)
+        filename = output_filename(os.path.join(arguments['--data'], 'gps'),
+                                   prefix, output_extension(output_format,
+                                                            compression))
+        return instrument(record_appender(filename, output_format,
+                                          compression=compression),
+                          'json', stats)
+
+    scheduler = GpsScheduler(appender_factory, workers=workers,
+                             clear=not arguments['--no-clear'])
+    if stats is not None:
+        stats.add_source('gps', scheduler.stats)
+    return scheduler
+
+
+def index(argv=sys.argv[1:]):
+    """
+    Find device sessions in the index of raw dumps. The index is filled by
+    kumbhdownload, kumbhdaemon and kumbhprocessor, or by adding raw dumps
+    explicitly. Sessions are printed as a table, or with --raw, their raw
+    data is written to standard output.
+
+    Usage:
+      kumbhindex [-h] [-V] [--data dir] [--stats dest] add <file>...
+      kumbhindex [-h] [-V] [--data dir] [--device id] [--from time]
+                 [--to time] [--file file] [--raw]
+
+    Options:
+      -d, --data dir     Data base directory [default: data]
+      -i, --device id    Only sessions of given device ID
+      -f, --from time    Only sessions ending after given ISO date or time
+      -t, --to time      Only sessions starting before given ISO date or time
+      -F, --file file    Only sessions in given raw dump
+      -r, --raw          Write the raw data of the sessions
+      -s, --stats dest   Report the throughput and latency of each stage
+                         every 10 seconds to standard output (-), a JSON
+                         file (.json) or a Prometheus text file (.prom).
+      -h, --help         This help text
+      -V, --version      Version information
+    """
+    arguments = docopt.docopt(index.__doc__, argv, version=__version__)
+    index_path = os.path.join(arguments['--data'], INDEX_FILE)
+
+    if arguments['add']:
+        stats, reporter = start_stats(arguments['--stats'])
+        for path in arguments['<file>']:
+            read_file(path, instrument(TrackerInterpreter(instrument(
+                SessionIndexAppender(index_path, path), 'index', stats)),
+                'tracker', stats))
+        if reporter is not None:
+            reporter.done()
+        return
+
+    if not os.path.exists(index_path):
+        sys.exit('Index {0} does not exist.'.format(index_path))
+    session_index = SessionIndex(index_path)
+    try:
+        sessions = session_index.find(
+            arguments['--device'], arguments['--from'], arguments['--to'],
+            arguments['--file'])
+    except ValueError as ex:
+        sys.exit(ex)
+    finally:
+        session_index.close()
+
+    if arguments['--raw']:
+        for session in sessions:
+            sys.stdout.buffer.write(read_session(session))
+        sys.stdout.flush()
+    else:
+        print('\t'.join(SESSION_FIELDS))
+        for session in sessions:
+            print('\t'.join(str(session[key]) for key in SESSION_FIELDS))
+
+
+def start_publisher(address):
+    """
+    Start publishing records on a socket, exiting if that fails.
+    :param address: socket address, see publisher.parse_address, or None
+    :return: started RecordPublisher or None if no address is given
+    """
+    if address is None:
+        return None
+    try:
+        publisher = RecordPublisher(address)
+    except (ValueError, OSError) as ex:
+        sys.exit('Cannot publish on {0}: {1}'.format(address, ex))
+    publisher.start()
+    print('Publishing records on {0}'.format(address))
+    return publisher
+
+
+def start_stats(destination):
+    """
+    Start reporting statistics periodically.
+    :param destination: where to report to, see stats.parse_destination, or
+        None to disable statistics.
+    :return: tuple of a StatsRegistry and a started StatsReporter, or of
+        None and None if no destination is given.
+    """
+    if destination is None:
+        return None, None
+    registry = StatsRegistry()
+    reporter = StatsReporter(registry, destination, interval=STATS_INTERVAL)
+    reporter.start()
+    return registry, reporter
+
+
+def resolve_compression(compression):
+    """
+    Check a compression method, exiting if it cannot be used.
+    :param compression: compression method or None
+    :return: the compression method or None
+    """
+    if compression is not None:
+        try:
+            check_compression(compression)
+        except ValueError as ex:
+            sys.exit(ex)
+    return compression
+
+
+def output_extension(output_format, compression):
+    """
+    File extension of output files. npz files are not compressed further.
+    """
+    if output_format == 'npz':
+        return output_format
+    return compressed_name(output_format, compression)
+
+
+def resolve_format(output_format, formats=RECORD_FORMATS):
+    """
+    Check the output format given on the command line. The function will exit
+    if it is not known.
+    :param output_format: output format name
+    :param formats: valid output formats
+    :return: valid output format
+    """
+    if output_format not in formats:
+        sys.exit('Output format {0} not one of {1}'
+                 .format(output_format, ', '.join(formats)))
+    return output_format
+
+
 def resolve_port(port):
     """
     Resolve given port or query the user for it. The function will exit if the
@@ -21,37 +21,161 @@ Listing and selecting serial port devices.
 
 import sys
 import glob
+import os
+import threading
 import serial
 from .helpers import text_in, select_value_from_list
 
 
-def serial_ports():
+def port_patterns():
     """
-    Lists serial port names. It may take some time: for each of the systems
-    serial ports it checks whether it is accessible for the current user.
-
+    Glob patterns of serial port device files on the current platform.
     :raises EnvironmentError: unsupported operating system or platform.
-    :return: A list of the serial ports available on the system
+    :return: tuple of patterns, or None if ports are not files.
     """
     if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
+        return None
     elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
         # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
+        return ('/dev/tty[A-Za-z]*',)
     elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
+        return ('/dev/tty.*',)
     else:
         raise EnvironmentError('Unsupported platform')
 
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
+
+def probe_port(port):
+    """
+    Whether a serial port is accessible for the current user.
+    :param port: serial port name
+    :return: bool
+    """
+    try:
+        s = serial.Serial(port)
+        s.close()
+        return True
+    except (OSError, serial.SerialException):
+        return False
+
+
+class PortWatcher(object):
+    """
+    Keeps track of the available serial ports. A scan lists the device files
+    and only probes the ones that are new or have changed since the previous
+    scan, for example because a device was plugged in again or its
+    permissions were set. Subscribers are called with ('added', port) or
+    ('removed', port) for each change.
+    """
+    def __init__(self, patterns=None, probe=probe_port):
+        """
+        :param patterns: glob patterns of serial port device files, by
+            default port_patterns().
+        :param probe: function that returns whether a port is accessible.
+        """
+        self.patterns = patterns if patterns is not None else port_patterns()
+        self.probe = probe
+        self.ports = set()
+        self.subscribers = []
+        self._files = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        """
+        Call given function for each added or removed port.
+        :param callback: function taking an event name, 'added' or 'removed',
+            and the port name.
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def scan(self):
+        """
+        Update the available ports and notify the subscribers of changes.
+        :return: tuple of sorted lists of added and removed ports
+        """
+        with self._lock:
+            files = {}
+            for pattern in self.patterns:
+                for path in glob.glob(pattern):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (st.st_ino, st.st_rdev, st.st_mode,
+                                   st.st_uid, st.st_gid)
+
+            ports = set(p for p in self.ports if files.get(p) is not None and
+                        files[p] == self._files.get(p))
+            for path, status in files.items():
+                if status != self._files.get(path) and self.probe(path):
+                    ports.add(path)
+
+            added = sorted(ports - self.ports)
+            removed = sorted(self.ports - ports)
+            self.ports = ports
+            self._files = files
+
+        for port in removed:
+            self._publish('removed', port)
+        for port in added:
+            self._publish('added', port)
+        return added, removed
+
+    def _publish(self, event, port):
+        for callback in list(self.subscribers):
+            callback(event, port)
+
+    def start(self, interval=1):
+        """
+        Scan in a background thread until stop() is called.
+        :param interval: seconds between scans
+        """
+        self._done.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,),
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self, interval):
+        while not self._done.is_set():
+            try:
+                self.scan()
+            except Exception as ex:
+                print('Scanning serial ports failed: {0}'.format(ex))
+            self._done.wait(interval)
+
+    def stop(self):
+        """ Stop scanning in the background. """
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_watcher = None
+
+
+def serial_ports():
+    """
+    Lists serial port names. Ports are checked for whether they are
+    accessible for the current user only when they first appear, see
+    PortWatcher.
+
+    :raises EnvironmentError: unsupported operating system or platform.
+    :return: A sorted list of the serial ports available on the system
+    """
+    global _watcher
+    if port_patterns() is None:
+        return [port for port in ['COM%s' % (i + 1) for i in range(256)]
+                if probe_port(port)]
+
+    if _watcher is None:
+        _watcher = PortWatcher()
+    _watcher.scan()
+    return sorted(_watcher.ports)
 
 
 def choose_serial_port(preamble=None):
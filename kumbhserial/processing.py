@@ -0,0 +1,557 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Convert raw lanyard dumps to JSON, optionally with a pool of processes.
+"""
+
+import json
+import mmap
+import multiprocessing
+import os
+import shutil
+import time
+import numpy as np
+from .appenders import (JsonListAppender, JsonLinesAppender, RECORD_FORMATS,
+                        open_dumper)
+from .compression import detect_compression, iter_chunks
+from .index import SessionIndexAppender
+from .interpreter import (SeparatedTrackerEntrySetJsonConverter,
+                          TrackerInterpreter, tracker_appender)
+from .reader import iter_records, read_file
+
+# dumps larger than this are split at device blocks over multiple processes
+SPLIT_SIZE = 64 * 1024 * 1024
+BLOCK_START = b'\n>'
+
+
+def convert_file(path, filename_detections, filename_system, start=0,
+                 end=None, output_format='json', checkpoint=None,
+                 index=None, compression=None):
+    """
+    Convert (part of) a raw dump to detection and system files.
+    :param path: raw dump file
+    :param filename_detections: output file for detections
+    :param filename_system: output file for system records
+    :param start: byte offset to start reading from
+    :param end: byte offset to stop reading at, or None for the end of file
+    :param output_format: output format, see interpreter.TRACKER_FORMATS
+    :param checkpoint: file to keep the progress in, see Checkpoint. If it
+        exists, the conversion resumes from the last device block written to
+        the output files. Conversions to npz can only be resumed once
+        complete.
+    :param index: session index file to add the device sessions to, see
+        index.SessionIndex.
+    :param compression: compression method of JSON output, see
+        compression.COMPRESSIONS. The raw dump may be compressed in any
+        case.
+    """
+    if checkpoint is not None:
+        state = Checkpoint(checkpoint)
+        if state.complete:
+            return
+        if output_format in RECORD_FORMATS:
+            convert_resumable(path, filename_detections, filename_system,
+                              state, start, end, output_format, index,
+                              compression)
+            return
+
+    appender = tracker_appender(filename_detections, filename_system,
+                                output_format, compression=compression)
+    if index is not None:
+        appender = SessionIndexAppender(index, path, appender)
+    tracker = TrackerInterpreter(appender, offset=start)
+    read_file(path, tracker, start=start, end=end)
+    if checkpoint is not None:
+        state.commit(end, None, complete=True)
+
+
+class Checkpoint(object):
+    """
+    Progress of converting (part of) a raw dump, kept in a JSON file. It
+    holds the byte offset of the dump up to which device blocks are written
+    to the output files, the sizes of the output files at that point, and
+    the device ID and start time of each device block written.
+    """
+    def __init__(self, path):
+        """
+        Load a checkpoint, if the file exists.
+        :param path: checkpoint file
+        """
+        self.path = path
+        self.offset = None
+        self.sizes = None
+        self.blocks = set()
+        self.complete = False
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        self.offset = state['offset']
+        self.sizes = state['sizes']
+        self.blocks = set(tuple(block) for block in state['blocks'])
+        self.complete = state['complete']
+
+    def commit(self, offset, sizes, blocks=(), complete=False):
+        """
+        Record progress and write it to file.
+        :param offset: byte offset of the dump up to which the output is
+            written
+        :param sizes: sizes of the output files
+        :param blocks: (device_id, time) tuples of newly written blocks
+        :param complete: whether the conversion is complete
+        """
+        self.offset = offset
+        self.sizes = sizes
+        self.blocks.update(blocks)
+        self.complete = complete
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({
+                'offset': offset,
+                'sizes': sizes,
+                'blocks': sorted(self.blocks),
+                'complete': complete,
+            }, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def remove(self):
+        _remove(self.path)
+
+
+class BlockCommitter(object):
+    """
+    Passes on device blocks, skipping blocks that were already written
+    according to a checkpoint, and keeps track of the blocks passed on
+    since the last commit.
+    """
+    def __init__(self, appender, checkpoint):
+        """
+        :param appender: appender of TrackerEntrySet objects
+        :param checkpoint: Checkpoint
+        """
+        self.appender = appender
+        self.checkpoint = checkpoint
+        self.pending = []
+
+    def append(self, entry_set):
+        key = (entry_set.device_id, entry_set.time)
+        if key in self.checkpoint.blocks or key in self.pending:
+            print('Skipping duplicate block of device {0} at {1}'
+                  .format(*key))
+            return
+        self.pending.append(key)
+        self.appender.append(entry_set)
+
+    def done(self):
+        self.appender.done()
+
+
+def convert_resumable(path, filename_detections, filename_system,
+                      checkpoint, start=0, end=None, output_format='json',
+                      index=None, compression=None):
+    """
+    Convert (part of) a raw dump to detection and system files, committing
+    the progress to a checkpoint after each device block. If the checkpoint
+    has progress, the output files are truncated to the committed sizes and
+    the conversion continues at the committed offset.
+    :param path: raw dump file
+    :param filename_detections: output file for detections
+    :param filename_system: output file for system records
+    :param checkpoint: Checkpoint
+    :param start: byte offset to start reading from
+    :param end: byte offset to stop reading at, or None for the end of file
+    :param output_format: one of appenders.RECORD_FORMATS
+    :param index: session index file to add the device sessions to
+    :param compression: compression method of the output files or None
+    """
+    if checkpoint.offset is None:
+        offset = start
+        sizes = (None, None)
+    else:
+        offset = checkpoint.offset
+        sizes = checkpoint.sizes
+
+    dumpers = []
+    appenders = []
+    for filename, size in zip((filename_detections, filename_system), sizes):
+        dumper = open_dumper(filename, flush=False, offset=size,
+                             compression=compression)
+        dumpers.append(dumper)
+        if output_format == 'json':
+            appenders.append(JsonListAppender(dumper,
+                                              started=size is not None,
+                                              first=size is None or size <= 1))
+        else:
+            appenders.append(JsonLinesAppender(dumper))
+
+    appender = SeparatedTrackerEntrySetJsonConverter(*appenders)
+    if index is not None:
+        appender = SessionIndexAppender(index, path, appender)
+    committer = BlockCommitter(appender, checkpoint)
+    tracker = TrackerInterpreter(committer, offset=offset)
+
+    def commit(position, complete=False):
+        if output_format == 'ndjson' and not complete:
+            for appender in appenders:
+                appender.flush()
+        sizes = None if complete else [d.tell() for d in dumpers]
+        checkpoint.commit(position, sizes, committer.pending, complete)
+        committer.pending = []
+
+    position = offset
+    try:
+        for record in iter_records(path, start=offset, end=end):
+            position += len(record)
+            tracker.append(record)
+            if (len(committer.pending) > 0 and
+                    tracker.current_entries is None):
+                commit(position)
+    except BaseException:
+        # stop writing; a resumed conversion truncates the files again
+        for dumper in dumpers:
+            dumper.done()
+        raise
+    tracker.done()
+    commit(position, complete=True)
+
+
+def split_blocks(path, num_parts, separator=BLOCK_START):
+    """
+    Split a raw dump in byte ranges of about equal size, each starting at a
+    device block. Compressed dumps are not split.
+    :param path: raw dump file
+    :param num_parts: maximum number of byte ranges
+    :param separator: bytes that start a device block
+    :return: list of (start, end) tuples covering the entire file
+    """
+    size = os.path.getsize(path)
+    if size == 0 or num_parts <= 1:
+        return [(0, size)]
+    if detect_compression(path) is not None:
+        return [(0, None)]
+
+    offsets = [0]
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for i in range(1, num_parts):
+                offset = mapped.find(separator,
+                                     max(offsets[-1] + 1,
+                                         i * size // num_parts))
+                if offset == -1:
+                    break
+                offsets.append(offset)
+        finally:
+            mapped.close()
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def merge_files(paths, filename, output_format='json', compression=None):
+    """
+    Merge files with records into a single file. The merged files are
+    removed.
+    :param paths: files with records
+    :param filename: output file
+    :param output_format: output format, see interpreter.TRACKER_FORMATS
+    :param compression: compression method of the files or None
+    """
+    if output_format == 'json':
+        merge_json_lists(paths, filename, compression)
+        return
+    elif output_format == 'npz':
+        merge_npz(paths, filename)
+        return
+
+    # compressed frames can be concatenated as they are
+    with open(filename, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            os.remove(path)
+
+
+def merge_json_lists(paths, filename, compression=None):
+    """
+    Merge files that each contain a JSON list into a single JSON list. The
+    merged files are removed.
+    :param paths: files with a JSON list
+    :param filename: output file
+    :param compression: compression method of the files or None
+    """
+    first = True
+    out = open_dumper(filename, flush=False, compression=compression)
+    out.append(b'[')
+    for path in paths:
+        # write the contents between the brackets, holding back the last
+        # byte of each chunk, which may be the closing bracket
+        pending = b''
+        opened = False
+        is_empty = True
+        for chunk in iter_chunks(path):
+            data = pending + chunk
+            if not opened:
+                data = data[1:]
+                opened = True
+            pending = data[-1:]
+            data = data[:-1]
+            if len(data) > 0:
+                if is_empty and not first:
+                    out.append(b',')
+                is_empty = False
+                out.append(data)
+        if not is_empty:
+            first = False
+        os.remove(path)
+    out.append(b']')
+    out.done()
+
+
+def merge_npz(paths, filename):
+    """
+    Merge .npz files with the same keys by concatenating their arrays. The
+    merged files are removed.
+    :param paths: .npz files
+    :param filename: output file
+    """
+    parts = []
+    for path in paths:
+        with np.load(path) as npz:
+            parts.append({key: npz[key] for key in npz.files})
+    with open(filename, 'wb') as f:
+        np.savez_compressed(f, **{key: np.concatenate([p[key] for p in parts])
+                                  for key in parts[0]})
+    for path in paths:
+        os.remove(path)
+
+
+def convert_files(conversions, jobs=1, split_size=SPLIT_SIZE,
+                  output_format='json', checkpoint_dir=None, index=None,
+                  compression=None, stats=None):
+    """
+    Convert raw dumps to JSON. With more than one job, the files are
+    converted in a process pool, and dumps larger than split_size are split
+    at device blocks over multiple processes. A failed conversion does not
+    stop the others.
+    :param conversions: sequence of (path, filename_detections,
+        filename_system) tuples, see convert_file.
+    :param jobs: number of processes to use
+    :param split_size: minimum file size to split over processes
+    :param output_format: output format, see interpreter.TRACKER_FORMATS
+    :param checkpoint_dir: directory to keep the progress of each conversion
+        in. A conversion that was interrupted earlier resumes where it
+        stopped and writes to the same output files as before; the yielded
+        conversion then has those file names.
+    :param index: session index file to add the device sessions to, see
+        index.SessionIndex.
+    :param compression: compression method of JSON output, see
+        compression.COMPRESSIONS. Compressed raw dumps are read as well, but
+        not split over processes.
+    :param stats: stats.StatsRegistry to record the duration and input size
+        of each converted file or part in, as stage 'convert'.
+    :return: iterator of (conversion, error) tuples, yielded as soon as the
+        output of a conversion is fully written. Error is None on success.
+    """
+    conversions = [tuple(c) for c in conversions]
+    if checkpoint_dir is not None and not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    tasks = []
+    num_parts = []
+    plans = []
+    for i, conversion in enumerate(conversions):
+        path = conversion[0]
+        plan = None
+        ranges = None
+        if checkpoint_dir is not None:
+            plan = _plan_name(checkpoint_dir, path)
+            ranges, resumed = _load_plan(plan, path, output_format,
+                                         compression)
+            if resumed is not None:
+                print('Resuming conversion of {0}'.format(path))
+                conversion = conversions[i] = resumed
+        if ranges is None:
+            if jobs > 1 and os.path.getsize(path) >= split_size:
+                ranges = split_blocks(path, jobs)
+            else:
+                ranges = [(0, None)]
+            if plan is not None:
+                _save_plan(plan, conversion, output_format, compression,
+                           ranges)
+
+        path, filename_detections, filename_system = conversion
+        if len(ranges) == 1:
+            tasks.append((i, None, path, filename_detections,
+                          filename_system, 0, None, output_format,
+                          _checkpoint_name(plan, None), index, compression))
+        else:
+            for j, (start, end) in enumerate(ranges):
+                tasks.append((i, j, path,
+                              _part_name(filename_detections, j),
+                              _part_name(filename_system, j), start, end,
+                              output_format, _checkpoint_name(plan, j),
+                              index, compression))
+        num_parts.append(len(ranges))
+        plans.append(plan)
+
+    remaining = list(num_parts)
+    errors = [None] * len(conversions)
+    if stats is not None:
+        convert_stats = stats.stage('convert')
+        sizes = {task[:2]: _part_size(task[2], task[5], task[6])
+                 for task in tasks}
+    if jobs <= 1:
+        pool = None
+        results = _convert_sequential(tasks, len(conversions))
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(_convert_part, tasks)
+    try:
+        for i, j, error, elapsed in results:
+            if stats is not None:
+                convert_stats.record(elapsed, size=sizes[i, j])
+            if error is not None and errors[i] is None:
+                errors[i] = error if j is None else 'part {0}: {1}'.format(
+                    j, error)
+            remaining[i] -= 1
+            if remaining[i] > 0:
+                continue
+
+            conversion = conversions[i]
+            if num_parts[i] > 1:
+                for filename in conversion[1:]:
+                    part_names = [_part_name(filename, k)
+                                  for k in range(num_parts[i])]
+                    if errors[i] is None:
+                        merge_files(part_names, filename, output_format,
+                                    compression)
+                    else:
+                        for part_name in part_names:
+                            _remove(part_name)
+            if errors[i] is not None:
+                _remove_output(conversion)
+            if plans[i] is not None:
+                _remove(_checkpoint_name(plans[i], None))
+                for k in range(num_parts[i]):
+                    _remove(_checkpoint_name(plans[i], k))
+                _remove(plans[i])
+            yield conversion, errors[i]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _convert_sequential(tasks, num_conversions):
+    for task in tasks:
+        if task[1] is None or task[1] == 0:
+            print("Converting {0} out of {1}: {2}"
+                  .format(task[0] + 1, num_conversions,
+                          os.path.basename(task[2])))
+        yield _convert_part(task)
+
+
+def _plan_name(checkpoint_dir, path):
+    return os.path.join(checkpoint_dir, os.path.basename(path) + '.json')
+
+
+def _checkpoint_name(plan, part):
+    if plan is None:
+        return None
+    elif part is None:
+        return plan[:-len('.json')] + '.progress.json'
+    else:
+        return plan[:-len('.json')] + '.part{0:03d}.json'.format(part)
+
+
+def _load_plan(plan, path, output_format, compression):
+    """
+    Load the output file names and byte ranges of an earlier conversion.
+    :return: tuple of a list of byte ranges and a conversion tuple, both
+        None if there is no earlier conversion of the same file.
+    """
+    try:
+        with open(plan) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None, None
+    if (state['input'] != os.path.abspath(path) or
+            state['size'] != os.path.getsize(path) or
+            state['format'] != output_format or
+            state.get('compression') != compression):
+        return None, None
+    return ([tuple(r) for r in state['ranges']],
+            (path, state['detections'], state['system']))
+
+
+def _save_plan(plan, conversion, output_format, compression, ranges):
+    with open(plan + '.tmp', 'w') as f:
+        json.dump({
+            'input': os.path.abspath(conversion[0]),
+            'size': os.path.getsize(conversion[0]),
+            'format': output_format,
+            'compression': compression,
+            'detections': conversion[1],
+            'system': conversion[2],
+            'ranges': ranges,
+        }, f)
+    os.replace(plan + '.tmp', plan)
+
+
+def _convert_part(task):
+    """
+    Run convert_file in a worker process.
+    :param task: tuple of the conversion index, the part index and the
+        convert_file arguments.
+    :return: tuple of conversion index, part index, error message or None,
+        and the duration in seconds.
+    """
+    i, j = task[:2]
+    start = time.perf_counter()
+    try:
+        convert_file(*task[2:])
+    except Exception as ex:
+        return (i, j, '{0}: {1}'.format(type(ex).__name__, ex),
+                time.perf_counter() - start)
+    return i, j, None, time.perf_counter() - start
+
+
+def _part_size(path, start, end):
+    """ Number of bytes of a raw dump to convert. """
+    if end is None:
+        try:
+            end = os.path.getsize(path)
+        except OSError:
+            return 0
+    return max(end - start, 0)
+
+
+def _part_name(filename, part):
+    return '{0}.part{1:03d}'.format(filename, part)
+
+
+def _remove_output(conversion):
+    for filename in conversion[1:]:
+        _remove(filename)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
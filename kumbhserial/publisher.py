@@ -0,0 +1,358 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Publish decoded records live over a Unix or TCP socket.
+
+Each message is a frame of a 4-byte big-endian length followed by that many
+bytes of a JSON object with keys 'seq', 'channel' and 'record'. The sequence
+number increases by one for each published record, so that a subscriber can
+see how many records it missed.
+"""
+
+import collections
+import json
+import os
+import selectors
+import socket
+import stat
+import struct
+import threading
+
+FRAME_HEADER = struct.Struct('>I')
+
+
+def parse_address(address):
+    """
+    Parse a socket address.
+    :param address: 'unix:PATH' or a path containing a '/' for a Unix
+        socket, or 'HOST:PORT' or 'tcp:HOST:PORT' for a TCP socket.
+    :return: tuple of the socket family and the socket address
+    :raises ValueError: if the address cannot be parsed.
+    """
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    if address.startswith('tcp:'):
+        address = address[len('tcp:'):]
+    elif '/' in address:
+        return socket.AF_UNIX, address
+    host, sep, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('Cannot parse socket address {0}'.format(address))
+    return socket.AF_INET, (host or 'localhost', port)
+
+
+class Subscriber(object):
+    """
+    Connection of a subscriber to a RecordPublisher, with its own queue of
+    frames waiting to be sent.
+    """
+    def __init__(self, connection, address):
+        self.connection = connection
+        self.address = address
+        self.frames = collections.deque()
+        self.pending = None
+        self.num_sent = 0
+        self.num_dropped = 0
+
+    def send(self):
+        """
+        Send waiting frames until the connection would block.
+        :return: whether frames are still waiting.
+        :raises OSError: if the connection is lost.
+        """
+        while True:
+            if self.pending is None:
+                if len(self.frames) == 0:
+                    return False
+                self.pending = memoryview(self.frames.popleft())
+            try:
+                sent = self.connection.send(self.pending)
+            except (BlockingIOError, InterruptedError):
+                return True
+            self.pending = self.pending[sent:]
+            if len(self.pending) == 0:
+                self.pending = None
+                self.num_sent += 1
+
+    def __str__(self):
+        return '{0} ({1} records sent, {2} dropped)'.format(
+            self.address or 'local', self.num_sent, self.num_dropped)
+
+
+class RecordPublisher(threading.Thread):
+    """
+    Pushes records to any number of socket subscribers. Publishing only
+    encodes the record and puts the frame in the queue of each subscriber;
+    the sockets are served by the thread. If a subscriber does not keep up
+    and already has maxsize frames waiting, new frames for it are dropped
+    and counted, so the publisher never blocks on a slow consumer.
+    Subscribers should only read; anything they send is ignored.
+    """
+    def __init__(self, address, maxsize=10000, backlog=16, **kwargs):
+        """
+        Opens the socket. Call start() to accept subscribers.
+        :param address: socket address, see parse_address.
+        :param maxsize: maximum number of frames waiting per subscriber.
+        :param backlog: number of pending connections to allow.
+        :param kwargs: arguments to threading.Thread.
+        :raises ValueError: if the address cannot be parsed.
+        :raises OSError: if the socket cannot be opened.
+        """
+        kwargs.setdefault('daemon', True)
+        super(RecordPublisher, self).__init__(**kwargs)
+        self.family, self.address = parse_address(address)
+        self.maxsize = maxsize
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+        self.num_published = 0
+        self.is_done = False
+
+        if self.family == socket.AF_UNIX:
+            _remove_socket_file(self.address)
+        self.server = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            if self.family == socket.AF_INET:
+                self.server.setsockopt(socket.SOL_SOCKET,
+                                       socket.SO_REUSEADDR, 1)
+            self.server.bind(self.address)
+            self.server.listen(backlog)
+        except OSError:
+            self.server.close()
+            raise
+        if self.family == socket.AF_INET:
+            self.address = self.server.getsockname()
+        self.server.setblocking(False)
+        self._wake_receiver, self._wake_sender = socket.socketpair()
+        self._wake_receiver.setblocking(False)
+        self._wake_sender.setblocking(False)
+        self._wake_pending = False
+        self.selector = selectors.DefaultSelector()
+
+    def publish(self, channel, record):
+        """
+        Send a record to all current subscribers.
+        :param channel: name of the record type, e.g. 'detection'
+        :param record: JSON serializable record
+        """
+        with self.lock:
+            seq = self.num_published
+            self.num_published += 1
+            if len(self.subscribers) == 0:
+                return
+        body = bytes(self.encoder.encode(
+            {'seq': seq, 'channel': channel, 'record': record}),
+            encoding='ascii')
+        frame = FRAME_HEADER.pack(len(body)) + body
+        with self.lock:
+            for subscriber in self.subscribers:
+                if len(subscriber.frames) >= self.maxsize:
+                    subscriber.num_dropped += 1
+                else:
+                    subscriber.frames.append(frame)
+            self._wake()
+
+    def channel(self, name):
+        """
+        Appender that publishes each appended record on a channel.
+        :param name: channel name
+        :return: PublisherAppender
+        """
+        return PublisherAppender(self, name)
+
+    def stats(self):
+        """
+        Publishing statistics.
+        :return: dict with the number of published records and for each
+            subscriber its address and number of sent, dropped and waiting
+            records.
+        """
+        with self.lock:
+            return {
+                'published': self.num_published,
+                'subscribers': [{
+                    'address': s.address,
+                    'sent': s.num_sent,
+                    'dropped': s.num_dropped,
+                    'depth': len(s.frames),
+                } for s in self.subscribers],
+            }
+
+    def _wake(self):
+        # called with the lock held
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self._wake_sender.send(b'\0')
+            except (BlockingIOError, InterruptedError):
+                pass
+
+    def run(self):
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.selector.register(self._wake_receiver, selectors.EVENT_READ)
+        try:
+            while True:
+                for key, events in self.selector.select():
+                    if key.fileobj is self.server:
+                        self._accept()
+                    elif key.fileobj is self._wake_receiver:
+                        self._clear_wake()
+                    elif events & selectors.EVENT_READ:
+                        self._receive(key.data)
+                self._send()
+                if self.is_done:
+                    break
+        finally:
+            for subscriber in list(self.subscribers):
+                self._remove(subscriber)
+            self.selector.close()
+
+    def _accept(self):
+        try:
+            connection, address = self.server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        connection.setblocking(False)
+        subscriber = Subscriber(connection, address)
+        self.selector.register(connection, selectors.EVENT_READ, subscriber)
+        with self.lock:
+            self.subscribers.append(subscriber)
+
+    def _clear_wake(self):
+        with self.lock:
+            self._wake_pending = False
+            try:
+                while self._wake_receiver.recv(4096):
+                    pass
+            except (BlockingIOError, InterruptedError):
+                pass
+
+    def _receive(self, subscriber):
+        try:
+            data = subscriber.connection.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if len(data) == 0:
+            self._remove(subscriber)
+
+    def _send(self):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                with self.lock:
+                    waiting = subscriber.send()
+            except OSError:
+                self._remove(subscriber)
+                continue
+            events = selectors.EVENT_READ
+            if waiting:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(subscriber.connection, events, subscriber)
+
+    def _remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+        try:
+            self.selector.unregister(subscriber.connection)
+        except (KeyError, ValueError):
+            pass
+        subscriber.connection.close()
+
+    def done(self):
+        """
+        Send the frames that can be sent without blocking, disconnect all
+        subscribers and close the socket.
+        """
+        with self.lock:
+            if self.is_done:
+                return
+            self.is_done = True
+            self._wake()
+        if self.is_alive():
+            self.join()
+        self.server.close()
+        self._wake_receiver.close()
+        self._wake_sender.close()
+        if self.family == socket.AF_UNIX:
+            _remove_socket_file(self.address)
+
+
+class PublisherAppender(object):
+    """
+    Publishes appended records on a channel of a RecordPublisher. The
+    publisher may be shared between appenders, so done() leaves it open.
+    """
+    def __init__(self, publisher, channel):
+        self.publisher = publisher
+        self.channel = channel
+
+    def append(self, data):
+        self.publisher.publish(self.channel, data)
+
+    def done(self):
+        pass
+
+
+def subscribe(address, timeout=None):
+    """
+    Receive the messages of a RecordPublisher.
+    :param address: socket address, see parse_address.
+    :param timeout: socket timeout in seconds, None to wait indefinitely.
+    :return: iterator of message dicts with keys 'seq', 'channel' and
+        'record', which ends when the publisher closes. The connection is
+        made before returning.
+    :raises OSError: if the publisher cannot be reached.
+    """
+    family, address = parse_address(address)
+    connection = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(timeout)
+        connection.connect(address)
+    except OSError:
+        connection.close()
+        raise
+    return _receive(connection)
+
+
+def _receive(connection):
+    with connection:
+        stream = connection.makefile('rb')
+        while True:
+            header = stream.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            size, = FRAME_HEADER.unpack(header)
+            body = stream.read(size)
+            if len(body) < size:
+                return
+            yield json.loads(str(body, encoding='ascii'))
+
+
+def _remove_socket_file(path):
+    """ Remove a Unix socket file left by an earlier publisher. """
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+    except FileNotFoundError:
+        pass
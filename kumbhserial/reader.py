@@ -19,17 +19,25 @@
 Read from a serial device
 """
 
+import mmap
+import os
 import serial
 import threading
 import time
-from .helpers import text_in, insert_timestamp
+from .compression import detect_compression, iter_chunks
+from .framing import RecordFramer
+from .helpers import text_in
 import sys
 
+# maximum number of bytes to read from a serial port at once
+READ_SIZE = 65536
+
 
 class ReaderSet(object):
     """ Set of active readers """
     def __init__(self):
         self.readers = []
+        self.lock = threading.Lock()
 
     def __repr__(self):
         self.update()
@@ -42,24 +50,23 @@ class ReaderSet(object):
 
     def start(self, reader):
         """
-        Add and start a SerialReader thread.
+        Add and start a SerialReader thread. Readers may be started from
+        any thread.
         :param reader: SerialReader thread not yet called start() on.
         """
         reader.start()
-        self.readers.append(reader)
+        with self.lock:
+            self.readers.append(reader)
 
     def update(self):
         """
         Updates the status of the readers and remove inactive readers.
         """
-        new_readers = []
-        for r in self.readers:
-            if r.is_alive():
-                new_readers.append(r)
-            else:
-                r.join()
-
-        self.readers = new_readers
+        with self.lock:
+            finished = [r for r in self.readers if not r.is_alive()]
+            self.readers = [r for r in self.readers if r not in finished]
+        for r in finished:
+            r.join()
 
     def stop(self, call_done=False):
         """
@@ -81,30 +88,36 @@ class ReaderSet(object):
 class SerialReader(threading.Thread):
 
     """
-    Reads a serial device, as provided in the Kumbh Mela project.
+    Reads a serial device, as provided in the Kumbh Mela project. Data is
+    split into records by a framing.RecordFramer, so records are passed to
+    the appender as memoryview objects, see the framing module.
     """
 
     def __init__(self, port, appender, writer=None, terminator=b'\r',
                  insert_timestamp_at=(b'>', b'<'), baud_rate=921600,
-                 wait_time=12):
+                 wait_time=12, clock=None):
         """
         Starts a serial port reader.
         :param port: serial port name
         :param appender: appender to write lines to
         :param writer: threading.Thread that takes a serial port as initial
             parameter. If it is None, no data will be written.
-        :param terminator: end-of-line terminator. It will not read beyond this
-            terminator. Pass None to read
-        :param insert_timestamp_at:
-        :param baud_rate:
+        :param terminator: end-of-record terminator. Pass None to pass on
+            data as it is read.
+        :param insert_timestamp_at: tokens to insert a timestamp after
+        :param baud_rate: serial baud rate
+        :param wait_time: maximum number of seconds to keep reading after
+            done() is called, while the device is still sending data.
+        :param clock: helpers.Clock for the inserted timestamps, by default
+            the shared clock.
         :return:
         """
         super().__init__()
         self.comm = serial.Serial(port, baud_rate, timeout=1)
         self.port = port
-        self.is_done = False
+        self._done = threading.Event()
         self.appender = appender
-        self.receive_until = time.time()
+        self.receive_until = None
         if writer is not None:
             self.writer = writer(self.comm)
         else:
@@ -113,6 +126,9 @@ class SerialReader(threading.Thread):
         self.terminator = terminator
         self.insert_timestamp_at = insert_timestamp_at
         self.wait_time = wait_time
+        self.clock = clock
+        self.framer = RecordFramer(appender, terminator, insert_timestamp_at,
+                                   clock=clock)
 
     def start(self):
         """
@@ -122,25 +138,35 @@ class SerialReader(threading.Thread):
         if self.writer:
             self.writer.start()
 
+    @property
+    def is_done(self):
+        return self._done.is_set()
+
     def read(self):
         """
-        Read data from the device (up to terminator) and write it to the
-        appender.
+        Read the data waiting at the device and write the complete records
+        to the appender. Blocks until data arrives or the serial timeout is
+        reached. If the appender is bounded, this also blocks while the
+        appender is full.
+        :return: number of bytes read
         """
-        data = self.comm.read_until(terminator=self.terminator)
-        for token in self.insert_timestamp_at:
-            data = insert_timestamp(data, token)
-        self.appender.append(data)
+        data = self.comm.read(max(1, min(self.comm.in_waiting, READ_SIZE)))
+        self.framer.feed(data)
+        return len(data)
 
     def run(self):
         """
-        Reads data until the thread is signalled done.
+        Reads data until the thread is signalled done. After that, it keeps
+        reading until the device stops sending data, or until the wait time
+        has passed.
         """
         print('started logger')
         try:
-            while not self.is_done:
-                if time.time() >= self.receive_until:
-                    self.read()
+            while not self._done.is_set():
+                self.read()
+            while (time.monotonic() < self.receive_until and
+                   self.read() > 0):
+                pass
             print('read stopped')
         except Exception as ex:
             self.exception = ex
@@ -148,23 +174,26 @@ class SerialReader(threading.Thread):
 
     def join(self, timeout=None):
         """
-        Waits for the thread to finish and once it is finished, marks the
-        appender with done().
+        Waits for the thread to finish and once it is finished, passes on
+        the unterminated rest of the data and marks the appender with done().
         :param timeout: if thread did not join after timeout, mark the appender
             done anyway and return.
         """
         try:
             super().join(timeout=timeout)
         finally:
-            self.appender.done()
+            try:
+                self.framer.flush()
+            finally:
+                self.appender.done()
 
     def done(self):
         """
         Mark the reader thread and writer thread, if any, as done.
         """
-        if not self.is_done:
-            self.is_done = True
-            self.receive_until = (time.time() + self.wait_time)
+        if not self._done.is_set():
+            self.receive_until = time.monotonic() + self.wait_time
+            self._done.set()
             if self.writer:
                 self.writer.done()
 
@@ -179,7 +208,11 @@ class Heartbeat(threading.Thread):
         super().__init__()
         self.comm = comm
         self.sleep = sleep
-        self.is_done = False
+        self._done = threading.Event()
+
+    @property
+    def is_done(self):
+        return self._done.is_set()
 
     def run(self):
         """
@@ -187,9 +220,9 @@ class Heartbeat(threading.Thread):
         """
         print('Heartbeat started')
         try:
-            while not self.is_done:
+            while not self._done.is_set():
                 self.comm.write(b'@')
-                time.sleep(self.sleep)
+                self._done.wait(self.sleep)
         except:
             print('Sending heartbeat failed')
             raise
@@ -200,32 +233,108 @@ class Heartbeat(threading.Thread):
         """
         Marks the heartbeat as done.
         """
-        self.is_done = True
+        self._done.set()
 
 
-def read_file(filename, appender, terminator=b'\r'):
+def iter_records(filename, terminator=b'\r', start=0, end=None):
     """
-    Read a file and send the output to given appender.
+    Iterate over the records of a file without copying them. The file is
+    memory-mapped and each record is a memoryview of the file up to and
+    including the terminator. The last record is whatever follows the last
+    terminator. A record is only valid until the next one is requested; copy
+    it with bytes() to keep it.
+
+    Compressed files, see compression.CompressedDumper, are decompressed
+    while reading instead; the offsets then refer to the decompressed data.
     :param filename: filename to read
-    :param appender: appender to append file contents to
     :param terminator: end-of-record terminator
+    :param start: byte offset to start reading from
+    :param end: byte offset to stop reading at, or None for the end of file
+    :return: iterator of memoryview objects
     """
-    buffer = b''
-    buffer_size = 1024
+    if detect_compression(filename) is not None:
+        yield from iter_chunk_records(iter_chunks(filename), terminator,
+                                      start, end)
+        return
     with open(filename, 'rb') as f:
-        terminator_idx = 0
-        while terminator_idx != -1:
-            new_buffer = b'i'
-            while terminator not in new_buffer and len(new_buffer) > 0:
-                new_buffer = f.read(buffer_size)
-                buffer += new_buffer
-
-            terminator_idx = buffer.find(terminator)
-            appender.append(buffer[:terminator_idx + len(terminator)])
-            buffer = buffer[terminator_idx + len(terminator):]
-
-        appender.append(buffer)
-        appender.done()
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        if end is None or end > len(view):
+            end = len(view)
+        try:
+            record_end = mapped.find(terminator, start, end)
+            while record_end != -1:
+                record_end += len(terminator)
+                yield view[start:record_end]
+                start = record_end
+                record_end = mapped.find(terminator, start, end)
+            if start < end:
+                yield view[start:end]
+        finally:
+            view.release()
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # a record is still referenced, let it be collected
+
+
+def iter_chunk_records(chunks, terminator=b'\r', start=0, end=None):
+    """
+    Iterate over the records in a stream of data chunks, see iter_records.
+    :param chunks: iterator of bytes
+    :param terminator: end-of-record terminator
+    :param start: byte offset in the stream to start reading from
+    :param end: byte offset to stop reading at, or None for the end of the
+        stream
+    :return: iterator of memoryview objects
+    """
+    buffer = bytearray()
+    # stream offset of the start of the buffer
+    position = 0
+    for chunk in chunks:
+        if position + len(chunk) <= start:
+            position += len(chunk)
+            continue
+        buffer += chunk
+        if position < start:
+            del buffer[:start - position]
+            position = start
+        finished = end is not None and position + len(buffer) >= end
+        if finished:
+            del buffer[end - position:]
+
+        data = bytes(buffer)
+        view = memoryview(data)
+        record_start = 0
+        record_end = data.find(terminator)
+        while record_end != -1:
+            record_end += len(terminator)
+            yield view[record_start:record_end]
+            record_start = record_end
+            record_end = data.find(terminator, record_start)
+        del buffer[:record_start]
+        position += record_start
+        if finished:
+            break
+    if len(buffer) > 0:
+        yield memoryview(bytes(buffer))
+
+
+def read_file(filename, appender, terminator=b'\r', start=0, end=None):
+    """
+    Read a file and send the output to given appender. Records are passed as
+    memoryview objects, see iter_records.
+    :param filename: filename to read
+    :param appender: appender to append file contents to
+    :param terminator: end-of-record terminator
+    :param start: byte offset to start reading from
+    :param end: byte offset to stop reading at, or None for the end of file
+    """
+    for record in iter_records(filename, terminator, start, end):
+        appender.append(record)
+    appender.done()
 
 
 def run_reader(port, appender, writer=None, **kwargs):
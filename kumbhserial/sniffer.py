@@ -19,7 +19,10 @@
 Handle the Salland Electronics sniffer node.
 """
 
-from .helpers import timestamp
+import itertools
+from .helpers import default_clock, strip_view, timestamp
+
+TIMESTAMP_FORMATS = ('iso', 'epoch')
 
 
 class SnifferInterpreter(object):
@@ -34,9 +37,9 @@ class SnifferInterpreter(object):
     def append(self, line):
         """
         Parse bytes data and convert it to a dict.
-        :param line: a single record of bytes data.
+        :param line: a single record of bytes-like data.
         """
-        line = line.strip()
+        line = bytes(strip_view(line))
         if len(line) == 0:
             return
         if b',' in line:
@@ -66,6 +69,148 @@ class SnifferInterpreter(object):
         self.appender.done()
 
 
+class BatchSnifferInterpreter(object):
+    """
+    Interprets the output of the Salland Electronics sniffer node in
+    batches, for busy nodes. Only the receive time is recorded per line;
+    lines are parsed when batch_size lines are pending, at the first line
+    after flush_interval seconds have passed, or when done. There is no
+    timer, so when the node goes quiet, pending lines wait for the next line
+    or for done. The records are the same as those of SnifferInterpreter,
+    except that malformed lines are counted in num_invalid and skipped.
+    Receive times and ISO timestamps come from a helpers.Clock; with the
+    'epoch' format, the timestamp is kept as seconds since the UNIX epoch.
+    """
+    def __init__(self, appender, batch_size=4096, flush_interval=0.5,
+                 timestamp_format='iso', clock=None):
+        """
+        :param appender: appender to send record dicts to
+        :param batch_size: number of lines to parse at once
+        :param flush_interval: number of seconds after which pending lines
+            are parsed at the next line
+        :param timestamp_format: one of TIMESTAMP_FORMATS
+        :param clock: helpers.Clock, by default the shared clock
+        :raises ValueError: if the timestamp format is not known
+        """
+        if timestamp_format not in TIMESTAMP_FORMATS:
+            raise ValueError('Timestamp format {0} not one of {1}'.format(
+                timestamp_format, ', '.join(TIMESTAMP_FORMATS)))
+        self.appender = appender
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock if clock is not None else default_clock
+        self.iso = timestamp_format == 'iso'
+        self.line_number = 0
+        self.num_invalid = 0
+        self.lines = []
+        self.times = []
+        self.flushed_at = self.clock.now()
+
+    def append(self, line):
+        """
+        Store a line with its receive time.
+        :param line: a single record of bytes-like data.
+        """
+        now = self.clock.now()
+        self.lines.append(bytes(line))
+        self.times.append(now)
+        if (len(self.lines) >= self.batch_size or
+                now - self.flushed_at >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Parse all pending lines and send their records to the appender.
+        """
+        self.flushed_at = self.clock.now()
+        if len(self.lines) == 0:
+            return
+        lines = self.lines
+        times = self.times
+        self.lines = []
+        self.times = []
+
+        records = None
+        if all(line.count(b',') == 5 for line in lines):
+            try:
+                records = self._parse_full(lines, times)
+            except ValueError:
+                pass
+        if records is None:
+            records = self._parse_each(lines, times)
+        self.line_number += len(records)
+        for record in records:
+            self.appender.append(record)
+
+    def _timestamps(self, times):
+        if not self.iso:
+            return times
+        timestamp_at = self.clock.timestamp
+        return [timestamp_at(t) for t in times]
+
+    def _parse_full(self, lines, times):
+        """
+        Parse lines that all have every field. They are joined and split
+        once, and each field is converted in a single pass.
+        :raises ValueError: if any field is malformed.
+        """
+        fields = str(b','.join(lines), encoding='ascii').split(',')
+        return [{
+            'rtc': int(rtc),
+            'time': int(network_time),
+            'state': state.strip(),
+            'id': int(device_id),
+            'density': int(density),
+            'auth': int(auth, base=16),
+            'timestamp': t,
+            'line': line_number,
+        } for line_number, rtc, network_time, state, device_id, density,
+            auth, t in zip(
+                itertools.count(self.line_number), fields[0::6],
+                fields[1::6], fields[2::6], fields[3::6], fields[4::6],
+                fields[5::6], self._timestamps(times))]
+
+    def _parse_each(self, lines, times):
+        """
+        Parse lines one by one, skipping empty lines and counting malformed
+        lines.
+        """
+        records = []
+        for line, t in zip(lines, times):
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                if b',' in line:
+                    elements = line.split(b',')
+                    if len(elements) != 6:
+                        raise ValueError('wrong number of fields')
+                    record = {
+                        'rtc': int(elements[0]),
+                        'time': int(elements[1]),
+                        'state': str(elements[2].strip(), encoding='ascii'),
+                        'id': int(elements[3]),
+                        'density': int(elements[4]),
+                        'auth': int(elements[5], base=16)
+                    }
+                else:
+                    record = {'rtc': int(line)}
+            except ValueError:
+                self.num_invalid += 1
+                continue
+            record['timestamp'] = self.clock.timestamp(t) if self.iso else t
+            record['line'] = self.line_number + len(records)
+            records.append(record)
+        return records
+
+    def done(self):
+        """
+        Parse all pending lines and mark the appender as done.
+        """
+        self.flush()
+        self.appender.done()
+
+
 if __name__ == '__main__':
     import sys
     from .appenders import JsonListAppender, Dumper
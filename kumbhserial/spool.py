@@ -0,0 +1,369 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read a serial device in one process and decode its data in another.
+
+A capture process only reads the port, splits the data into timestamped
+records, writes them to the raw dump and adds them to a SharedRing, a ring
+buffer in shared memory. A decode process takes the records out of the ring
+and decodes and writes them, so that a slow decoding step never keeps the
+port from being read. If the ring is full, or the decode process has
+stopped, records are still written to the raw dump, but they are dropped
+from the ring and counted, and the next record in the ring records how many
+bytes were lost before it.
+"""
+
+import multiprocessing
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+import serial
+from .appenders import Duplicator, open_dumper
+from .framing import RecordFramer
+from .helpers import default_clock, text_in
+from .reader import Heartbeat, SerialReader
+
+# default ring size in bytes
+RING_SIZE = 16 * 1024 * 1024
+# seconds to wait before looking at an empty ring again
+POLL_TIME = 0.01
+
+# counters at the start of the shared memory, as unsigned 64-bit integers
+(_WRITE_POS, _READ_POS, _CAPTURED, _DELIVERED, _LOST_BYTES, _LOST_READS,
+ _MAX_DEPTH, _CLOSED) = range(8)
+_COUNTER = struct.Struct('<Q')
+_COUNTERS_SIZE = 8 * _COUNTER.size
+# header of each chunk in the ring: receive time, size, and number of bytes
+# lost just before the chunk
+CHUNK_HEADER = struct.Struct('<dIQ')
+
+
+class SharedRing(object):
+    """
+    Single-producer, single-consumer ring buffer of data chunks in shared
+    memory. Pass it to a multiprocessing.Process to use it from there. The
+    process that created it must call unlink() when all processes are done
+    with it.
+    """
+    def __init__(self, size=RING_SIZE, context=None):
+        """
+        :param size: number of bytes that can be waiting in the ring,
+            including a chunk header of CHUNK_HEADER.size bytes per chunk.
+        :param context: multiprocessing context of the processes that use
+            the ring, by default the default context.
+        """
+        if context is None:
+            context = multiprocessing.get_context()
+        self.capacity = size
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=_COUNTERS_SIZE + size)
+        self.lock = context.Lock()
+        self._attach()
+        self.counters[:] = bytes(_COUNTERS_SIZE)
+
+    def _attach(self):
+        self.counters = self.shm.buf[:_COUNTERS_SIZE]
+        self.data = self.shm.buf[_COUNTERS_SIZE:_COUNTERS_SIZE +
+                                 self.capacity]
+        # bytes lost since the last chunk, only known to the writer
+        self._pending_lost = 0
+
+    def __getstate__(self):
+        return {'capacity': self.capacity, 'shm': self.shm,
+                'lock': self.lock}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def put(self, data, receive_time):
+        """
+        Add a chunk of data, or drop and count it if it does not fit.
+        :param data: bytes-like data
+        :param receive_time: wall-clock time that the data was received
+        :return: whether the data was added
+        """
+        size = len(data)
+        needed = CHUNK_HEADER.size + size
+        with self.lock:
+            write_pos = self._get(_WRITE_POS)
+            read_pos = self._get(_READ_POS)
+        if needed > self.capacity - (write_pos - read_pos):
+            with self.lock:
+                self._add(_LOST_BYTES, size)
+                self._add(_LOST_READS, 1)
+            self._pending_lost += size
+            return False
+
+        self._copy_in(write_pos, CHUNK_HEADER.pack(receive_time, size,
+                                                   self._pending_lost))
+        self._copy_in(write_pos + CHUNK_HEADER.size, data)
+        self._pending_lost = 0
+        with self.lock:
+            self._set(_WRITE_POS, write_pos + needed)
+            self._add(_CAPTURED, size)
+            depth = write_pos + needed - self._get(_READ_POS)
+            if depth > self._get(_MAX_DEPTH):
+                self._set(_MAX_DEPTH, depth)
+        return True
+
+    def get(self):
+        """
+        Take the oldest chunk out of the ring.
+        :return: tuple of the receive time, the data as bytes and the number
+            of bytes lost just before it, or None if the ring is empty.
+        """
+        with self.lock:
+            write_pos = self._get(_WRITE_POS)
+            read_pos = self._get(_READ_POS)
+        if write_pos == read_pos:
+            return None
+        receive_time, size, lost = CHUNK_HEADER.unpack(
+            self._copy_out(read_pos, CHUNK_HEADER.size))
+        data = self._copy_out(read_pos + CHUNK_HEADER.size, size)
+        with self.lock:
+            self._set(_READ_POS, read_pos + CHUNK_HEADER.size + size)
+            self._add(_DELIVERED, size)
+        return receive_time, data, lost
+
+    def close(self):
+        """ Mark that no more data will be added. """
+        with self.lock:
+            self._set(_CLOSED, 1)
+
+    @property
+    def closed(self):
+        with self.lock:
+            return self._get(_CLOSED) == 1
+
+    def stats(self):
+        """
+        Counters of the ring. Captured, delivered and lost counts are in
+        bytes of data, depth and max_depth in bytes including chunk headers.
+        :return: dict
+        """
+        with self.lock:
+            return {
+                'captured': self._get(_CAPTURED),
+                'delivered': self._get(_DELIVERED),
+                'lost_bytes': self._get(_LOST_BYTES),
+                'lost_reads': self._get(_LOST_READS),
+                'depth': self._get(_WRITE_POS) - self._get(_READ_POS),
+                'max_depth': self._get(_MAX_DEPTH),
+                'size': self.capacity,
+            }
+
+    def release(self):
+        """ Stop using the shared memory in this process. """
+        self.counters.release()
+        self.data.release()
+        self.shm.close()
+
+    def unlink(self):
+        """ Free the shared memory, once all processes released it. """
+        self.shm.unlink()
+
+    def _get(self, index):
+        return _COUNTER.unpack_from(self.counters, index * _COUNTER.size)[0]
+
+    def _set(self, index, value):
+        _COUNTER.pack_into(self.counters, index * _COUNTER.size, value)
+
+    def _add(self, index, value):
+        self._set(index, self._get(index) + value)
+
+    def _copy_in(self, position, data):
+        view = memoryview(data).cast('B')
+        start = position % self.capacity
+        first = min(len(view), self.capacity - start)
+        self.data[start:start + first] = view[:first]
+        if first < len(view):
+            self.data[:len(view) - first] = view[first:]
+
+    def _copy_out(self, position, size):
+        start = position % self.capacity
+        end = start + size
+        if end <= self.capacity:
+            return bytes(self.data[start:end])
+        return (bytes(self.data[start:]) +
+                bytes(self.data[:end - self.capacity]))
+
+
+class RingAppender(object):
+    """
+    Adds incoming data to a SharedRing, with its receive time, and closes
+    the ring when done.
+    """
+    def __init__(self, ring, clock=None):
+        """
+        :param ring: SharedRing
+        :param clock: helpers.Clock for the receive time of data passed to
+            append, by default the shared clock.
+        """
+        self.ring = ring
+        self.clock = clock if clock is not None else default_clock
+
+    def append(self, data):
+        self.ring.put(data, self.clock.now())
+
+    def append_record(self, record, meta):
+        if meta.timestamp is not None:
+            record = meta.splice(record)
+        self.ring.put(record, meta.receive_time)
+
+    def done(self):
+        self.ring.close()
+
+
+def capture(port, ring, stop, dump_path=None, compression=None, **kwargs):
+    """
+    Read a serial device into a ring until stop is set, sending a heartbeat
+    to the device. Records get their timestamps here, and are written to the
+    raw dump, if any, whether or not they fit in the ring. The ring is
+    closed when reading has finished.
+    :param port: serial port name
+    :param ring: SharedRing
+    :param stop: multiprocessing.Event to stop reading at
+    :param dump_path: raw dump file to write, or None
+    :param compression: compression method of the raw dump, see
+        compression.COMPRESSIONS.
+    :param kwargs: other arguments to SerialReader
+    """
+    appender = RingAppender(ring)
+    try:
+        if dump_path is not None:
+            appender = Duplicator([appender, open_dumper(
+                dump_path, compression=compression)])
+        reader = SerialReader(port, appender, writer=Heartbeat, **kwargs)
+    except (OSError, serial.SerialException) as ex:
+        print('Cannot start serial connection: {0}'.format(ex))
+        appender.done()
+        return
+    reader.start()
+    while reader.is_alive() and not stop.wait(0.5):
+        pass
+    reader.done()
+    reader.join(reader.wait_time + 1)
+    if reader.exception:
+        print('Failed to communicate: {0}'.format(reader.exception))
+
+
+def drain(ring, appender, terminator=b'\r', insert_timestamp_at=(),
+          poll_time=POLL_TIME):
+    """
+    Take the data out of a ring until it is closed and empty, and send its
+    records to an appender, see framing.RecordFramer. Where data was lost,
+    the record before the gap is passed on as it is.
+    :param ring: SharedRing
+    :param appender: appender to send records to
+    :param terminator: end-of-record terminator
+    :param insert_timestamp_at: tokens to insert a timestamp after, with the
+        time the data was captured. Records from capture already have their
+        timestamps.
+    :param poll_time: seconds to wait before looking at an empty ring again
+    """
+    framer = RecordFramer(appender, terminator, insert_timestamp_at)
+    try:
+        while True:
+            closed = ring.closed
+            chunk = ring.get()
+            if chunk is None:
+                if closed:
+                    break
+                time.sleep(poll_time)
+                continue
+            receive_time, data, lost = chunk
+            if lost > 0:
+                print('Lost {0} bytes before byte {1}: the ring buffer was '
+                      'full.'.format(lost, framer.offset + framer.length))
+                framer.flush()
+            framer.feed(data, receive_time)
+        framer.flush()
+    finally:
+        appender.done()
+
+
+def run_spooled_reader(port, decoder, ring_size=RING_SIZE, wait_time=12,
+                       context=None, **kwargs):
+    """
+    Read from a device in a capture process and decode in a decode process,
+    until the user quits. If the decode process stops before that, this is
+    reported at once; the capture process keeps reading.
+    :param port: serial port device name
+    :param decoder: function taking a SharedRing, run in the decode
+        process, for example drain with an appender. With the spawn start
+        method of multiprocessing, it must be picklable.
+    :param ring_size: size of the SharedRing in bytes
+    :param wait_time: maximum number of seconds to keep reading after the
+        user quits, while the device is still sending data.
+    :param context: multiprocessing context to start the processes with, by
+        default the default context.
+    :param kwargs: other arguments to capture.
+    :return: tuple of the stats of the ring, see SharedRing.stats, and the
+        exit code of the decode process.
+    """
+    if context is None:
+        context = multiprocessing.get_context()
+    ring = SharedRing(ring_size, context)
+    stop = context.Event()
+    kwargs['wait_time'] = wait_time
+    processes = [
+        context.Process(target=_run_uninterrupted,
+                        args=(capture, port, ring, stop),
+                        kwargs=kwargs, name='capture ' + port),
+        context.Process(target=_run_uninterrupted,
+                        args=(decoder, ring), name='decode ' + port),
+    ]
+    for process in processes:
+        process.start()
+
+    def watch_decoder():
+        processes[1].join()
+        # drain only returns normally once the ring is closed
+        if processes[1].exitcode != 0 and not stop.is_set():
+            print('ERROR: decoding {0} stopped with exit code {1}. The raw '
+                  'dump is still written, but data is no longer decoded. '
+                  'Type q or quit to quit.'
+                  .format(port, processes[1].exitcode))
+
+    threading.Thread(target=watch_decoder, daemon=True).start()
+    print('Reading ' + port + '. Type q or quit to quit.')
+    try:
+        while processes[0].is_alive():
+            text_in()
+    except (ValueError, KeyboardInterrupt):
+        print('Stopping {0}... WAIT {1} SECONDS!'.format(port, wait_time + 3))
+    finally:
+        stop.set()
+        for process in processes:
+            process.join()
+        stats = ring.stats()
+        ring.release()
+        ring.unlink()
+    return stats, processes[1].exitcode
+
+
+def _run_uninterrupted(function, *args, **kwargs):
+    """
+    Run a function in a child process, leaving keyboard interrupts to the
+    parent process, which stops the children in order.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    function(*args, **kwargs)
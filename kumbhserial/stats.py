@@ -0,0 +1,400 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Opt-in instrumentation of appender chains. Any appender can be wrapped in
+an InstrumentedAppender that counts the calls and bytes passing through it
+and measures how long they take, both including and excluding the time
+spent in instrumented appenders further down the chain. Without a
+StatsRegistry, instrument() returns the appender itself, so that disabled
+instrumentation costs nothing.
+"""
+
+import bisect
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from .framing import record_function
+
+# upper bounds of the latency histogram buckets, from 1 us to about 2 min,
+# each a factor 2 ** 0.25 apart
+LATENCY_BUCKETS = tuple(1e-6 * 2 ** (i / 4) for i in range(108))
+QUANTILES = (0.5, 0.9, 0.99)
+STATS_FORMATS = ('text', 'json', 'prometheus')
+
+_local = threading.local()
+
+
+class StageStats(object):
+    """
+    Counters and latency histogram of a stage of an appender chain.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.num_calls = 0
+        self.num_bytes = 0
+        self.total_time = 0.
+        self.self_time = 0.
+        self.max_latency = 0.
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, elapsed, self_time=None, size=0):
+        """
+        Record a single call.
+        :param elapsed: duration of the call in seconds
+        :param self_time: part of the duration not spent in other
+            instrumented stages, by default all of it.
+        :param size: number of bytes passed
+        """
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        with self.lock:
+            self.num_calls += 1
+            self.num_bytes += size
+            self.total_time += elapsed
+            self.self_time += elapsed if self_time is None else self_time
+            if elapsed > self.max_latency:
+                self.max_latency = elapsed
+            self.buckets[bucket] += 1
+
+    def percentile(self, quantile):
+        """
+        Latency below which given fraction of the calls took, rounded up to
+        the histogram bucket.
+        :param quantile: fraction between 0 and 1
+        :return: seconds, or 0 if there were no calls
+        """
+        with self.lock:
+            buckets = list(self.buckets)
+            max_latency = self.max_latency
+        total = sum(buckets)
+        if total == 0:
+            return 0.
+        count = 0
+        for i, num in enumerate(buckets):
+            count += num
+            if count >= quantile * total:
+                if i < len(LATENCY_BUCKETS):
+                    return min(LATENCY_BUCKETS[i], max_latency)
+                break
+        return max_latency
+
+    def snapshot(self):
+        """
+        :return: dict of the counters and latency percentiles
+        """
+        with self.lock:
+            ret = {
+                'calls': self.num_calls,
+                'bytes': self.num_bytes,
+                'total_time': self.total_time,
+                'self_time': self.self_time,
+                'mean_latency': self.total_time / max(self.num_calls, 1),
+                'max_latency': self.max_latency,
+            }
+        for quantile in QUANTILES:
+            ret['p{0:g}'.format(quantile * 100)] = self.percentile(quantile)
+        return ret
+
+
+class InstrumentedAppender(object):
+    """
+    Passes data on to an appender and records each call in a StageStats.
+    Other attributes are those of the wrapped appender.
+    """
+    def __init__(self, appender, stage):
+        """
+        :param appender: appender to wrap
+        :param stage: StageStats to record to
+        """
+        self.appender = appender
+        self.stage = stage
+        self._append_record = None
+
+    def append(self, data):
+        self._call(self.appender.append, (data,), data)
+
+    def append_record(self, record, meta):
+        """ Pass on a framed record, see framing.record_function. """
+        if self._append_record is None:
+            self._append_record = record_function(self.appender)
+        self._call(self._append_record, (record, meta), record)
+
+    def _call(self, function, args, data):
+        try:
+            stack = _local.stack
+        except AttributeError:
+            stack = _local.stack = []
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            size = len(data)
+        else:
+            size = 0
+        stack.append(0.)
+        start = time.perf_counter()
+        try:
+            function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested_time = stack.pop()
+            if len(stack) > 0:
+                stack[-1] += elapsed
+            self.stage.record(elapsed, elapsed - nested_time, size)
+
+    def done(self):
+        self.appender.done()
+
+    def __getattr__(self, name):
+        return getattr(self.appender, name)
+
+
+class StatsRegistry(object):
+    """
+    Stages and other sources of statistics of a running program.
+    """
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.sources = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+
+    def stage(self, name):
+        """
+        The StageStats with given name, created if it does not exist yet.
+        Appenders of the same stage, for example of different devices,
+        share their statistics.
+        """
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats(name)
+            return self.stages[name]
+
+    def wrap(self, appender, name):
+        """
+        Instrument an appender.
+        :param appender: appender to wrap
+        :param name: stage name
+        :return: InstrumentedAppender
+        """
+        return InstrumentedAppender(appender, self.stage(name))
+
+    def add_source(self, name, source):
+        """
+        Add a source of statistics that is read at each report, such as
+        the stats method of a ThreadBuffer or RecordPublisher.
+        :param name: source name
+        :param source: function returning a dict of numbers
+        """
+        with self.lock:
+            self.sources[name] = source
+
+    def remove_source(self, name):
+        with self.lock:
+            self.sources.pop(name, None)
+
+    def snapshot(self):
+        """
+        :return: dict with the time since the registry was created, and the
+            statistics of each stage and source.
+        """
+        with self.lock:
+            stages = list(self.stages.values())
+            sources = list(self.sources.items())
+        return {
+            'time': time.time(),
+            'uptime': time.monotonic() - self.start_time,
+            'stages': collections.OrderedDict(
+                (s.name, s.snapshot()) for s in stages),
+            'sources': collections.OrderedDict(
+                (name, source()) for name, source in sources),
+        }
+
+
+def instrument(appender, name, registry=None):
+    """
+    Instrument an appender if statistics are enabled.
+    :param appender: appender to wrap
+    :param name: stage name
+    :param registry: StatsRegistry, or None if statistics are disabled
+    :return: InstrumentedAppender, or the appender itself without registry
+    """
+    if registry is None:
+        return appender
+    return registry.wrap(appender, name)
+
+
+def parse_destination(destination):
+    """
+    Parse where to report statistics to.
+    :param destination: '-' for standard output, or a file name. A file
+        name ending in '.json' gets JSON output, a file name ending in
+        '.prom' the Prometheus text format, other files plain text. The
+        format can be given explicitly as 'FORMAT:PATH'.
+    :return: tuple of the format and the path, or None for standard output
+    """
+    output_format, sep, path = destination.partition(':')
+    if sep and output_format in STATS_FORMATS:
+        return output_format, (None if path == '-' else path)
+    if destination == '-':
+        return 'text', None
+    if destination.endswith('.json'):
+        return 'json', destination
+    if destination.endswith('.prom'):
+        return 'prometheus', destination
+    return 'text', destination
+
+
+def format_text(snapshot):
+    """ Statistics as a human readable table. """
+    lines = ['Statistics after {0:.1f} s:'.format(snapshot['uptime']),
+             '{0:<16} {1:>10} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+                 'stage', 'calls', 'MB', 'self s', 'p50 ms', 'p99 ms',
+                 'max ms')]
+    for name, stage in snapshot['stages'].items():
+        lines.append(
+            '{0:<16} {1:>10} {2:>10.2f} {3:>9.2f} {4:>9.3f} {5:>9.3f} '
+            '{6:>9.3f}'.format(
+                name, stage['calls'], stage['bytes'] / 1e6,
+                stage['self_time'], 1000 * stage['p50'],
+                1000 * stage['p99'], 1000 * stage['max_latency']))
+    for name, source in snapshot['sources'].items():
+        lines.append('{0}: {1}'.format(name, ', '.join(
+            '{0}={1}'.format(key, _format_number(value))
+            for key, value in source.items() if _is_number(value))))
+    return '\n'.join(lines) + '\n'
+
+
+def format_prometheus(snapshot, prefix='kumbhserial'):
+    """ Statistics in the Prometheus text exposition format. """
+    metrics = collections.OrderedDict()
+
+    def add(name, metric_type, labels, value):
+        if name not in metrics:
+            metrics[name] = (metric_type, [])
+        metrics[name][1].append((labels, value))
+
+    add(prefix + '_uptime_seconds', 'gauge', {}, snapshot['uptime'])
+    for name, stage in snapshot['stages'].items():
+        labels = {'stage': name}
+        add(prefix + '_stage_calls_total', 'counter', labels,
+            stage['calls'])
+        add(prefix + '_stage_bytes_total', 'counter', labels,
+            stage['bytes'])
+        add(prefix + '_stage_seconds_total', 'counter', labels,
+            stage['total_time'])
+        add(prefix + '_stage_self_seconds_total', 'counter', labels,
+            stage['self_time'])
+        add(prefix + '_stage_max_latency_seconds', 'gauge', labels,
+            stage['max_latency'])
+        for quantile in QUANTILES:
+            add(prefix + '_stage_latency_seconds', 'gauge',
+                {'stage': name, 'quantile': '{0:g}'.format(quantile)},
+                stage['p{0:g}'.format(quantile * 100)])
+    for name, source in snapshot['sources'].items():
+        for key, value in source.items():
+            if _is_number(value):
+                add('{0}_source_{1}'.format(prefix, key), 'gauge',
+                    {'source': name}, value)
+
+    lines = []
+    for name, (metric_type, samples) in metrics.items():
+        lines.append('# TYPE {0} {1}'.format(name, metric_type))
+        for labels, value in samples:
+            if len(labels) > 0:
+                lines.append('{0}{{{1}}} {2}'.format(name, ','.join(
+                    '{0}="{1}"'.format(k, _escape_label(v))
+                    for k, v in sorted(labels.items())), value))
+            else:
+                lines.append('{0} {1}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def format_json(snapshot):
+    """ Statistics as a JSON object. """
+    return json.dumps(snapshot, indent=2) + '\n'
+
+
+FORMATTERS = {
+    'text': format_text,
+    'json': format_json,
+    'prometheus': format_prometheus,
+}
+
+
+class StatsReporter(threading.Thread):
+    """
+    Reports the statistics of a StatsRegistry periodically, and once more
+    when done. Standard output gets a new report each time; a file is
+    replaced atomically, so that it always holds one complete report.
+    """
+    def __init__(self, registry, destination='-', interval=10., **kwargs):
+        """
+        :param registry: StatsRegistry
+        :param destination: where to report to, see parse_destination.
+        :param interval: seconds between reports
+        :param kwargs: arguments to threading.Thread.
+        """
+        kwargs.setdefault('daemon', True)
+        super(StatsReporter, self).__init__(**kwargs)
+        self.registry = registry
+        self.output_format, self.path = parse_destination(destination)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        """ Write a report now. """
+        text = FORMATTERS[self.output_format](self.registry.snapshot())
+        if self.path is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            return
+        try:
+            with open(self.path + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as ex:
+            print('Cannot write statistics to {0}: {1}'.format(self.path, ex))
+
+    def done(self):
+        """ Stop reporting periodically and write a final report. """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        self.report()
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return '{0:.4g}'.format(value)
+    return str(value)
+
+
+def _escape_label(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
@@ -0,0 +1,214 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Synthetic output of the Kumbh Mela devices, for testing and benchmarking.
+"""
+
+import numpy as np
+from .decoder import B64_ALPHABET, B64_LENGTH, DETECTION_SLOTS, RECORD_LENGTH
+
+EXPERIMENT_DATA_LINE = b'RVhQRVJJTUVOVF9EQVRBAA'
+SYSTEM_SEPARATOR_LINE = b'/////////////////////w'
+DETECTION_SEPARATOR_LINE = b'//////////////////////'
+
+_B64_CHARS = np.frombuffer(B64_ALPHABET, dtype=np.uint8)
+
+
+def b64encode_records(binary):
+    """
+    Encode records to base64 lines without padding.
+    :param binary: (N, 16) uint8 array
+    :return: list of N bytes objects of 22 characters
+    """
+    padded = np.zeros((len(binary), 18), dtype=np.uint8)
+    padded[:, :RECORD_LENGTH] = binary
+    groups = padded.reshape(-1, 6, 3)
+    sextets = np.empty((len(binary), 6, 4), dtype=np.uint8)
+    sextets[:, :, 0] = groups[:, :, 0] >> 2
+    sextets[:, :, 1] = ((groups[:, :, 0] & 0x3) << 4) | (groups[:, :, 1] >> 4)
+    sextets[:, :, 2] = ((groups[:, :, 1] & 0xf) << 2) | (groups[:, :, 2] >> 6)
+    sextets[:, :, 3] = groups[:, :, 2] & 0x3f
+    chars = _B64_CHARS[sextets.reshape(-1, 24)[:, :B64_LENGTH]]
+    data = chars.tobytes()
+    return [data[i:i + B64_LENGTH]
+            for i in range(0, len(data), B64_LENGTH)]
+
+
+def add_checksums(binary):
+    """
+    Set the first byte of each record so that the record sums to 0 mod 256.
+    :param binary: (N, 16) uint8 array, modified in place.
+    """
+    binary[:, 0] = (-binary[:, 1:].sum(axis=1, dtype=np.int64)) % 256
+
+
+def detection_records(rng, num_lines):
+    """
+    Random detection records. The last record has fewer than six detections
+    and is filled up with terminating slots.
+    :param rng: numpy.random.RandomState
+    :param num_lines: number of records
+    :return: (num_lines, 16) uint8 array
+    """
+    slots = num_lines * DETECTION_SLOTS
+    values = ((rng.randint(0, 4, slots) << 18) +
+              (rng.randint(0, 64, slots) << 12) +
+              rng.randint(0, 0xfff, slots))
+    values = values.reshape(num_lines, DETECTION_SLOTS)
+    if num_lines > 0:
+        values[-1, rng.randint(0, DETECTION_SLOTS):] = 0xfffff
+    shifts = np.arange(16, -1, -4)
+    nibbles = ((values[:, :, np.newaxis] >> shifts) & 0xf).reshape(
+        num_lines, 30)
+    binary = np.zeros((num_lines, RECORD_LENGTH), dtype=np.uint8)
+    binary[:, 1:] = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    add_checksums(binary)
+    return binary
+
+
+def system_records(rng, num_lines, start_time=4000000):
+    """
+    Random system records with increasing times.
+    :param rng: numpy.random.RandomState
+    :param num_lines: number of records
+    :param start_time: device time of the first record
+    :return: (num_lines, 16) uint8 array
+    """
+    binary = np.zeros((num_lines, RECORD_LENGTH), dtype=np.uint8)
+    times = start_time + 60 * np.arange(num_lines, dtype=np.int64)
+    detections = rng.randint(0, 1 << 21, num_lines) << 3
+    rtc = times & 0xffffff
+    binary[:, 1] = rng.randint(0, 256, num_lines)
+    for i in range(5):
+        binary[:, 2 + i] = (times >> (8 * i)) & 0xff
+    binary[:, 8:10] = rng.randint(0, 256, (num_lines, 2))
+    binary[:, 10] = ((detections & 0xf8) | rng.randint(0, 2, num_lines) |
+                     (rng.randint(0, 4, num_lines) << 1))
+    binary[:, 11] = (detections >> 8) & 0xff
+    binary[:, 12] = (detections >> 16) & 0xff
+    for i in range(3):
+        binary[:, 13 + i] = (rtc >> (8 * i)) & 0xff
+    add_checksums(binary)
+    return binary
+
+
+def lanyard_block(rng, device_id, num_detections=1000, num_system=10,
+                  timestamps=True):
+    """
+    Output of a lanyard device, framed as it is after a serial read.
+    :param rng: numpy.random.RandomState
+    :param device_id: device number
+    :param num_detections: number of detection lines
+    :param num_system: number of system lines
+    :param timestamps: include timestamps in the framing lines
+    :return: list of records as bytes
+    """
+    if timestamps:
+        start = b'\n>%2016-04-23T22:59:00.000000+05:30%' + b'%d' % device_id
+        end = b'\n<%2016-04-23T23:00:00.000000+05:30%' + b'%d' % device_id
+    else:
+        start = b'\n>%d' % device_id
+        end = b'\n<%d' % device_id
+
+    records = [start + b'\r', b'\n000000-' + EXPERIMENT_DATA_LINE + b'\r']
+    for i, line in enumerate(b64encode_records(
+            system_records(rng, num_system))):
+        records.append(b'\n%06d-%s\r' % (i + 1, line))
+    records.append(b'\n%06d-%s\r' % (num_system + 1, SYSTEM_SEPARATOR_LINE))
+    for i, line in enumerate(b64encode_records(
+            detection_records(rng, num_detections))):
+        records.append(b'\n%06d:%s\r' % (i, line))
+    records.append(b'\n%06d:%s\r' % (num_detections,
+                                     DETECTION_SEPARATOR_LINE))
+    records.append(end + b'\r')
+    return records
+
+
+def lanyard_dump(out, num_bytes, num_detections=10000, num_system=100,
+                 timestamps=True, seed=0):
+    """
+    Write a raw dump of lanyard devices of at least given size.
+    :param out: binary file-like object to write to
+    :param num_bytes: minimum number of bytes to write
+    :param num_detections: number of detection lines per device
+    :param num_system: number of system lines per device
+    :param timestamps: include timestamps in the framing lines
+    :param seed: random seed
+    :return: tuple of number of bytes and number of records written
+    """
+    rng = np.random.RandomState(seed)
+    size = 0
+    num_records = 0
+    device_id = 0
+    while size < num_bytes:
+        data = b''.join(lanyard_block(rng, device_id, num_detections,
+                                      num_system, timestamps))
+        out.write(data)
+        size += len(data)
+        num_records += num_detections + num_system + 5
+        device_id += 1
+    return size, num_records
+
+
+def sniffer_stream(out, num_records, seed=0):
+    """
+    Write output of the sniffer node.
+    :param out: binary file-like object to write to
+    :param num_records: number of records to write
+    :param seed: random seed
+    :return: number of bytes written
+    """
+    rng = np.random.RandomState(seed)
+    states = (b'I', b'S', b'D')
+    data = b''.join(
+        b'\n%d, %d, %s, %d, %d, %x\r' % (
+            rtc, 4000000 + i, states[state], device_id, density, auth)
+        for i, (rtc, state, device_id, density, auth) in enumerate(zip(
+            rng.randint(0, 1 << 24, num_records).tolist(),
+            rng.randint(0, 3, num_records).tolist(),
+            rng.randint(0, 0xfff, num_records).tolist(),
+            rng.randint(0, 256, num_records).tolist(),
+            rng.randint(0, 1 << 16, num_records).tolist())))
+    out.write(data)
+    return len(data)
+
+
+def gps_stream(out, num_records, device_id=b'TI010', seed=0):
+    """
+    Write output of a Thinture GPS device, ending with the '@' marker.
+    :param out: binary file-like object to write to
+    :param num_records: number of records to write
+    :param device_id: GPS device ID
+    :param seed: random seed
+    :return: number of bytes written
+    """
+    rng = np.random.RandomState(seed)
+    seconds = (12 * 3600 + np.arange(num_records)) % (24 * 3600)
+    data = b''.join(
+        b'$%s,230416%02d%02d%02d,23%07.4fN,075%07.4fE,%06.2f,%06.2f,%d,%d#' % (
+            device_id, t // 3600, t // 60 % 60, t % 60, lat, lon, speed,
+            direction, sats, i + 1)
+        for i, (t, lat, lon, speed, direction, sats) in enumerate(zip(
+            seconds.tolist(),
+            rng.uniform(0, 60, num_records).tolist(),
+            rng.uniform(0, 60, num_records).tolist(),
+            rng.uniform(0, 20, num_records).tolist(),
+            rng.uniform(0, 360, num_records).tolist(),
+            rng.randint(3, 15, num_records).tolist()))) + b'@'
+    out.write(data)
+    return len(data)
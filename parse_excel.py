@@ -4,46 +4,229 @@ Converts Thinture GPS Excel sheets to json.
 
 This increases the redundancy of the data, but also makes
 it easier to read cross-platform.
+
+A manifest in the output directory keeps the modification time, size and
+hash of each converted workbook, so that unchanged workbooks are not
+converted again.
 """
-import xlrd
+import hashlib
 import json
+import multiprocessing
 import os
+import sys
+import docopt
+import xlrd
+
+MANIFEST = 'manifest.json'
+
+
+def convert_dates(values, datemode, part):
+    """
+    Convert a column of Excel dates, converting each distinct value once.
+    :param values: list of Excel date numbers
+    :param datemode: datemode of the workbook
+    :param part: slice of the date tuple to keep
+    :return: list of tuples
+    """
+    converted = {value: xlrd.xldate_as_tuple(value, datemode)[part]
+                 for value in set(values)}
+    return [converted[value] for value in values]
+
+
+def parse_workbook(path):
+    """
+    Read the records of the first sheet of a Thinture GPS workbook.
+    :param path: .xlsx file
+    :return: list of record dicts
+    """
+    wb = xlrd.open_workbook(path)
+    sh = wb.sheet_by_index(0)
+    columns = [sh.col_values(col, start_rowx=1) for col in range(9)]
+    dates = convert_dates(columns[2], wb.datemode, slice(None, 3))
+    times = convert_dates(columns[3], wb.datemode, slice(3, None))
+
+    return [{
+        'row': int(row),
+        'device': device,
+        'year': year,
+        'month': month,
+        'day': day,
+        'hour': hour,
+        'minute': minute,
+        'second': second,
+        'latitude': latitude,
+        'longitude': longitude,
+        'speed': speed,
+        'direction': direction,
+        'numSatellites': int(satellites)
+    } for (row, device, (year, month, day), (hour, minute, second),
+           latitude, longitude, speed, direction, satellites) in zip(
+        columns[0], columns[1], dates, times, *columns[4:9])]
+
+
+def file_hash(path):
+    """ SHA-256 hex digest of a file. """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_status(path):
+    """ Modification time and size of a file. """
+    st = os.stat(path)
+    return {'mtime': st.st_mtime, 'size': st.st_size}
+
+
+def convert_workbook(task):
+    """
+    Convert a workbook to a json file. The json file is written under a
+    temporary name and renamed when complete.
+    :param task: tuple of the workbook path and the json path
+    :return: tuple of the task, the manifest entry or None, and an error
+        message or None.
+    """
+    path, json_path = task
+    try:
+        entry = file_status(path)
+        entry['hash'] = file_hash(path)
+        entry['output'] = os.path.basename(json_path)
+        records = parse_workbook(path)
+        with open(json_path + '.tmp', 'w') as f:
+            json.dump(records, f, separators=(',', ':'))
+        os.replace(json_path + '.tmp', json_path)
+    except Exception as ex:
+        return task, None, '{0}: {1}'.format(type(ex).__name__, ex)
+    return task, entry, None
+
 
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
 
-def parse_excel(input_directory, output_directory):
+
+def save_manifest(manifest, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_unchanged(path, json_path, entry):
+    """
+    Whether a workbook was converted before and did not change since. Only
+    if the modification time or size differ, the file is hashed.
+    :param path: .xlsx file
+    :param json_path: json file it was converted to
+    :param entry: manifest entry of the workbook or None
+    :return: bool
+    """
+    if entry is None or not os.path.exists(json_path):
+        return False
+    status = file_status(path)
+    if status['size'] != entry['size']:
+        return False
+    if status['mtime'] != entry['mtime'] and file_hash(path) != entry['hash']:
+        return False
+    entry.update(status)
+    return True
+
+
+def parse_excel(input_directory, output_directory, jobs=1, force=False):
+    """
+    Convert all changed workbooks in a directory to json files.
+    :param input_directory: directory to search .xlsx files in
+    :param output_directory: directory to write json files and the manifest
+        to
+    :param jobs: number of processes to convert with
+    :param force: convert all workbooks, whether they changed or not
+    :return: tuple of the number of converted and skipped workbooks, and a
+        list of (path, error) tuples of failed workbooks.
+    """
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    manifest_path = os.path.join(output_directory, MANIFEST)
+    manifest = load_manifest(manifest_path)
+
+    tasks = []
+    num_skipped = 0
     for path, dirs, files in os.walk(input_directory):
         for file_name in files:
             if not file_name.endswith('.xlsx'):
                 continue
+            xlsx_path = os.path.join(path, file_name)
+            json_path = os.path.join(
+                output_directory, os.path.splitext(file_name)[0] + '.json')
+            key = os.path.relpath(xlsx_path, input_directory)
+            if not force and is_unchanged(xlsx_path, json_path,
+                                          manifest.get(key)):
+                num_skipped += 1
+            else:
+                tasks.append((xlsx_path, json_path))
+
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(convert_workbook, tasks)
+    else:
+        pool = None
+        results = map(convert_workbook, tasks)
+
+    failed = []
+    try:
+        for (xlsx_path, json_path), entry, error in results:
+            key = os.path.relpath(xlsx_path, input_directory)
+            if error is None:
+                manifest[key] = entry
+                print('Converted {0}'.format(key))
+            else:
+                manifest.pop(key, None)
+                failed.append((xlsx_path, error))
+            save_manifest(manifest, manifest_path)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    save_manifest(manifest, manifest_path)
+
+    return len(tasks) - len(failed), num_skipped, failed
+
+
+def main(argv=sys.argv[1:]):
+    """
+    Converts Thinture GPS Excel sheets to json, skipping workbooks that did
+    not change since they were last converted.
+
+    Usage:
+      parse_excel.py [-h] [--jobs N] [--force] [<input_dir> [<output_dir>]]
+
+    Options:
+      <input_dir>          Directory with .xlsx files, by default data/raw
+      <output_dir>         Directory to write json files to, by default
+                           data/json
+      -j, --jobs N         Number of workbooks to convert in parallel
+                           [default: 1]
+      -f, --force          Convert all workbooks, also if they did not change
+      -h, --help           This help text
+    """
+    arguments = docopt.docopt(main.__doc__, argv)
+    try:
+        jobs = int(arguments['--jobs'])
+    except ValueError:
+        sys.exit('Number of jobs {0} is not a number.'
+                 .format(arguments['--jobs']))
+
+    num_converted, num_skipped, failed = parse_excel(
+        arguments['<input_dir>'] or os.path.join('data', 'raw'),
+        arguments['<output_dir>'] or os.path.join('data', 'json'),
+        jobs, arguments['--force'])
+    print('Converted {0} and skipped {1} unchanged workbooks.'
+          .format(num_converted, num_skipped))
+    for path, error in failed:
+        print('Failed to convert {0}: {1}'.format(path, error))
+
 
-            wb = xlrd.open_workbook(os.path.join(path, file_name))
-            sh = wb.sheet_by_index(0)
-
-            records = []
-            for rownum in range(1, sh.nrows):
-                row = sh.row_values(rownum)
-                year, month, day = xlrd.xldate_as_tuple(row[2],
-                                                        wb.datemode)[:3]
-                hour, minute, second = xlrd.xldate_as_tuple(row[3],
-                                                            wb.datemode)[3:]
-                records.append({
-                    'row': int(row[0]),
-                    'device': row[1],
-                    'year': year,
-                    'month': month,
-                    'day': day,
-                    'hour': hour,
-                    'minute': minute,
-                    'second': second,
-                    'latitude': row[4],
-                    'longitude': row[5],
-                    'speed': row[6],
-                    'direction': row[7],
-                    'numSatellites': int(row[8])
-                })
-            json_file_name = os.path.splitext(file_name)[0] + '.json'
-            json_path = os.path.join(output_directory, json_file_name)
-            with open(json_path, 'w') as f:
-                json.dump(records, f, separators=(',', ':'))
-
-parse_excel(os.path.join('data', 'raw'), os.path.join('data', 'json'))
+if __name__ == '__main__':
+    main()
@@ -32,14 +32,20 @@ setup(name='kumbhserial',
       author='Zoltan Beck',
       author_email='zb1f12@soton.ac.uk',
       packages=find_packages(),
-      install_requires=['pyserial', 'docopt'],
+      install_requires=['pyserial', 'docopt', 'numpy'],
       tests_require=['nose', 'pyflakes', 'pep8'],
+      extras_require={
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+      },
       entry_points = {
         'console_scripts': [
             'kumbhdownload  = kumbhserial.main:download',
             'kumbhsniffer   = kumbhserial.main:sniffer',
             'kumbhprocessor = kumbhserial.main:processor',
             'kumbhgps       = kumbhserial.main:gps',
+            'kumbhdaemon    = kumbhserial.main:daemon',
+            'kumbhindex     = kumbhserial.main:index',
         ]
       },
       classifiers=[
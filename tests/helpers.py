@@ -0,0 +1,38 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers shared by the tests.
+"""
+
+
+class ListAppender(object):
+    """
+    Keeps all appended data in a list. memoryview data, such as framed
+    records, is copied, since its buffer may be reused.
+    """
+    def __init__(self):
+        self.data = []
+        self.is_done = False
+
+    def append(self, data):
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        self.data.append(data)
+
+    def done(self):
+        self.is_done = True
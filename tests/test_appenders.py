@@ -0,0 +1,165 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import threading
+import time
+from nose.tools import (assert_equals, assert_list_equal, assert_raises,
+                        assert_true)
+
+from kumbhserial.appenders import (JsonListAppender, JsonLinesAppender,
+                                   ThreadBuffer, record_appender)
+
+from helpers import ListAppender
+
+
+class BlockedAppender(ListAppender):
+    """ Only accepts data once it is released. """
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def append(self, data):
+        self.released.wait()
+        super().append(data)
+
+
+def test_json_list_appender():
+    out = ListAppender()
+    appender = JsonListAppender(out)
+    appender.append({'a': 1})
+    appender.append({'b': [1, 2]})
+    appender.done()
+    assert_equals(b'[{"a":1},{"b":[1,2]}]', b''.join(out.data))
+    assert_true(out.is_done)
+
+
+def test_json_lines_appender_batches():
+    out = ListAppender()
+    appender = JsonLinesAppender(out, batch_size=2, buffer_size=20,
+                                 flush_interval=60)
+    appender.append({'a': 1})
+    assert_list_equal([], out.data)
+    appender.append({'a': 2})
+    assert_list_equal([], out.data)
+    appender.append({'a': 3})
+    appender.append({'a': 4})
+    assert_list_equal([b'{"a":1}\n{"a":2}\n{"a":3}\n{"a":4}\n'], out.data)
+    appender.append({'a': 5})
+    appender.done()
+    assert_list_equal([b'{"a":1}\n{"a":2}\n{"a":3}\n{"a":4}\n',
+                       b'{"a":5}\n'], out.data)
+    assert_true(out.is_done)
+
+
+def test_json_lines_appender_interval():
+    out = ListAppender()
+    appender = JsonLinesAppender(out, flush_interval=0)
+    appender.append({'a': 1})
+    assert_list_equal([b'{"a":1}\n'], out.data)
+    appender.done()
+    assert_list_equal([b'{"a":1}\n'], out.data)
+
+
+def test_ndjson_record_appender_flushes():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'records.ndjson')
+        appender = record_appender(path, 'ndjson', flush=False)
+        appender.append({'a': 1})
+        appender.flush()
+        # readable before the appender is done
+        with open(path, 'rb') as f:
+            assert_equals(b'{"a":1}\n', f.read())
+        appender.done()
+
+
+def test_thread_buffer_drains_on_done():
+    out = BlockedAppender()
+    buffer = ThreadBuffer(out)
+    for i in range(1000):
+        buffer.append(i)
+    out.released.set()
+    buffer.done()
+    assert_list_equal(list(range(1000)), out.data)
+    assert_true(out.is_done)
+    stats = buffer.stats()
+    assert_equals(1000, stats['appended'])
+    assert_equals(1000, stats['delivered'])
+    assert_equals(0, stats['depth'])
+
+
+def test_thread_buffer_drop():
+    out = BlockedAppender()
+    buffer = ThreadBuffer(out, maxsize=10, policy='drop')
+    for i in range(100):
+        buffer.append(i)
+    assert_true(buffer.depth <= 10)
+    assert_true(buffer.stats()['dropped'] >= 89)
+    out.released.set()
+    buffer.done()
+    assert_equals(100 - buffer.stats()['dropped'], len(out.data))
+    assert_true(buffer.stats()['max_depth'] <= 10)
+
+
+def test_thread_buffer_block():
+    out = BlockedAppender()
+    buffer = ThreadBuffer(out, maxsize=10)
+    producer = threading.Thread(
+        target=lambda: [buffer.append(i) for i in range(100)])
+    producer.start()
+    producer.join(0.2)
+    assert_true(producer.is_alive())
+    out.released.set()
+    producer.join()
+    buffer.done()
+    assert_list_equal(list(range(100)), out.data)
+    assert_equals(0, buffer.stats()['dropped'])
+    assert_true(buffer.stats()['max_depth'] <= 10)
+
+
+def test_thread_buffer_counts_in_flight():
+    out = BlockedAppender()
+    buffer = ThreadBuffer(out, maxsize=10, policy='drop')
+    buffer.append(0)
+    # the thread has taken the first item and waits for the receiver
+    while buffer.stats()['in_flight'] == 0:
+        time.sleep(0.001)
+    for i in range(1, 100):
+        buffer.append(i)
+    stats = buffer.stats()
+    assert_equals(10, stats['depth'])
+    assert_equals(1, stats['in_flight'])
+    assert_equals(90, stats['dropped'])
+    assert_equals(10, stats['max_depth'])
+    out.released.set()
+    buffer.done()
+    assert_list_equal(list(range(10)), out.data)
+    assert_equals(0, buffer.depth)
+
+
+def test_thread_buffer_failed_receiver():
+    class FailingAppender(ListAppender):
+        def append(self, data):
+            raise IOError('disk full')
+
+    out = FailingAppender()
+    buffer = ThreadBuffer(out, maxsize=1)
+    buffer.append(0)
+    buffer.join()
+    assert_raises(RuntimeError, buffer.append, 1)
+    assert_true(out.is_done)
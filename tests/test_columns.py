@@ -0,0 +1,46 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from nose.tools import assert_equals, assert_list_equal, assert_raises
+
+from kumbhserial.columns import RecordColumns
+
+DTYPES = (('line', np.uint32), ('rssi', np.int8))
+
+
+def test_record_columns():
+    columns = RecordColumns(DTYPES)
+    assert_equals(0, len(columns))
+    assert_list_equal([], columns.column('rssi').tolist())
+    columns.extend({'line': [0, 0], 'rssi': [-20, -35]})
+    columns.extend({'line': [], 'rssi': []})
+    columns.extend({'line': np.array([1]), 'rssi': np.array([-83])})
+    assert_equals(3, len(columns))
+    assert_list_equal([{'line': 0, 'rssi': -20}, {'line': 0, 'rssi': -35},
+                       {'line': 1, 'rssi': -83}], list(columns))
+    assert_equals({'line': 1, 'rssi': -83}, columns[-1])
+    assert_raises(IndexError, columns.__getitem__, 3)
+    assert_equals(np.int8, columns.column('rssi').dtype)
+    assert_equals(15, columns.nbytes)
+
+
+def test_record_columns_from_records():
+    records = [{'line': 5, 'rssi': -40}, {'line': 6, 'rssi': -41}]
+    columns = RecordColumns.from_records(DTYPES, records)
+    assert_list_equal(records, list(columns))
+    assert_list_equal([5, 6], columns.column('line').tolist())
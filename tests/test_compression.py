@@ -0,0 +1,131 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import os
+import shutil
+import tempfile
+import time
+from nose.tools import (assert_equals, assert_list_equal, assert_true,
+                        assert_raises, assert_is_none)
+
+from kumbhserial.compression import (CompressedDumper, detect_compression,
+                                     iter_chunks, check_compression,
+                                     compressed_name, frame_compressor,
+                                     strip_compression_extension)
+from kumbhserial.index import read_session
+from kumbhserial.reader import iter_records
+
+RECORDS = [bytes('\n{0:06d}:XxsBcPAXDwFw8BcPAXDwFw\r'.format(i), 'ascii')
+           for i in range(1000)]
+
+
+def test_compressed_dumper():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'dump.txt.gz')
+        dumper = CompressedDumper(path, frame_size=4096)
+        for record in RECORDS[:500]:
+            dumper.append(record)
+        size = dumper.tell()
+        for record in RECORDS[500:]:
+            dumper.append(record)
+        dumper.done()
+
+        assert_equals('gzip', detect_compression(path))
+        assert_equals(b''.join(RECORDS), b''.join(iter_chunks(path)))
+
+        # a crash while writing leaves an incomplete frame
+        with open(path, 'r+b') as f:
+            f.truncate(size + 10)
+        assert_equals(b''.join(RECORDS[:500]), b''.join(iter_chunks(path)))
+
+        # continue after the last complete frame
+        dumper = CompressedDumper(path, offset=size)
+        dumper.append(b''.join(RECORDS[500:]))
+        dumper.done()
+        assert_equals(b''.join(RECORDS), b''.join(iter_chunks(path)))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_compressed_dumper_interval():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'dump.txt.gz')
+        dumper = CompressedDumper(path, flush_interval=0.05)
+        dumper.append(RECORDS[0])
+        # written by the thread without another append
+        for _ in range(100):
+            if os.path.getsize(path) > 0:
+                break
+            time.sleep(0.01)
+        assert_equals(RECORDS[0], b''.join(iter_chunks(path)))
+        dumper.done()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_iter_compressed_records():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'dump.txt.gz')
+        dumper = CompressedDumper(path, frame_size=1000)
+        dumper.append(b''.join(RECORDS))
+        dumper.append(b'\ntail')
+        dumper.done()
+        assert_list_equal(RECORDS + [b'\ntail'],
+                          [bytes(r) for r in iter_records(path)])
+
+        start = len(RECORDS[0]) * 100
+        end = len(RECORDS[0]) * 700 + 5
+        assert_list_equal(RECORDS[100:700] + [RECORDS[700][:5]],
+                          [bytes(r) for r in iter_records(path, start=start,
+                                                          end=end)])
+
+        session = {'file': path, 'start_offset': start,
+                   'end_offset': start + len(RECORDS[0]) * 2}
+        assert_equals(b''.join(RECORDS[100:102]), read_session(session))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_compression_names():
+    check_compression('gzip')
+    assert_raises(ValueError, check_compression, 'bz2')
+    assert_equals('a.json.gz', compressed_name('a.json', 'gzip'))
+    assert_equals('a.json', compressed_name('a.json', None))
+    assert_equals('a.txt', strip_compression_extension('a.txt.zst'))
+    assert_equals('a.txt', strip_compression_extension('a.txt'))
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'plain.txt')
+        with open(path, 'wb') as f:
+            f.write(RECORDS[0])
+        assert_is_none(detect_compression(path))
+        assert_true(b''.join(iter_chunks(path)) == RECORDS[0])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_gzip_frame():
+    compress = frame_compressor('gzip')
+    frame = compress(RECORDS[0])
+    # no modification time, so equal data gives equal frames
+    assert_equals(b'\0\0\0\0', frame[4:8])
+    assert_equals(frame, compress(RECORDS[0]))
+    assert_equals(RECORDS[0], gzip.decompress(frame))
@@ -0,0 +1,78 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import threading
+from nose.tools import assert_equals, assert_list_equal, assert_true
+
+from kumbhserial.daemon import DownloadDaemon
+
+from helpers import ListAppender
+
+
+def open_pty():
+    master, slave = os.openpty()
+    return master, os.ttyname(slave), slave
+
+
+def test_download_daemon():
+    ptys = [open_pty() for _ in range(3)]
+    appenders = {}
+
+    def appender_factory(port):
+        appenders[port] = ListAppender()
+        return appenders[port]
+
+    reader_daemon = DownloadDaemon(appender_factory, insert_timestamp_at=(),
+                                   heartbeat=0.1, idle_time=0.3)
+    loop = reader_daemon.loop
+
+    async def run():
+        await asyncio.gather(reader_daemon.run(), talk())
+
+    async def talk():
+        for i, (master, _, _) in enumerate(ptys):
+            os.write(master, b'\n>%d\r\n000000:ab' % i)
+        await asyncio.sleep(0.3)
+        for i, (master, _, _) in enumerate(ptys):
+            os.write(master, b'c\r')
+        reader_daemon.stop()
+        await asyncio.sleep(0.1)
+        # keep reading until the device is idle
+        for i, (master, _, _) in enumerate(ptys):
+            os.write(master, b'\n<%d\r' % i)
+
+    try:
+        num_threads = threading.active_count()
+        for _, port, _ in ptys:
+            reader_daemon.add(port)
+        assert_equals(num_threads, threading.active_count())
+        loop.run_until_complete(run())
+        assert_equals({}, reader_daemon.readers)
+        for i, (master, port, _) in enumerate(ptys):
+            assert_true(appenders[port].is_done)
+            assert_list_equal([b'\n>%d\r' % i, b'\n000000:abc\r',
+                               b'\n<%d\r' % i], appenders[port].data)
+            heartbeat = os.read(master, 1024)
+            assert_true(len(heartbeat) >= 2)
+            assert_equals(b'@' * len(heartbeat), heartbeat)
+    finally:
+        loop.close()
+        for master, _, slave in ptys:
+            os.close(master)
+            os.close(slave)
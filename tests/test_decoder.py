@@ -0,0 +1,60 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+from nose.tools import assert_equals, assert_list_equal
+
+from kumbhserial.decoder import (b64decode_lines, decode_lines,
+                                 unpack_detections, unpack_system)
+
+
+def test_b64decode_lines():
+    lines = [b'IQL6QD0AAAAwwQMAAPVAPQ', b'XxsBcPAXDwFw8BcPAXDwFw',
+             b'IQL6QD0AAAAwwQ!AAPVAPQ', b'IQL6QD0AAAAwwQMAAPVAP']
+    binary, valid = b64decode_lines(lines)
+    assert_list_equal([True, True, False, False], valid.tolist())
+    assert_equals(base64.b64decode(lines[0] + b'=='), binary[0].tobytes())
+    assert_equals(base64.b64decode(lines[1] + b'=='), binary[1].tobytes())
+
+
+def test_decode_lines():
+    lines = [b'RVhQRVJJTUVOVF9EQVRBAA', b'//////////////////////',
+             b'IQL6QD0AAAAwwQMAAPVAPQ', b'IQL6QD0AAAAwwQMAAPVAPA']
+    binary, valid, checksums = decode_lines(lines)
+    assert_list_equal([False, False, True, True], valid.tolist())
+    assert_equals(0, checksums[2])
+    assert_equals(255, checksums[3])
+
+
+def test_unpack_system():
+    binary, _, _ = decode_lines([b'IQL6QD0AAAAwwQMAAPVAPQ'])
+    columns = unpack_system(binary, [1])
+    assert_equals({'line': 1, 'auth': 12481, 'time': 4014330, 'density': 2,
+                   'rtc': 4014325, 'reset': 1, 'state': 1, 'detection': 0},
+                  {k: v.tolist()[0] for k, v in columns.items()})
+
+
+def test_unpack_detections():
+    binary, _, _ = decode_lines([b'XxsBcPAXDwFw8BcPAXDwFw',
+                                 b'/////////////////////w',
+                                 b'ZxsBcPAXD////////////w'])
+    columns = unpack_detections(binary, [0, 1, 2])
+    assert_list_equal([0] * 6 + [2] * 3, columns['line'].tolist())
+    assert_list_equal([-47] + [-35] * 5 + [-47, -35, -35],
+                      columns['rssi'].tolist())
+    assert_list_equal([23] * 8 + [4095], columns['id'].tolist())
+    assert_list_equal([0] * 9, columns['type'].tolist())
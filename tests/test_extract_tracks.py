@@ -0,0 +1,205 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import sys
+import tempfile
+import time
+from nose.tools import assert_equals, assert_false, assert_raises
+
+# extract_tracks.py is a script in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import extract_tracks  # noqa: E402
+
+_old_tz = None
+
+
+def setup_module():
+    # times are in local time, as recorded in India
+    global _old_tz
+    _old_tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Kolkata'
+    time.tzset()
+
+
+def teardown_module():
+    if _old_tz is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = _old_tz
+    time.tzset()
+
+
+def record(row, day, hour, minute, second, latitude, longitude, speed):
+    return {'row': row, 'device': 'GPS01', 'year': 2016, 'month': 1,
+            'day': day, 'hour': hour, 'minute': minute, 'second': second,
+            'latitude': latitude, 'longitude': longitude, 'speed': speed,
+            'direction': 90.0, 'numSatellites': 7}
+
+
+def records():
+    return [
+        record(1, 15, 23, 40, 0, 23.18, 75.77, 0.0),
+        record(2, 15, 23, 40, 10, 23.18, 75.771, 35.0),
+        # a break of more than 10 minutes, continuing past midnight
+        record(3, 15, 23, 59, 55, 23.181, 75.771, 0.0),
+        record(4, 16, 0, 0, 5, 23.182, 75.771, 40.0),
+        # time going backwards
+        record(5, 16, 0, 0, 0, 23.182, 75.772, 0.0),
+        record(6, 16, 0, 0, 30, 23.182, 75.775, 36.0),
+    ]
+
+
+def track(track_id, coordinates):
+    return {'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': coordinates},
+            'properties': {'id': track_id, 'device': 'GPS01',
+                           'filename': 'GPS01'}}
+
+
+def point(coordinates, timestamp, speed, track_id, meter_x, meter_y,
+          speed_computed):
+    return {'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': coordinates},
+            'properties': {'timestamp': timestamp, 'speed': speed,
+                           'direction': 90.0, 'numSatellites': 7,
+                           'track': track_id, 'device': 'GPS01',
+                           'meter_x': meter_x, 'meter_y': meter_y,
+                           'speed_computed': speed_computed}}
+
+
+TRACKS = {'type': 'FeatureCollection', 'features': [
+    track(1, [[75.77, 23.18], [75.771, 23.18]]),
+    track(2, [[75.771, 23.181], [75.771, 23.182]]),
+    track(3, [[75.772, 23.182], [75.775, 23.182]]),
+]}
+
+# projected coordinates in meters and computed speeds in km/h, rounded
+POINTS = {'type': 'FeatureCollection', 'features': [
+    point([75.77, 23.18], 1452881400, 0.0, 1,
+          1193998.404, 2579636.151, 0.0),
+    point([75.771, 23.18], 1452881410, 35.0, 1,
+          1194101.247, 2579640.958, 37.064),
+    point([75.771, 23.181], 1452882595, 0.0, 2,
+          1194096.048, 2579752.198, 0.0),
+    point([75.771, 23.182], 1452882605, 40.0, 2,
+          1194090.848, 2579863.439, 40.090),
+    point([75.772, 23.182], 1452882600, 0.0, 3,
+          1194193.689, 2579868.246, 0.0),
+    point([75.775, 23.182], 1452882630, 36.0, 3,
+          1194502.214, 2579882.672, 37.063),
+]}
+
+
+def rounded(points):
+    for feature in points['features']:
+        properties = feature['properties']
+        for key in ('meter_x', 'meter_y', 'speed_computed'):
+            properties[key] = round(properties[key], 3)
+    return points
+
+
+def test_segment_starts():
+    unix_times = extract_tracks.timestamps(records())
+    assert_equals([int(extract_tracks.timestamp(r)) for r in records()],
+                  unix_times.tolist())
+    assert_equals([True, False, True, False, True, False],
+                  extract_tracks.segment_starts(unix_times).tolist())
+    assert_equals([True, False, False, False, True, False],
+                  extract_tracks.segment_starts(unix_times, 1200).tolist())
+
+
+def test_extract_tracks():
+    with tempfile.TemporaryDirectory() as input_directory, \
+            tempfile.TemporaryDirectory() as output_directory:
+        with open(os.path.join(input_directory, 'GPS01.json'), 'w') as f:
+            json.dump(records(), f)
+        with open(os.path.join(input_directory, 'notes.txt'), 'w') as f:
+            f.write('not a json file')
+        extract_tracks.extract_tracks(input_directory, output_directory)
+        with open(os.path.join(output_directory, 'tracks.json')) as f:
+            assert_equals(TRACKS, json.load(f))
+        with open(os.path.join(output_directory, 'points.json')) as f:
+            assert_equals(POINTS, rounded(json.load(f)))
+
+
+def test_feature_writer():
+    features = [track(i, [[75.77, 23.18]]) for i in range(1, 4)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tracks.json')
+        for num_features in range(len(features) + 1):
+            with extract_tracks.FeatureWriter(path) as writer:
+                for feature in features[:num_features]:
+                    writer.write(feature)
+                    writer.flush()
+            with open(path) as f:
+                assert_equals({'type': 'FeatureCollection',
+                               'features': features[:num_features]},
+                              json.load(f))
+        assert_equals(['tracks.json'], os.listdir(directory))
+
+
+def test_feature_writer_ndjson():
+    features = [track(i, [[75.77, 23.18]]) for i in range(1, 4)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tracks.ndjson')
+        with extract_tracks.FeatureWriter(path, ndjson=True) as writer:
+            for feature in features:
+                writer.write(feature)
+        with open(path) as f:
+            assert_equals(features, [json.loads(line) for line in f])
+
+
+def test_extract_tracks_ndjson():
+    with tempfile.TemporaryDirectory() as input_directory, \
+            tempfile.TemporaryDirectory() as output_directory:
+        with open(os.path.join(input_directory, 'GPS01.json'), 'w') as f:
+            json.dump(records(), f)
+        extract_tracks.extract_tracks(input_directory, output_directory,
+                                      ndjson=True)
+        with open(os.path.join(output_directory, 'tracks.ndjson')) as f:
+            assert_equals(TRACKS['features'],
+                          [json.loads(line) for line in f])
+        with open(os.path.join(output_directory, 'points.ndjson')) as f:
+            assert_equals(POINTS, rounded({
+                'type': 'FeatureCollection',
+                'features': [json.loads(line) for line in f]}))
+
+
+def test_interrupted():
+    with tempfile.TemporaryDirectory() as input_directory, \
+            tempfile.TemporaryDirectory() as output_directory:
+        with open(os.path.join(input_directory, 'GPS01.json'), 'w') as f:
+            json.dump(records(), f)
+        extract_tracks.extract_tracks(input_directory, output_directory)
+        with open(os.path.join(output_directory, 'tracks.json')) as f:
+            tracks = f.read()
+        with open(os.path.join(output_directory, 'points.json')) as f:
+            points = f.read()
+
+        with open(os.path.join(input_directory, 'GPS02.json'), 'w') as f:
+            f.write('[{"row": 1, ')
+        assert_raises(ValueError, extract_tracks.extract_tracks,
+                      input_directory, output_directory)
+        with open(os.path.join(output_directory, 'tracks.json')) as f:
+            assert_equals(tracks, f.read())
+        with open(os.path.join(output_directory, 'points.json')) as f:
+            assert_equals(points, f.read())
+        for file_name in os.listdir(output_directory):
+            assert_false(file_name.endswith('.tmp'))
@@ -0,0 +1,94 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+from nose.tools import assert_equals, assert_is_none
+
+from kumbhserial.appenders import Duplicator, Dumper
+from kumbhserial.framing import RecordFramer
+from kumbhserial.helpers import Clock
+
+from helpers import ListAppender
+
+DATA = b'\n>%1\r\n000000:abcd\r\n<1\r\npartial'
+
+
+class FixedClock(Clock):
+    def now(self):
+        return 1e9
+
+    def timestamp_bytes(self, unix_time=None):
+        return b'T' if unix_time == 1e9 else b'?'
+
+
+class RecordAppender(ListAppender):
+    def append_record(self, record, meta):
+        self.data.append((bytes(record), meta.offset, meta.timestamp,
+                          meta.timestamp_index))
+
+
+def feed(framer, data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        framer.feed(data[i:i + chunk_size])
+
+
+def test_split_chunks():
+    for chunk_size in (1, 3, len(DATA)):
+        appender = ListAppender()
+        framer = RecordFramer(appender, clock=FixedClock(), buffer_size=4)
+        feed(framer, DATA, chunk_size)
+        assert_equals([b'\n>%T%%1\r', b'\n000000:abcd\r', b'\n<%T%1\r'],
+                      appender.data)
+        assert_equals(b'\npartial', bytes(framer.buffer[:framer.length]))
+        framer.flush()
+        assert_equals(b'\npartial', appender.data[-1])
+        assert_equals(4, framer.num_records)
+        assert_equals(len(DATA), framer.offset)
+
+
+def test_append_record():
+    appender = RecordAppender()
+    framer = RecordFramer(appender, clock=FixedClock())
+    feed(framer, DATA, 5)
+    assert_equals([(b'\n>%1\r', 0, b'T', 2),
+                   (b'\n000000:abcd\r', 5, None, None),
+                   (b'\n<1\r', 18, b'T', 2)], appender.data)
+
+
+def test_no_terminator():
+    appender = ListAppender()
+    framer = RecordFramer(appender, terminator=None, clock=FixedClock())
+    framer.feed(b'ab>c')
+    framer.feed(b'de')
+    assert_equals([b'ab>%T%c', b'de'], appender.data)
+    assert_equals(0, framer.flush())
+
+
+def test_dumper_append_record():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dump.txt')
+        appender = ListAppender()
+        dumper = Dumper(path)
+        framer = RecordFramer(Duplicator([appender, dumper]),
+                              clock=FixedClock())
+        framer.feed(DATA)
+        framer.flush()
+        dumper.done()
+        with open(path, 'rb') as f:
+            assert_equals(b''.join(appender.data), f.read())
+    assert_is_none(framer.meta.timestamp)
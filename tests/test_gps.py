@@ -0,0 +1,158 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import threading
+import time
+from nose.tools import (assert_almost_equal, assert_equals, assert_false,
+                        assert_less, assert_true)
+
+from kumbhserial.gps import GpsDrain, GpsInterpreter, GpsScheduler
+from kumbhserial.synthetic import gps_stream
+
+from helpers import ListAppender
+
+
+def test_gps_interpreter():
+    appender = ListAppender()
+    interpreter = GpsInterpreter('test', appender, batch_size=2)
+    interpreter.append(b'$TI010,230416125520,2310.6876N,07543.6625E,'
+                       b'000.00,029.87,14,1#')
+    assert_equals([], appender.data)
+    interpreter.append(b'$TI010,290216000001,0010.5000S,00030.0000W,'
+                       b'5.5,-1,3,2#')
+    assert_equals(2, len(appender.data))
+    first, second = appender.data
+    assert_equals('TI010', first['deviceId'])
+    # 2016-04-23T12:55:20Z
+    assert_equals(1461416120, first['timestamp'])
+    assert_almost_equal(23 + 10.6876 / 60, first['latitude'])
+    assert_almost_equal(75 + 43.6625 / 60, first['longitude'])
+    assert_equals(0.0, first['speed'])
+    assert_equals(29.87, first['direction'])
+    assert_equals(14, first['numberOfSatellites'])
+    assert_equals(1, first['line'])
+    assert_equals(1456704001, second['timestamp'])
+    assert_almost_equal(-0.175, second['latitude'])
+    assert_almost_equal(-0.5, second['longitude'])
+    assert_equals('TI010', interpreter.current_id)
+    assert_false(interpreter.has_error())
+
+    interpreter.append(b'$TI010,300216000001,0010.5000S,00030.0000W,'
+                       b'5.5,-1,3,3#')
+    interpreter.append(b'garbage#')
+    interpreter.append(b'@')
+    assert_true(interpreter.is_done)
+    assert_true(appender.is_done)
+    assert_equals(2, len(appender.data))
+    assert_equals(4, interpreter.num_records)
+    assert_equals(2, len(interpreter.errors))
+    assert_true(interpreter.errors[0].startswith('cannot parse record #3'))
+    assert_true(interpreter.errors[1].startswith('cannot parse record #4'))
+
+
+class FakeGpsDevice(threading.Thread):
+    """ Answers OpenT with GPS records and records the commands it got. """
+    def __init__(self, num_records, device_id=b'TI010'):
+        super().__init__(daemon=True)
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        out = io.BytesIO()
+        gps_stream(out, num_records, device_id=device_id)
+        self.data = out.getvalue()
+        self.commands = b''
+
+    def run(self):
+        while not self.commands.endswith(b'OpenT'):
+            self.commands += os.read(self.master, 100)
+        os.write(self.master, self.data)
+        while not self.commands.endswith(b'clearM'):
+            self.commands += os.read(self.master, 100)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def test_gps_drain():
+    device = FakeGpsDevice(100)
+    device.start()
+    appender = ListAppender()
+    try:
+        drain = GpsDrain(device.port, appender, idle_time=5)
+        start = time.monotonic()
+        drain.run()
+        # the end marker stops reading without waiting for the idle time
+        assert_less(time.monotonic() - start, 2)
+        device.join(timeout=5)
+        assert_equals(b'OpenTclearM', device.commands)
+    finally:
+        device.close()
+    assert_true(drain.end_reached)
+    assert_true(appender.is_done)
+    assert_equals(100, len(appender.data))
+    assert_equals('TI010', appender.data[0]['deviceId'])
+    assert_equals(len(device.data), drain.num_bytes)
+
+
+def test_gps_drain_empty():
+    master, slave = os.openpty()
+    appender = ListAppender()
+    try:
+        drain = GpsDrain(os.ttyname(slave), appender, idle_time=0.3)
+        drain.run()
+        assert_equals(b'OpenT', os.read(master, 100))
+    finally:
+        os.close(master)
+        os.close(slave)
+    assert_false(drain.end_reached)
+    assert_true(appender.is_done)
+    assert_equals([], appender.data)
+
+
+def test_gps_scheduler():
+    devices = [FakeGpsDevice(50, device_id=b'TI%03d' % i) for i in range(5)]
+    appenders = {}
+
+    def appender_factory(port):
+        appenders[port] = ListAppender()
+        return appenders[port]
+
+    for device in devices:
+        device.start()
+    try:
+        scheduler = GpsScheduler(appender_factory, workers=2, idle_time=5)
+        for device in devices:
+            assert_true(scheduler.add(device.port))
+        assert_false(scheduler.add(devices[-1].port))
+        scheduler.stop()
+        for device in devices:
+            device.join(timeout=5)
+            assert_equals(b'OpenTclearM', device.commands)
+    finally:
+        for device in devices:
+            device.close()
+
+    assert_equals(5, len(scheduler.finished))
+    assert_equals({}, scheduler.active)
+    for i, device in enumerate(devices):
+        appender = appenders[device.port]
+        assert_true(appender.is_done)
+        assert_equals(50, len(appender.data))
+        assert_equals('TI%03d' % i, appender.data[0]['deviceId'])
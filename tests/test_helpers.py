@@ -0,0 +1,82 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from datetime import datetime, timezone
+from nose.tools import assert_equals, assert_true, assert_is
+
+from kumbhserial.helpers import (Clock, IsoFormatter, insert_timestamp,
+                                 strip_view, timestamp)
+
+
+def iso(unix_time):
+    return datetime.fromtimestamp(unix_time, timezone.utc).astimezone() \
+        .isoformat()
+
+
+def test_iso_formatter():
+    formatter = IsoFormatter()
+    now = time.time()
+    for t in (now, now + 0.5, now + 1, float(int(now)), 1e9 + 0.9999996):
+        assert_equals(iso(t), formatter.format(t))
+
+
+def test_clock():
+    clock = Clock()
+    now = time.time()
+    assert_equals(iso(now), clock.timestamp(now))
+    assert_equals(bytes(iso(now), encoding='ascii'),
+                  clock.timestamp_bytes(now))
+    before = time.time()
+    assert_true(before <= clock.now() <= time.time())
+    assert_true(clock.monotonic() <= time.monotonic())
+
+    clock = Clock(resolution=0.5)
+    assert_equals(iso(1e9), clock.timestamp(1e9 + 0.25))
+    text = clock.timestamp(1e9 + 0.5)
+    assert_equals(iso(1e9 + 0.5), text)
+    # same tick: cached
+    assert_is(text, clock.timestamp(1e9 + 0.75))
+
+
+def test_timestamp():
+    before = datetime.now(timezone.utc)
+    text = timestamp()
+    after = datetime.now(timezone.utc)
+    assert_true(before <= datetime.fromisoformat(text) <= after)
+
+
+def test_insert_timestamp():
+    clock = Clock(resolution=1)
+    before = clock.timestamp_bytes()
+    data = insert_timestamp(b'\n>12\r', b'>', clock=clock)
+    after = clock.timestamp_bytes()
+    assert_true(data in (b'\n>%' + before + b'%12\r',
+                         b'\n>%' + after + b'%12\r'))
+    assert_equals(b'\n000000:ab\r',
+                  insert_timestamp(b'\n000000:ab\r', b'>', clock=clock))
+
+
+def test_strip_view():
+    data = bytearray(b'\n \t000000:abcd\r\n')
+    view = strip_view(data)
+    assert_equals(b'000000:abcd', view)
+    # not a copy
+    data[3] = ord('1')
+    assert_equals(b'100000:abcd', view)
+    for text in (b'', b' \r\n', b'abc', b'a b'):
+        assert_equals(text.strip(), bytes(strip_view(text)))
@@ -0,0 +1,111 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from nose.tools import assert_equals, assert_list_equal, assert_is_none
+
+from kumbhserial.index import (SessionIndex, SessionIndexAppender,
+                               parse_time, read_session, unix_time)
+from kumbhserial.interpreter import TrackerInterpreter
+from kumbhserial.processing import convert_files
+from kumbhserial.reader import read_file
+
+BLOCK = (b'\n>%2016-04-{1}T22:59:00.000000+05:30%{0}\r'
+         b'\n000000-RVhQRVJJTUVOVF9EQVRBAA\r'
+         b'\n000001-IQL6QD0AAAAwwQMAAPVAPQ\r'
+         b'\n000000:XxsBcPAXDwFw8BcPAXDwFw\r'
+         b'\n000554://////////////////////\r'
+         b'\n<%2016-04-{1}T23:00:00.000000+05:30%{0}\r')
+
+
+def block(device_id, day):
+    return (BLOCK.replace(b'{0}', str(device_id).encode('ascii'))
+            .replace(b'{1}', str(day).encode('ascii')))
+
+
+def make_dump(directory):
+    path = os.path.join(directory, 'dump.txt')
+    with open(path, 'wb') as f:
+        for device_id, day in ((1, 20), (2, 21), (1, 22), (3, 23), (1, 24)):
+            f.write(block(device_id, day))
+    return path
+
+
+def test_session_index():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory)
+        index_path = os.path.join(directory, 'sessions.sqlite')
+        read_file(path, TrackerInterpreter(
+            SessionIndexAppender(index_path, path)))
+        # indexing again does not add duplicates
+        read_file(path, TrackerInterpreter(
+            SessionIndexAppender(index_path, path)))
+
+        index = SessionIndex(index_path)
+        assert_equals(5, len(index.find()))
+        sessions = index.find(device_id=1, start='2016-04-21',
+                              end='2016-04-24T23:00:00+05:30')
+        index.close()
+
+        assert_list_equal(['2016-04-22T22:59:00.000000+05:30',
+                           '2016-04-24T22:59:00.000000+05:30'],
+                          [s['time'] for s in sessions])
+        session = sessions[0]
+        assert_equals(block(1, 22), read_session(session))
+        assert_equals((6, 6, 1), (session['num_lines'],
+                                  session['detections'], session['system']))
+        assert_is_none(session['error'])
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_session_index_parallel():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory)
+        index_path = os.path.join(directory, 'sessions.sqlite')
+        conversion = (path, os.path.join(directory, 'detection.json'),
+                      os.path.join(directory, 'system.json'))
+        results = list(convert_files([conversion], jobs=2, split_size=0,
+                                     index=index_path))
+        assert_is_none(results[0][1])
+
+        index = SessionIndex(index_path)
+        sessions = index.find(filename=path)
+        index.close()
+        assert_list_equal([1, 2, 1, 3, 1], [s['device_id'] for s in sessions])
+        for session, (device_id, day) in zip(sessions, ((1, 20), (2, 21),
+                                                        (1, 22), (3, 23),
+                                                        (1, 24))):
+            assert_equals(block(device_id, day), read_session(session))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_parse_time():
+    # 2016-04-23T17:29:00 UTC
+    expected = 1461432540.0
+    assert_equals(expected, parse_time('2016-04-23T22:59:00.000000+05:30'))
+    assert_equals(expected, parse_time('2016-04-23T22:59:00+0530'))
+    assert_equals(expected, parse_time('2016-04-23T16:29:00-01:00'))
+    assert_equals(expected + 0.5,
+                  unix_time('2016-04-23T22:59:00.500000+05:30'))
+    assert_is_none(unix_time('2016-04-23T22:59:00+05:3'))
+    assert_is_none(unix_time(None))
@@ -15,9 +15,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from nose.tools import assert_equals, assert_list_equal
+import io
+from contextlib import redirect_stdout
+from nose.tools import assert_equals, assert_list_equal, assert_true
 
-from kumbhserial.interpreter import TrackerEntrySet, TrackerInterpreter
+from kumbhserial.interpreter import (
+    SeparatedTrackerEntrySetJsonConverter, TrackerEntrySet,
+    TrackerInterpreter)
+
+from helpers import ListAppender
 
 
 class MockAppender():
@@ -82,3 +88,81 @@ def test_tracker_entryset():
                        {'line': 0, 'type': 0, 'id': 23, 'rssi': -35}],
                       tracker.detections)
 
+
+def test_converter_checksum_error():
+    tracker = TrackerEntrySet(0, '2016-04-23T22:59:00.0000')
+    # one character changed, so the LRC is invalid
+    tracker.add_detection(0, b'YxsBcPAXDwFw8BcPAXDwFw')
+    tracker.add_system(1, b'IQL6QD0AAAAwwQMAAPVAPQ')
+    detections = ListAppender()
+    system = ListAppender()
+    SeparatedTrackerEntrySetJsonConverter(detections, system).append(tracker)
+    assert_equals(6, len(detections.data))
+    assert_equals(1, len(system.data))
+    for record in detections.data + system.data:
+        assert_true(record['error'].startswith('data checksum'))
+
+
+def test_checksum_and_format_error():
+    appender = ListAppender()
+    parser = TrackerInterpreter(appender)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        parser.append(b'\n>%2016-04-23T22:59:00.0000%0\r')
+        parser.append(b'\n000000:YxsBcPAXDwFw8BcPAXDwFw\r')
+        parser.append(b'\n000001:XxsBcPAXDw\r')
+        parser.done()
+    assert_equals(1, len(appender.data))
+    assert_true(appender.data[0].error.startswith(
+        b'Device log line not length 29'))
+    messages = output.getvalue().splitlines()
+    assert_equals(2, len(messages))
+    assert_true('data checksum' in messages[0])
+    assert_true('not length 29' in messages[1])
+
+
+def test_batch_appender():
+    appender = ListAppender()
+    batches = ListAppender()
+    parser = TrackerInterpreter(appender, batch_appender=batches,
+                                batch_interval=0)
+    parser.append(b'\n>%2016-04-23T22:59:00.0000%0\r')
+    parser.append(b'\n000000:XxsBcPAXDwFw8BcPAXDwFw\r')
+    # decoded before the device log is finished
+    assert_equals(1, len(batches.data))
+    assert_equals(6, len(batches.data[0].detection_columns))
+    assert_equals(0, len(batches.data[0].system_columns))
+    parser.append(b'\n000001-IQL6QD0AAAAwwQMAAPVAPQ\r')
+    assert_equals(2, len(batches.data))
+    assert_equals([1], [r['line'] for r in batches.data[1].system])
+    assert_equals([], appender.data)
+    parser.append(b'\n<%2016-04-23T23:00:00.0000%0\r')
+    parser.done()
+    assert_equals(2, len(batches.data))
+    assert_equals(1, len(appender.data))
+    assert_equals(6, len(appender.data[0].detection_columns))
+    assert_equals(1, len(appender.data[0].system_columns))
+
+
+def test_memoryview_records():
+    records = [b'\n>%2016-04-23T22:59:00.0000%0\r',
+               b'\n000000:XxsBcPAXDwFw8BcPAXDwFw\r',
+               b'\n000001-IQL6QD0AAAAwwQMAAPVAPQ\r',
+               b'\n<%2016-04-23T23:00:00.0000%0\r']
+    expected = ListAppender()
+    parser = TrackerInterpreter(expected)
+    for record in records:
+        parser.append(record)
+    parser.done()
+
+    appender = ListAppender()
+    parser = TrackerInterpreter(appender)
+    buffer = bytearray(64)
+    for record in records:
+        # the buffer is reused for each record, as with framed records
+        buffer[:len(record)] = record
+        parser.append(memoryview(buffer)[:len(record)])
+    parser.done()
+    assert_equals(expected.data, appender.data)
+    assert_equals(6, len(appender.data[0].detections))
+    assert_equals(1, len(appender.data[0].system))
@@ -0,0 +1,203 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import types
+from datetime import datetime, timedelta
+from nose.tools import assert_equals, assert_true
+
+# parse_excel.py is a script in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+if importlib.util.find_spec('xlrd') is None:
+    sys.modules['xlrd'] = types.ModuleType('xlrd')
+import parse_excel  # noqa: E402
+
+
+class FakeSheet(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def col_values(self, col, start_rowx=0):
+        return [row[col] for row in self.rows[start_rowx:]]
+
+
+class FakeWorkbook(object):
+    datemode = 0
+
+    def __init__(self, rows):
+        self.sheet = FakeSheet(rows)
+
+    def sheet_by_index(self, index):
+        return self.sheet
+
+
+class FakeXlrd(object):
+    """ Reads workbooks that are json lists of rows, header included. """
+    def __init__(self):
+        self.converted = []
+
+    def open_workbook(self, path):
+        with open(path) as f:
+            return FakeWorkbook(json.load(f))
+
+    def xldate_as_tuple(self, value, datemode):
+        self.converted.append(value)
+        moment = datetime(1899, 12, 30) + timedelta(days=value)
+        return moment.timetuple()[:6]
+
+
+_xlrd = None
+
+
+def setup_module():
+    global _xlrd
+    _xlrd = parse_excel.xlrd
+    parse_excel.xlrd = FakeXlrd()
+
+
+def teardown_module():
+    parse_excel.xlrd = _xlrd
+
+
+HEADER = ['No', 'Device', 'Date', 'Time', 'Latitude', 'Longitude', 'Speed',
+          'Direction', 'Satellites']
+# 2016-01-15
+DAY = 42384.0
+
+
+def write_workbook(path, device, num_rows=2):
+    rows = [HEADER] + [[float(i + 1), device, DAY, 0.5 + i / 64.0,
+                        23.18, 75.77, 10.0, 90.0, 7.0]
+                       for i in range(num_rows)]
+    with open(path, 'w') as f:
+        json.dump(rows, f)
+
+
+def test_convert_dates():
+    parse_excel.xlrd.converted = []
+    dates = parse_excel.convert_dates([DAY, DAY + 1, DAY], 0, slice(None, 3))
+    assert_equals([(2016, 1, 15), (2016, 1, 16), (2016, 1, 15)], dates)
+    assert_equals([DAY, DAY + 1], sorted(parse_excel.xlrd.converted))
+    times = parse_excel.convert_dates([0.5, 0.5, 0.75], 0, slice(3, None))
+    assert_equals([(12, 0, 0), (12, 0, 0), (18, 0, 0)], times)
+    assert_equals(4, len(parse_excel.xlrd.converted))
+
+
+def test_parse_workbook():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'GPS01.xlsx')
+        write_workbook(path, 'GPS01')
+        records = parse_excel.parse_workbook(path)
+    assert_equals(2, len(records))
+    assert_equals({
+        'row': 2, 'device': 'GPS01', 'year': 2016, 'month': 1, 'day': 15,
+        'hour': 12, 'minute': 22, 'second': 30, 'latitude': 23.18,
+        'longitude': 75.77, 'speed': 10.0, 'direction': 90.0,
+        'numSatellites': 7}, records[1])
+
+
+def convert(input_directory, output_directory, jobs=1, force=False):
+    num_converted, num_skipped, failed = parse_excel.parse_excel(
+        input_directory, output_directory, jobs, force)
+    assert_equals([], failed)
+    return num_converted, num_skipped
+
+
+def test_manifest():
+    with tempfile.TemporaryDirectory() as input_directory, \
+            tempfile.TemporaryDirectory() as output_directory:
+        first = os.path.join(input_directory, 'GPS01.xlsx')
+        second = os.path.join(input_directory, 'GPS02.xlsx')
+        write_workbook(first, 'GPS01')
+        write_workbook(second, 'GPS02')
+        assert_equals((2, 0), convert(input_directory, output_directory))
+        assert_equals((0, 2), convert(input_directory, output_directory))
+        assert_equals((2, 0), convert(input_directory, output_directory,
+                                      force=True))
+
+        # a new modification time with the same content is only hashed
+        status = os.stat(first)
+        os.utime(first, (status.st_atime, status.st_mtime + 10))
+        assert_equals((0, 2), convert(input_directory, output_directory))
+        manifest = parse_excel.load_manifest(
+            os.path.join(output_directory, parse_excel.MANIFEST))
+        assert_equals(status.st_mtime + 10, manifest['GPS01.xlsx']['mtime'])
+
+        # changed content of the same size
+        write_workbook(first, 'GPS03')
+        os.utime(first, (status.st_atime, status.st_mtime + 20))
+        assert_equals((1, 1), convert(input_directory, output_directory))
+        with open(os.path.join(output_directory, 'GPS01.json')) as f:
+            assert_equals('GPS03', json.load(f)[0]['device'])
+
+        # the same modification time and size are trusted without hashing
+        write_workbook(first, 'GPS04')
+        os.utime(first, (status.st_atime, status.st_mtime + 20))
+        assert_equals((0, 2), convert(input_directory, output_directory))
+
+        # another size
+        write_workbook(first, 'GPS01', num_rows=3)
+        os.utime(first, (status.st_atime, status.st_mtime + 20))
+        assert_equals((1, 1), convert(input_directory, output_directory))
+
+        # a missing output file
+        os.remove(os.path.join(output_directory, 'GPS02.json'))
+        assert_equals((1, 1), convert(input_directory, output_directory))
+        assert_equals(sorted(['GPS01.json', 'GPS02.json',
+                              parse_excel.MANIFEST]),
+                      sorted(os.listdir(output_directory)))
+
+
+def test_failed_workbook():
+    with tempfile.TemporaryDirectory() as input_directory, \
+            tempfile.TemporaryDirectory() as output_directory:
+        write_workbook(os.path.join(input_directory, 'GPS01.xlsx'), 'GPS01')
+        broken = os.path.join(input_directory, 'GPS02.xlsx')
+        with open(broken, 'w') as f:
+            f.write('[["No"], [1.0]]')
+        num_converted, num_skipped, failed = parse_excel.parse_excel(
+            input_directory, output_directory)
+        assert_equals((1, 0), (num_converted, num_skipped))
+        assert_equals(1, len(failed))
+        assert_equals(broken, failed[0][0])
+        assert_true(failed[0][1].startswith('IndexError'))
+        manifest = parse_excel.load_manifest(
+            os.path.join(output_directory, parse_excel.MANIFEST))
+        assert_equals(['GPS01.xlsx'], list(manifest))
+
+
+def test_jobs():
+    with tempfile.TemporaryDirectory() as input_directory, \
+            tempfile.TemporaryDirectory() as serial_directory, \
+            tempfile.TemporaryDirectory() as parallel_directory:
+        for i in range(3):
+            write_workbook(os.path.join(input_directory,
+                                        'GPS0{0}.xlsx'.format(i)),
+                           'GPS0{0}'.format(i), num_rows=i + 1)
+        assert_equals((3, 0), convert(input_directory, serial_directory))
+        assert_equals((3, 0), convert(input_directory, parallel_directory,
+                                      jobs=2))
+        for file_name in os.listdir(serial_directory):
+            with open(os.path.join(serial_directory, file_name)) as f:
+                expected = json.load(f)
+            with open(os.path.join(parallel_directory, file_name)) as f:
+                assert_equals(expected, json.load(f))
@@ -0,0 +1,70 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+from nose.tools import assert_equals, assert_list_equal
+
+from kumbhserial.ports import PortWatcher
+
+
+def test_port_watcher():
+    directory = tempfile.mkdtemp()
+    probed = []
+    events = []
+
+    def probe(port):
+        probed.append(os.path.basename(port))
+        return os.access(port, os.R_OK)
+
+    def touch(name):
+        open(os.path.join(directory, name), 'w').close()
+
+    try:
+        touch('ttyUSB0')
+        touch('ttyUSB1')
+        touch('other')
+        watcher = PortWatcher([os.path.join(directory, 'tty*')], probe)
+        watcher.subscribe(lambda event, port: events.append(
+            (event, os.path.basename(port))))
+        watcher.scan()
+        assert_list_equal(['ttyUSB0', 'ttyUSB1'], sorted(probed))
+        assert_list_equal([('added', 'ttyUSB0'), ('added', 'ttyUSB1')],
+                          events)
+
+        # known ports are not probed again
+        del probed[:], events[:]
+        assert_equals(([], []), watcher.scan())
+        assert_list_equal([], probed)
+
+        touch('ttyUSB2')
+        os.remove(os.path.join(directory, 'ttyUSB0'))
+        watcher.scan()
+        assert_list_equal(['ttyUSB2'], probed)
+        assert_list_equal([('removed', 'ttyUSB0'), ('added', 'ttyUSB2')],
+                          events)
+
+        # a port with changed permissions is probed again
+        del probed[:], events[:]
+        os.chmod(os.path.join(directory, 'ttyUSB1'), 0o200)
+        watcher.scan()
+        assert_list_equal(['ttyUSB1'], probed)
+        if os.geteuid() != 0:
+            assert_list_equal([('removed', 'ttyUSB1')], events)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,236 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+from nose.tools import assert_equals, assert_true, assert_is_none
+
+import kumbhserial.processing
+from kumbhserial.compression import (open_compressed,
+                                     strip_compression_extension)
+from kumbhserial.processing import (Checkpoint, convert_file, convert_files,
+                                    split_blocks)
+
+BLOCK = (b'\n>%2016-04-23T22:59:00.0000%{0}\r'
+         b'\n000000-RVhQRVJJTUVOVF9EQVRBAA\r'
+         b'\n000001-IQL6QD0AAAAwwQMAAPVAPQ\r'
+         b'\n000000:XxsBcPAXDwFw8BcPAXDwFw\r'
+         b'\n000554://////////////////////\r'
+         b'\n<%2016-04-23T23:00:00.0000%{0}\r')
+
+
+def make_dump(directory, num_blocks, device_ids=None):
+    if device_ids is None:
+        device_ids = range(num_blocks)
+    path = os.path.join(directory, 'dump.txt')
+    with open(path, 'wb') as f:
+        for i in device_ids:
+            f.write(BLOCK.replace(b'{0}', str(i).encode('ascii')))
+    return path
+
+
+def convert(path, directory, name, output_format='json', extension=None,
+            **kwargs):
+    if extension is None:
+        extension = output_format
+    conversion = (path,
+                  os.path.join(directory, name + '-detection.' + extension),
+                  os.path.join(directory, name + '-system.' + extension))
+    results = list(convert_files([conversion], output_format=output_format,
+                                 **kwargs))
+    assert_equals(1, len(results))
+    assert_is_none(results[0][1])
+    return load(conversion[1]), load(conversion[2])
+
+
+def load(path):
+    with open_compressed(path) as f:
+        text = str(f.read(), encoding='ascii')
+    if strip_compression_extension(path).endswith('.ndjson'):
+        return [json.loads(line) for line in text.splitlines()]
+    else:
+        return json.loads(text)
+
+
+def test_split_blocks():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory, 10)
+        ranges = split_blocks(path, 4)
+        size = os.path.getsize(path)
+        assert_equals(4, len(ranges))
+        assert_equals((0, size), (ranges[0][0], ranges[-1][1]))
+        with open(path, 'rb') as f:
+            data = f.read()
+        for start, end in ranges:
+            assert_true(data[start:end].startswith(b'\n>'))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_convert_files_parallel():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory, 25)
+        sequential = convert(path, directory, 'sequential')
+        parallel = convert(path, directory, 'parallel', jobs=3, split_size=0)
+        assert_equals(25 * 6, len(sequential[0]))
+        assert_equals(25, len(sequential[1]))
+        assert_equals(sequential, parallel)
+        assert_equals(['dump.txt', 'parallel-detection.json',
+                       'parallel-system.json', 'sequential-detection.json',
+                       'sequential-system.json'],
+                      sorted(os.listdir(directory)))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_convert_files_ndjson():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory, 10)
+        sequential = convert(path, directory, 'sequential')
+        parallel = convert(path, directory, 'parallel', jobs=2, split_size=0,
+                           output_format='ndjson')
+        assert_equals(sequential, parallel)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_convert_files_gzip():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory, 10)
+        expected = convert(path, directory, 'expected')
+        with open(path, 'rb') as f:
+            data = f.read()
+        compressed_path = path + '.gz'
+        with open(compressed_path, 'wb') as f:
+            # two independent gzip members
+            f.write(gzip.compress(data[:1000]))
+            f.write(gzip.compress(data[1000:]))
+
+        for output_format in ('json', 'ndjson'):
+            extension = output_format + '.gz'
+            assert_equals(expected, convert(
+                compressed_path, directory, 'sequential', output_format,
+                extension, compression='gzip'))
+            assert_equals(expected, convert(
+                path, directory, 'parallel', output_format, extension,
+                jobs=2, split_size=0, compression='gzip'))
+            with open(os.path.join(directory, 'parallel-system.' +
+                                   extension), 'rb') as f:
+                assert_equals(b'\x1f\x8b', f.read(2))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_convert_files_npz():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory, 10)
+        detections, system = convert(path, directory, 'json')
+        for kwargs in ({}, {'jobs': 2, 'split_size': 0}):
+            conversion = (path, os.path.join(directory, 'detection.npz'),
+                          os.path.join(directory, 'system.npz'))
+            results = list(convert_files([conversion], output_format='npz',
+                                         **kwargs))
+            assert_is_none(results[0][1])
+            assert_equals(detections, load_npz(conversion[1]))
+            assert_equals(system, load_npz(conversion[2]))
+    finally:
+        shutil.rmtree(directory)
+
+
+def load_npz(path):
+    with np.load(path) as npz:
+        columns = {key: npz[key] for key in npz.files}
+    count = columns.pop('block_count')
+    base = {'deviceId': columns.pop('block_device_id'),
+            'time': columns.pop('block_time'),
+            'endTime': columns.pop('block_end_time')}
+    columns.pop('block_error')
+    # like the JSON records, record fields take precedence over block fields
+    base = {key: np.repeat(value, count) for key, value in base.items()
+            if key not in columns}
+    base.update(columns)
+    return [dict(zip(base, row))
+            for row in zip(*[c.tolist() for c in base.values()])]
+
+
+def test_convert_file_resume():
+    directory = tempfile.mkdtemp()
+    iter_records = kumbhserial.processing.iter_records
+
+    def interrupted_iter_records(*args, **kwargs):
+        for i, record in enumerate(iter_records(*args, **kwargs)):
+            if i == 27:
+                raise KeyboardInterrupt
+            yield record
+
+    try:
+        path = make_dump(directory, 10)
+        expected = convert(path, directory, 'expected')
+        for output_format, compression in (('json', None),
+                                           ('ndjson', None),
+                                           ('json', 'gzip')):
+            extension = output_format + ('.gz' if compression else '')
+            conversion = (path,
+                          os.path.join(directory, 'detection.' + extension),
+                          os.path.join(directory, 'system.' + extension))
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            kumbhserial.processing.iter_records = interrupted_iter_records
+            try:
+                convert_file(*conversion, output_format=output_format,
+                             checkpoint=checkpoint, compression=compression)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                kumbhserial.processing.iter_records = iter_records
+            state = Checkpoint(checkpoint)
+            # four complete blocks, with single digit device IDs
+            assert_equals(4 * (len(BLOCK) - 4), state.offset)
+            assert_equals(4, len(state.blocks))
+            # data written after the last checkpoint is discarded
+            with open(conversion[1], 'ab') as f:
+                f.write(b'{"incomplete":')
+
+            convert_file(*conversion, output_format=output_format,
+                         checkpoint=checkpoint, compression=compression)
+            assert_equals(expected, (load(conversion[1]),
+                                     load(conversion[2])))
+            os.remove(checkpoint)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_convert_files_checkpoint():
+    directory = tempfile.mkdtemp()
+    try:
+        path = make_dump(directory, 5, device_ids=[0, 1, 2, 1, 3])
+        checkpoint_dir = os.path.join(directory, 'checkpoints')
+        detections, system = convert(path, directory, 'checkpoint',
+                                     checkpoint_dir=checkpoint_dir)
+        # the repeated block of device 1 is skipped
+        assert_equals([0, 1, 2, 3], [s['deviceId'] for s in system])
+        assert_equals([], os.listdir(checkpoint_dir))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,133 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+from nose.tools import (assert_equals, assert_list_equal, assert_true,
+                        assert_false, assert_raises)
+
+from kumbhserial import main
+from kumbhserial.publisher import RecordPublisher, subscribe, parse_address
+
+
+def wait_for_subscribers(publisher, num_subscribers):
+    for _ in range(100):
+        if len(publisher.stats()['subscribers']) == num_subscribers:
+            return
+        time.sleep(0.01)
+    raise AssertionError('subscribers did not connect')
+
+
+def test_parse_address():
+    assert_equals((socket.AF_UNIX, '/tmp/kumbh.sock'),
+                  parse_address('/tmp/kumbh.sock'))
+    assert_equals((socket.AF_UNIX, 'kumbh.sock'),
+                  parse_address('unix:kumbh.sock'))
+    assert_equals((socket.AF_INET, ('localhost', 5000)),
+                  parse_address(':5000'))
+    assert_equals((socket.AF_INET, ('0.0.0.0', 5000)),
+                  parse_address('tcp:0.0.0.0:5000'))
+    assert_raises(ValueError, parse_address, 'localhost')
+
+
+def test_publish_unix():
+    directory = tempfile.mkdtemp()
+    address = os.path.join(directory, 'kumbh.sock')
+    publisher = RecordPublisher(address, maxsize=10)
+    payload = 'x' * 1000
+    try:
+        publisher.start()
+        # published before anyone listens
+        publisher.publish('system', {'a': 0})
+        messages = subscribe(address, timeout=5)
+        slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        slow.connect(address)
+        wait_for_subscribers(publisher, 2)
+
+        detections = publisher.channel('detection')
+        received = []
+        for i in range(1, 5000):
+            detections.append({'b': i, 'payload': payload})
+            received.append(next(messages))
+        detections.done()
+        assert_true(publisher.is_alive())
+        stats = publisher.stats()
+        publisher.done()
+        assert_false(os.path.exists(address))
+        assert_list_equal([], list(messages))
+        slow.close()
+    finally:
+        publisher.done()
+        shutil.rmtree(directory)
+
+    assert_equals({'seq': 1, 'channel': 'detection',
+                   'record': {'b': 1, 'payload': payload}}, received[0])
+    assert_list_equal(list(range(1, 5000)),
+                      [m['record']['b'] for m in received])
+    assert_equals(5000, stats['published'])
+    fast_stats, slow_stats = stats['subscribers']
+    assert_equals((4999, 0), (fast_stats['sent'], fast_stats['dropped']))
+    assert_true(slow_stats['dropped'] > 0)
+    assert_true(slow_stats['depth'] <= 10)
+
+
+def test_publish_tcp():
+    publisher = RecordPublisher('localhost:0')
+    try:
+        publisher.start()
+        host, port = publisher.address
+        messages = subscribe('{0}:{1}'.format(host, port), timeout=5)
+        wait_for_subscribers(publisher, 1)
+        publisher.publish('system', {'a': 1})
+        received = next(messages)
+    finally:
+        publisher.done()
+    assert_equals({'seq': 0, 'channel': 'system', 'record': {'a': 1}},
+                  received)
+    assert_list_equal([], list(messages))
+
+
+def test_publish_download():
+    directory = tempfile.mkdtemp()
+    address = os.path.join(directory, 'kumbh.sock')
+    publisher = RecordPublisher(address)
+    interval = main.PUBLISH_INTERVAL
+    main.PUBLISH_INTERVAL = 0
+    try:
+        publisher.start()
+        messages = subscribe(address, timeout=5)
+        wait_for_subscribers(publisher, 1)
+        appender = main.download_appender('/dev/ttyTEST', directory,
+                                          publisher=publisher)
+        appender.append(b'\n>%2016-04-23T22:59:00.0000%0\r')
+        appender.append(b'\n000001-IQL6QD0AAAAwwQMAAPVAPQ\r')
+        # received while the device is still being read
+        received = next(messages)
+        appender.append(b'\n<%2016-04-23T23:00:00.0000%0\r')
+        appender.done()
+        publisher.done()
+        assert_list_equal([], list(messages))
+    finally:
+        main.PUBLISH_INTERVAL = interval
+        publisher.done()
+        shutil.rmtree(directory)
+    assert_equals('system', received['channel'])
+    assert_equals(0, received['record']['deviceId'])
+    assert_equals(1, received['record']['line'])
@@ -0,0 +1,96 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import time
+from nose.tools import (assert_equals, assert_false, assert_list_equal,
+                        assert_true)
+
+from kumbhserial.reader import iter_records, read_file, SerialReader
+
+from helpers import ListAppender
+
+
+def write_temp(data):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_iter_records():
+    path = write_temp(b'\n>%t%1\r\n000000:abc\r\r\n<%t%1')
+    try:
+        records = [bytes(r) for r in iter_records(path)]
+    finally:
+        os.remove(path)
+    assert_list_equal([b'\n>%t%1\r', b'\n000000:abc\r', b'\r',
+                       b'\n<%t%1'], records)
+
+
+def test_iter_records_terminated():
+    path = write_temp(b'a##b##')
+    try:
+        records = [bytes(r) for r in iter_records(path, terminator=b'##')]
+    finally:
+        os.remove(path)
+    assert_list_equal([b'a##', b'b##'], records)
+
+
+def test_read_file_empty():
+    path = write_temp(b'')
+    appender = ListAppender()
+    try:
+        read_file(path, appender)
+    finally:
+        os.remove(path)
+    assert_equals([], appender.data)
+    assert_true(appender.is_done)
+
+
+def open_pty():
+    master, slave = os.openpty()
+    return master, os.ttyname(slave), slave
+
+
+def test_serial_reader():
+    master, port, slave = open_pty()
+    appender = ListAppender()
+    try:
+        reader = SerialReader(port, appender, insert_timestamp_at=(),
+                              wait_time=5)
+        reader.start()
+        os.write(master, b'\n>1\r\n000000:abc\r')
+        cpu = time.process_time()
+        time.sleep(1.5)
+        # blocked on the port, not polling
+        assert_true(time.process_time() - cpu < 0.5)
+        reader.done()
+        # read after done, until the device is idle
+        os.write(master, b'\n<1\r')
+        start = time.monotonic()
+        reader.join(6)
+        assert_true(time.monotonic() - start < 4)
+        assert_false(reader.is_alive())
+        assert_true(appender.is_done)
+        assert_equals(b'\n>1\r\n000000:abc\r\n<1\r',
+                      b''.join(appender.data))
+    finally:
+        reader.comm.close()
+        os.close(master)
+        os.close(slave)
@@ -0,0 +1,80 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import time
+from nose.tools import (assert_equals, assert_list_equal, assert_true,
+                        assert_raises)
+
+from kumbhserial.helpers import Clock
+from kumbhserial.sniffer import SnifferInterpreter, BatchSnifferInterpreter
+from kumbhserial.synthetic import sniffer_stream
+
+from helpers import ListAppender
+
+
+def without_timestamp(records):
+    return [{k: v for k, v in r.items() if k != 'timestamp'}
+            for r in records]
+
+
+def test_batch_sniffer():
+    out = io.BytesIO()
+    sniffer_stream(out, 1000)
+    lines = out.getvalue().split(b'\r')
+    lines[500:500] = [b'\n12345\r', b'\n1, 2, I\r', b'\n1, x, I, 3, 4, 5\r']
+
+    expected = ListAppender()
+    interpreter = SnifferInterpreter(expected)
+    for line in lines:
+        try:
+            interpreter.append(line)
+        except (ValueError, IndexError):
+            pass
+
+    records = ListAppender()
+    interpreter = BatchSnifferInterpreter(records, batch_size=100)
+    for line in lines:
+        interpreter.append(memoryview(line))
+    interpreter.done()
+
+    assert_true(records.is_done)
+    assert_equals(2, interpreter.num_invalid)
+    assert_equals(1001, len(records.data))
+    assert_list_equal(without_timestamp(expected.data),
+                      without_timestamp(records.data))
+    assert_equals({'rtc': 12345, 'line': 500},
+                  without_timestamp(records.data)[500])
+    assert_true(isinstance(records.data[0]['timestamp'], str))
+    assert_true(expected.data[0]['timestamp'] <=
+                records.data[0]['timestamp'])
+
+
+def test_batch_sniffer_epoch():
+    records = ListAppender()
+    interpreter = BatchSnifferInterpreter(records, timestamp_format='epoch',
+                                          clock=Clock(resolution=1))
+    before = time.time()
+    interpreter.append(b'\n1, 2, I, 3, 4, ff\r')
+    assert_list_equal([], records.data)
+    interpreter.flush()
+    assert_equals({'rtc': 1, 'time': 2, 'state': 'I', 'id': 3, 'density': 4,
+                   'auth': 255, 'line': 0},
+                  without_timestamp(records.data)[0])
+    assert_true(before <= records.data[0]['timestamp'] <= time.time())
+    assert_raises(ValueError, BatchSnifferInterpreter, records,
+                  timestamp_format='unix')
@@ -0,0 +1,139 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from nose.tools import (assert_equals, assert_false, assert_is_none,
+                        assert_true)
+
+from kumbhserial.helpers import default_clock
+from kumbhserial.spool import CHUNK_HEADER, SharedRing, capture, drain
+
+from helpers import ListAppender
+
+
+def test_ring_wrap():
+    ring = SharedRing(3 * CHUNK_HEADER.size)
+    try:
+        for i in range(20):
+            data = b'x' * (i % 7)
+            assert_true(ring.put(data, i))
+            assert_equals((i, data, 0), ring.get())
+        assert_is_none(ring.get())
+        stats = ring.stats()
+        assert_equals(sum(i % 7 for i in range(20)), stats['captured'])
+        assert_equals(stats['captured'], stats['delivered'])
+        assert_equals(0, stats['depth'])
+    finally:
+        ring.release()
+        ring.unlink()
+
+
+def test_ring_overflow():
+    ring = SharedRing(2 * CHUNK_HEADER.size + 10)
+    try:
+        assert_true(ring.put(b'abcde', 1))
+        assert_true(ring.put(b'fghij', 2))
+        assert_false(ring.put(b'k', 3))
+        assert_false(ring.put(b'lm', 4))
+        stats = ring.stats()
+        assert_equals(3, stats['lost_bytes'])
+        assert_equals(2, stats['lost_reads'])
+        assert_equals(ring.capacity, stats['max_depth'])
+        assert_equals((1, b'abcde', 0), ring.get())
+        assert_true(ring.put(b'no', 5))
+        assert_equals((2, b'fghij', 0), ring.get())
+        assert_equals((5, b'no', 3), ring.get())
+    finally:
+        ring.release()
+        ring.unlink()
+
+
+def write_records(ring):
+    data = b'\n>1\r\n000000:abcd\r\n<1\r\n'
+    for i in range(0, len(data), 4):
+        ring.put(data[i:i + 4], 0)
+    ring.close()
+
+
+def test_drain_process():
+    # a spawned process gets the ring pickled
+    context = multiprocessing.get_context('spawn')
+    ring = SharedRing(1024, context)
+    appender = ListAppender()
+    try:
+        writer = context.Process(target=write_records, args=(ring,))
+        writer.start()
+        drain(ring, appender, insert_timestamp_at=(b'>', b'<'),
+              poll_time=0.001)
+        writer.join()
+    finally:
+        ring.release()
+        ring.unlink()
+    timestamp = default_clock.timestamp_bytes(0)
+    assert_equals([b'\n>%' + timestamp + b'%1\r', b'\n000000:abcd\r',
+                   b'\n<%' + timestamp + b'%1\r', b'\n'], appender.data)
+    assert_true(appender.is_done)
+
+
+def test_capture():
+    master, slave = os.openpty()
+    # too small for all records, which still all go to the raw dump
+    ring = SharedRing(100)
+    stop = threading.Event()
+    directory = tempfile.mkdtemp()
+    dump_path = os.path.join(directory, 'dump.txt')
+    try:
+        thread = threading.Thread(target=capture,
+                                  args=(os.ttyname(slave), ring, stop),
+                                  kwargs={'wait_time': 2,
+                                          'dump_path': dump_path})
+        thread.start()
+        time.sleep(0.2)
+        os.write(master, b'\n>1\r\n000000:ab')
+        os.write(master, b'cd\r\n<1\r\n')
+        time.sleep(0.2)
+        stop.set()
+        thread.join(timeout=5)
+        assert_true(ring.closed)
+        assert_true(os.read(master, 100).startswith(b'@'))
+        records = []
+        chunk = ring.get()
+        while chunk is not None:
+            records.append(chunk[1])
+            chunk = ring.get()
+        stats = ring.stats()
+        with open(dump_path, 'rb') as f:
+            dump = f.read()
+    finally:
+        os.close(master)
+        os.close(slave)
+        ring.release()
+        ring.unlink()
+        shutil.rmtree(directory)
+    assert_equals(2, len(records))
+    assert_true(records[0].startswith(b'\n>%'))
+    assert_true(records[0].endswith(b'%1\r'))
+    assert_equals(b'\n000000:abcd\r', records[1])
+    assert_equals(2, stats['lost_reads'])
+    assert_equals(len(dump), stats['captured'] + stats['lost_bytes'])
+    assert_equals(b''.join(records), dump[:sum(len(r) for r in records)])
+    assert_true(dump.endswith(b'%1\r\n'))
@@ -0,0 +1,134 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import time
+from nose.tools import (assert_equals, assert_greater, assert_in,
+                        assert_is, assert_less, assert_true)
+
+from kumbhserial.stats import (StageStats, StatsRegistry, StatsReporter,
+                               format_prometheus, format_text, instrument,
+                               parse_destination)
+
+
+class SleepAppender(object):
+    def __init__(self, seconds, appender=None):
+        self.seconds = seconds
+        self.appender = appender
+        self.is_done = False
+
+    def append(self, data):
+        time.sleep(self.seconds)
+        if self.appender is not None:
+            self.appender.append(data)
+
+    def done(self):
+        self.is_done = True
+
+
+def test_instrument_disabled():
+    appender = SleepAppender(0)
+    assert_is(appender, instrument(appender, 'sleep'))
+
+
+def test_instrumented_chain():
+    registry = StatsRegistry()
+    inner = SleepAppender(0.02)
+    chain = instrument(
+        SleepAppender(0.01, instrument(inner, 'inner', registry)),
+        'outer', registry)
+    for _ in range(3):
+        chain.append(b'abcd')
+    chain.done()
+    # attributes of the wrapped appender are passed through
+    assert_true(chain.is_done)
+
+    snapshot = registry.snapshot()
+    outer = snapshot['stages']['outer']
+    inner = snapshot['stages']['inner']
+    assert_equals({'outer', 'inner'}, set(snapshot['stages']))
+    assert_equals(3, outer['calls'])
+    assert_equals(12, outer['bytes'])
+    assert_equals(3, inner['calls'])
+    assert_greater(outer['total_time'], inner['total_time'])
+    assert_less(outer['self_time'], inner['self_time'])
+    assert_greater(inner['p50'], 0.015)
+    assert_true(inner['p50'] <= inner['max_latency'])
+
+
+def test_stage_percentile():
+    stage = StageStats('test')
+    assert_equals(0., stage.percentile(0.5))
+    for _ in range(90):
+        stage.record(1e-4)
+    for _ in range(10):
+        stage.record(1e-1)
+    assert_less(stage.percentile(0.5), 1.2e-4)
+    assert_greater(stage.percentile(0.5), 0.9e-4)
+    assert_greater(stage.percentile(0.99), 0.08)
+    assert_equals(0.1, stage.snapshot()['max_latency'])
+
+
+def test_parse_destination():
+    assert_equals(('text', None), parse_destination('-'))
+    assert_equals(('json', 'stats.json'), parse_destination('stats.json'))
+    assert_equals(('prometheus', 'a/b.prom'), parse_destination('a/b.prom'))
+    assert_equals(('prometheus', 'metrics.txt'),
+                  parse_destination('prometheus:metrics.txt'))
+    assert_equals(('text', 'stats.log'), parse_destination('stats.log'))
+
+
+def test_formats():
+    registry = StatsRegistry()
+    registry.stage('tracker').record(0.001, size=10)
+    registry.add_source('buffer ttyUSB0', lambda: {'depth': 3,
+                                                   'subscribers': []})
+    snapshot = registry.snapshot()
+
+    text = format_text(snapshot)
+    assert_in('tracker', text)
+    assert_in('buffer ttyUSB0: depth=3', text)
+
+    lines = format_prometheus(snapshot).splitlines()
+    assert_in('# TYPE kumbhserial_stage_calls_total counter', lines)
+    assert_in('kumbhserial_stage_calls_total{stage="tracker"} 1', lines)
+    assert_in('kumbhserial_stage_bytes_total{stage="tracker"} 10', lines)
+    assert_in('kumbhserial_source_depth{source="buffer ttyUSB0"} 3', lines)
+    assert_true(any(line.startswith(
+        'kumbhserial_stage_latency_seconds{quantile="0.5",stage="tracker"}')
+        for line in lines))
+
+
+def test_reporter():
+    registry = StatsRegistry()
+    registry.stage('read').record(0.5, size=100)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'stats.json')
+        reporter = StatsReporter(registry, path, interval=0.05)
+        reporter.start()
+        time.sleep(0.2)
+        with open(path) as f:
+            assert_equals(1, json.load(f)['stages']['read']['calls'])
+        registry.stage('read').record(0.5, size=100)
+        reporter.done()
+        with open(path) as f:
+            report = json.load(f)
+        assert_equals(2, report['stages']['read']['calls'])
+        assert_equals(200, report['stages']['read']['bytes'])
+        assert_equals(['stats.json'], os.listdir(directory))
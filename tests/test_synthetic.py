@@ -0,0 +1,69 @@
+# Indo-Dutch Kumbh Mela experiment serial device reader
+#
+# Copyright 2015 Zoltan Beck, Netherlands eScience Center, and
+#                University of Amsterdam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import numpy as np
+from nose.tools import assert_equals, assert_is_none, assert_true
+
+from kumbhserial.decoder import b64decode_lines
+from kumbhserial.interpreter import TrackerInterpreter
+from kumbhserial.sniffer import SnifferInterpreter
+from kumbhserial.synthetic import (b64encode_records, detection_records,
+                                   lanyard_dump, sniffer_stream)
+
+from helpers import ListAppender
+
+
+def test_b64encode_records():
+    binary = detection_records(np.random.RandomState(1), 20)
+    decoded, valid = b64decode_lines(b64encode_records(binary))
+    assert_true(valid.all())
+    assert_true((binary == decoded).all())
+
+
+def test_lanyard_dump():
+    out = io.BytesIO()
+    size, num_records = lanyard_dump(out, 5000, num_detections=50,
+                                     num_system=5)
+    data = out.getvalue()
+    assert_equals(len(data), size)
+    assert_equals(data.count(b'\r'), num_records)
+
+    entry_sets = ListAppender()
+    interpreter = TrackerInterpreter(entry_sets)
+    for record in data.split(b'\r'):
+        interpreter.append(record)
+    interpreter.done()
+    assert_equals(num_records // 60, len(entry_sets.data))
+    for i, entry_set in enumerate(entry_sets.data):
+        entry_set.flush()
+        assert_is_none(entry_set.error)
+        assert_equals(i, entry_set.device_id)
+        assert_equals(5, len(entry_set.system_columns))
+        num_detections = len(entry_set.detection_columns)
+        assert_true(49 * 6 <= num_detections < 50 * 6)
+
+
+def test_sniffer_stream():
+    out = io.BytesIO()
+    sniffer_stream(out, 10)
+    records = ListAppender()
+    interpreter = SnifferInterpreter(records)
+    for record in out.getvalue().split(b'\r'):
+        interpreter.append(record)
+    assert_equals(10, len(records.data))
+    assert_equals(4000009, records.data[-1]['time'])